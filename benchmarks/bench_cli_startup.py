@@ -0,0 +1,72 @@
+"""
+Startup guard for main.py: runs the CLI help paths under -X importtime, reports the import cost and
+fails when a heavy dependency is imported before a subcommand runs, or the imports exceed the budget
+
+usage: python benchmarks/bench_cli_startup.py [--budget-ms 250]
+"""
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.resolve()
+
+# dependencies only the subcommands themselves may import
+HEAVY_MODULES = [
+    "pandas", "numpy", "gensim", "scipy", "nltk", "Sastrawi", "pyarrow",
+    "google.cloud.bigquery", "google.oauth2", "app_store_scraper",
+]
+COMMANDS = [
+    ["--help"],
+    ["scrap-data", "--help"],
+    ["generate-reason", "--help"],
+    ["aggregate", "--help"],
+    ["update-model", "--help"],
+    ["serve", "--help"],
+]
+
+
+def import_times(command):
+    """
+    Returns {module: cumulative microseconds} of every import of a main.py run,
+    nested imports keep the indentation importtime gives them
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "main.py", *command],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name[1:].rstrip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CLI startup benchmark')
+    parser.add_argument('--budget-ms', type=float, default=250, help='maximum total import time of a help run')
+    args = parser.parse_args()
+
+    failed = False
+    for command in COMMANDS:
+        times = import_times(command)
+        # top level entries are not indented, their cumulative times add up to the whole import cost
+        total_ms = sum(value for name, value in times.items() if not name.startswith(" ")) / 1000
+        heavy = sorted(
+            name.strip() for name in times
+            if any(name.strip() == module or name.strip().startswith(module + ".") for module in HEAVY_MODULES)
+        )
+        print("main.py {:<26} imports {:7.1f} ms".format(" ".join(command), total_ms))
+        if heavy:
+            print("  heavy modules imported: {}".format(", ".join(heavy[:10])))
+            failed = True
+        if total_ms > args.budget_ms:
+            print("  over the {:.0f} ms budget".format(args.budget_ms))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Measures the time from process launch to the first inferred document, loading the LDA model
+the legacy way (full unpickle + Dictionary.doc2bow) and through module.model_loader
+
+usage: python benchmarks/bench_model_startup.py [--runs 5]
+"""
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.resolve()
+
+LEGACY = """
+from gensim import models
+ldamodel = models.ldamodel.LdaModel.load('lda_model')
+bow = ldamodel.id2word.doc2bow(['saldo', 'buka', 'aplikasi'])
+ldamodel[bow]
+"""
+
+LOADER = """
+from module.model_loader import load_lda_model, token_lookup
+ldamodel = load_lda_model('lda_model')
+bow = token_lookup(ldamodel.id2word).doc2bow(['saldo', 'buka', 'aplikasi'])
+ldamodel[bow]
+"""
+
+
+def time_to_first_document(code, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='model startup benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='process launches per loader')
+    args = parser.parse_args()
+
+    for name, code in (("legacy", LEGACY), ("loader", LOADER)):
+        timings = time_to_first_document(code, args.runs)
+        print("{:<7} median {:.3f}s  min {:.3f}s  max {:.3f}s".format(
+            name, statistics.median(timings), min(timings), max(timings)
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Near-duplicate clustering of tokenized reviews with MinHash LSH at growing corpus sizes. The corpus mixes
+training reviews, random reviews drawn from their vocabulary and planted copies of them with a few words
+edited, like bot and copy-paste reviews. Reports the time of every stage, the share of planted copies at
+least as similar as the threshold clustered with their source (recall), the share of distinct reviews merged
+with another one and the time an exact pairwise Jaccard comparison would take, measured on a sample and
+extrapolated quadratically
+
+usage: python benchmarks/bench_near_duplicates.py [--sizes 10000 100000 1000000] [--threshold 0.8] [--copies 0.1]
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+from module.near_duplicates import NUM_PERM, minhash_signatures, lsh_bands, candidate_pairs, near_duplicate_clusters  # noqa: E402
+
+
+def synthetic_corpus(documents, size, copies, edits, seed):
+    """
+    size tokenized reviews: the training reviews, then random reviews, with a share of copies of earlier
+    reviews where edits words are replaced. Returns the reviews and the source of every review (itself when not a copy)
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(sorted({word for words in documents for word in words}), dtype=object)
+    lengths = np.array([len(words) for words in documents])
+    texts = list(documents[:size])
+    sources = list(range(len(texts)))
+    while len(texts) < size:
+        if len(texts) > 0 and rng.random() < copies:
+            source = sources[int(rng.integers(len(texts)))]
+            words = list(texts[source])
+            for position in rng.integers(0, max(1, len(words)), size=edits * len(words) // 10):
+                words[position] = vocabulary[rng.integers(len(vocabulary))]
+        else:
+            source = len(texts)
+            words = list(vocabulary[rng.integers(0, len(vocabulary), size=max(3, rng.choice(lengths)))])
+        texts.append(words)
+        sources.append(source)
+    return texts, np.array(sources)
+
+
+def shingle_set(words):
+    return set(zip(words, words[1:])) or {tuple(words)}
+
+
+def exact_jaccard(texts, first, second):
+    return np.array([
+        len(shingle_set(texts[i]) & shingle_set(texts[j])) / len(shingle_set(texts[i]) | shingle_set(texts[j]))
+        for i, j in zip(first, second)
+    ])
+
+
+def exact_jaccard_seconds(texts, sample):
+    """
+    Seconds to compare every pair of sample reviews by their exact shingle Jaccard similarity
+    """
+    shingles = [shingle_set(words) for words in texts[:sample]]
+    start = time.perf_counter()
+    for i in range(len(shingles)):
+        for j in range(i + 1, len(shingles)):
+            len(shingles[i] & shingles[j]) / (len(shingles[i] | shingles[j]) or 1)
+    return time.perf_counter() - start
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='near-duplicate clustering benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='corpus sizes to benchmark')
+    parser.add_argument('--threshold', type=float, default=0.8, help='similarity threshold of the clusters')
+    parser.add_argument('--copies', type=float, default=0.1, help='share of planted near-duplicate copies')
+    parser.add_argument('--edits', type=int, default=1, help='words edited per ten words of a copy')
+    parser.add_argument('--exact-sample', type=int, default=2000, help='reviews compared pairwise to time the exact baseline')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic corpus')
+    args = parser.parse_args()
+
+    reviews = pd.read_csv(ROOT / 'training' / 'jom_review_all_result.csv')['review'].dropna()
+    documents = [text.lower().split() for text in reviews]
+    bands, rows = lsh_bands(args.threshold)
+    print("threshold {}, {} permutations in {} bands of {} rows".format(args.threshold, NUM_PERM, bands, rows))
+
+    print("{:>9} {:>10} {:>8} {:>8} {:>8} {:>9} {:>8} {:>9} {:>12}".format(
+        "reviews", "clusters", "minhash", "lsh", "total", "reviews/s", "recall", "false", "exact (est)"
+    ))
+    for size in args.sizes:
+        texts, sources = synthetic_corpus(documents, size, args.copies, args.edits, args.seed)
+        signatures, minhash_seconds = timed(minhash_signatures, texts)
+        _, lsh_seconds = timed(candidate_pairs, signatures, bands, rows)
+        clusters, seconds = timed(near_duplicate_clusters, texts, args.threshold)
+        copies = np.flatnonzero(sources != np.arange(size))
+        # distinct reviews, neither a copy nor copied, merged with any other review
+        distinct = np.setdiff1d(np.flatnonzero(sources == np.arange(size)), sources[copies])
+        copies = copies[exact_jaccard(texts, copies, sources[copies]) >= args.threshold]
+        recall = (clusters[copies] == clusters[sources[copies]]).mean() if len(copies) else 1.0
+        merged = np.bincount(clusters, minlength=size)[clusters[distinct]] > 1
+        sample = min(size, args.exact_sample)
+        exact = exact_jaccard_seconds(texts, sample) * (size / sample) ** 2
+        print("{:>9} {:>10} {:>8.2f} {:>8.2f} {:>8.2f} {:>9.0f} {:>8.3f} {:>9.4f} {:>11.0f}s".format(
+            size, len(np.unique(clusters)), minhash_seconds, lsh_seconds, seconds, size / seconds,
+            recall, merged.mean(), exact
+        ))
+
+
+if __name__ == "__main__":
+    main()
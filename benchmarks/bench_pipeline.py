@@ -0,0 +1,245 @@
+"""
+Offline benchmark of the reason generation pipeline. The training CSVs are replayed, synthetically
+scaled, through NegReasonGeneration.generate_reason with BigQuery swapped for a local stub, one
+scraping job per batch. Reports per stage throughput, batch latency percentiles and peak RSS,
+and compares against a saved baseline
+
+usage: python benchmarks/bench_pipeline.py [--scales 10 100 1000] [--batch-size 5000] [--save-baseline]
+
+The committed baselines/bench_pipeline.json was generated with
+    python benchmarks/bench_pipeline.py --scales 10 100 --save-baseline
+and records that command and its environment, regenerate it on the machine the comparisons run on
+
+Scaled copies shuffle the word order of every review with a fixed seed, the vocabulary stays that
+of the training data. At 1000x (about 4.3M negative reviews) a run takes around half an hour on a single core
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+# the pipeline config is read from the environment at import, point it at the shipped model
+os.environ.setdefault("MODEL_LDA", str(ROOT / "lda_model"))
+os.environ.setdefault("REASON_MAP", "model/topic_data.json")
+os.environ.setdefault("BQ_DB", "benchmark")
+for table in ["APP_STORE_SCRAPING_TABLE", "APP_STORE_LOG_TABLE", "APP_STORE_NEG_REASON_RESULT_TABLE", "APP_STORE_TOPIC_LOG_TABLE"]:
+    os.environ.setdefault(table, table.lower())
+os.environ.pop("APP_STORE_METRICS_TABLE", None)
+from module.as_config import BQ_CONFIG, APP_STORE_TOPIC_KEYWORD_TABLE  # noqa: E402
+from module.profiling import RunProfiler, current_rss_mb  # noqa: E402
+from module.reason_generation import NegReasonGeneration  # noqa: E402
+from module.sink import make_sink  # noqa: E402
+
+TRAINING_FILES = ["jom_review_all_result.csv", "jmo_topic.csv"]
+SCRAPED_COLUMNS = ["date", "review", "rating", "userName", "title"]
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baselines" / "bench_pipeline.json"
+PERCENTILES = [50, 95, 99]
+
+
+def load_training_reviews():
+    """
+    Negative reviews of the training CSVs in the scraping table layout, as the generate-reason query selects them
+    """
+    frames = [pd.read_csv(ROOT / "training" / name, usecols=SCRAPED_COLUMNS) for name in TRAINING_FILES]
+    reviews = pd.concat(frames, ignore_index=True).drop_duplicates(subset=["userName", "date", "title"])
+    return reviews[reviews["rating"] <= 2].reset_index(drop=True)
+
+
+def scaled_batches(base, scale, batch_size, seed):
+    """
+    Yields scale copies of the base reviews in batches of batch_size, every copy after the first
+    with the word order of each review shuffled. Nothing beyond one batch is kept in memory
+    """
+    rng = np.random.default_rng(seed)
+    pending, pending_rows = [], 0
+    for copy in range(scale):
+        frame = base.copy()
+        if copy:
+            frame["review"] = [
+                text if not isinstance(text, str) else " ".join(rng.permutation(text.split()))
+                for text in frame["review"]
+            ]
+        offset = 0
+        while offset < len(frame):
+            take = min(batch_size - pending_rows, len(frame) - offset)
+            pending.append(frame.iloc[offset:offset + take])
+            pending_rows += take
+            offset += take
+            if pending_rows == batch_size:
+                yield pd.concat(pending, ignore_index=True)
+                pending, pending_rows = [], 0
+    if pending:
+        yield pd.concat(pending, ignore_index=True)
+
+
+class LocalBigQuery(object):
+    def __init__(self):
+        """
+        Stand-in for BQConnection: the log query returns the current job, the scraping table query
+        returns the current batch and loads of the staged files only count the rows, the keyword index
+        query returns the model versions of the keyword files loaded so far
+        """
+        self.batch = None
+        self.job_id = None
+        self.loaded = {}
+        self.model_versions = set()
+
+    def serve(self, job_id, batch):
+        self.job_id = job_id
+        self.batch = batch.assign(job_id=job_id)
+
+    def read_bq_arrow(self, query, cred, project, job_config=None):
+        if "job_id = " in query:
+            return pa.Table.from_pandas(self.batch, preserve_index=False)
+        if "DISTINCT model_version" in query:
+            return pa.table({"model_version": pa.array(sorted(self.model_versions), pa.string())})
+        return pa.Table.from_pandas(pd.DataFrame({"job_id": [self.job_id], "created_at": [pd.Timestamp.now()]}))
+
+    def table_columns(self, table_id, cred, project):
+        return list(self.batch.columns)
+
+    def load_files(self, loads, cred, project, on_loaded=None):
+        for index, (path, table_id, _) in enumerate(loads):
+            self.loaded[table_id] = self.loaded.get(table_id, 0) + pq.read_metadata(path).num_rows
+            if table_id.endswith("." + str(APP_STORE_TOPIC_KEYWORD_TABLE)):
+                self.model_versions.update(pq.read_table(path, columns=["model_version"])["model_version"].to_pylist())
+            if on_loaded is not None:
+                on_loaded(index)
+
+    def latency_summary(self):
+        return {}
+
+
+def percentiles(values):
+    return {"p{}".format(q): round(float(np.percentile(values, q)), 4) for q in PERCENTILES}
+
+
+def run_scale(base, scale, batch_size, workers, seed, sink_root):
+    """
+    Runs generate_reason once per batch and aggregates the stage stats of every run
+    """
+    BQ_CONFIG["CRED"] = None
+    reason = NegReasonGeneration(token_cache=None)
+    reason.bq = LocalBigQuery()
+    reason.sink = make_sink("bigquery", sink_root, reason.bq, BQ_CONFIG)
+    runs = []
+    reason.finish_run = lambda: runs.append(reason.profiler.stage_summary())
+    batches = 0
+    start = time.perf_counter()
+    for batch in scaled_batches(base, scale, batch_size, seed):
+        reason.profiler = RunProfiler("bench-pipeline")
+        reason.bq.serve("bench-{}-{}".format(scale, batches), batch)
+        run_start, run_rss = time.perf_counter(), current_rss_mb()
+        reason.generate_reason(workers=workers)
+        peak_rss = max(stats["peak_rss_mb"] for stats in runs[-1].values())
+        runs[-1]["end_to_end"] = {
+            "seconds": time.perf_counter() - run_start,
+            "calls": 1,
+            "rows": len(batch),
+            "peak_rss_mb": peak_rss,
+            "rss_growth_mb": round(max(0.0, peak_rss - run_rss), 1),
+        }
+        batches += 1
+    elapsed = time.perf_counter() - start
+
+    stages = {}
+    for name in runs[0]:
+        seconds = [run[name]["seconds"] for run in runs if name in run]
+        rows = sum(run[name]["rows"] for run in runs if name in run)
+        stages[name] = {
+            "rows": rows,
+            "seconds": round(sum(seconds), 4),
+            "rows_per_second": round(rows / sum(seconds), 1) if sum(seconds) else None,
+            "batch_latency": percentiles(seconds),
+            "peak_rss_mb": max(run[name]["peak_rss_mb"] for run in runs if name in run),
+            "rss_growth_mb": max(run[name]["rss_growth_mb"] for run in runs if name in run),
+        }
+    return {
+        "reviews": len(base) * scale,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "loaded_rows": reason.bq.loaded,
+        "stages": stages,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def print_scale(scale, result, baseline=None):
+    print("\n{}x: {} reviews in {} batches, {:.1f}s".format(scale, result["reviews"], result["batches"], result["seconds"]))
+    print("{:<20} {:>12} {:>10} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        "stage", "rows/s", "p50 (s)", "p95 (s)", "p99 (s)", "rss (MB)", "growth (MB)", "vs base"
+    ))
+    for name, stage in result["stages"].items():
+        change = ""
+        base_stage = (baseline or {}).get("stages", {}).get(name)
+        if base_stage and base_stage["rows_per_second"] and stage["rows_per_second"]:
+            change = "{:+.1f}%".format(100 * (stage["rows_per_second"] / base_stage["rows_per_second"] - 1))
+        latency = stage["batch_latency"]
+        print("{:<20} {:>12} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.1f} {:>12.1f} {:>10}".format(
+            name, stage["rows_per_second"], latency["p50"], latency["p95"], latency["p99"], stage["peak_rss_mb"],
+            stage.get("rss_growth_mb", 0.0), change
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline reason generation pipeline benchmark")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000], help="multiples of the training reviews to replay")
+    parser.add_argument("--batch-size", type=int, default=5000, help="reviews per scraping job")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of generate_reason")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic copies")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    base = load_training_reviews()
+    command = " ".join(["python", os.path.relpath(__file__, ROOT)] + sys.argv[1:])
+    results = {"command": command, "environment": environment(), "batch_size": args.batch_size, "workers": args.workers, "scales": {}}
+    print("{} negative training reviews, batch size {}, {} worker(s)".format(len(base), args.batch_size, args.workers))
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as sink_root:
+            result = run_scale(base, scale, args.batch_size, args.workers, args.seed, sink_root)
+        results["scales"][str(scale)] = result
+        print_scale(scale, result, baseline.get("scales", {}).get(str(scale)))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print("\nbaseline saved to {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
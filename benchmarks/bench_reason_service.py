@@ -0,0 +1,100 @@
+"""
+Load test of the reason classification service. Sends single-review requests from concurrent
+keep-alive clients and reports requests per second and latency percentiles. Without --url an
+in-process service is started on a free port with the shipped model
+
+usage: python benchmarks/bench_reason_service.py [--url http://host:8080] [--requests 2000] [--concurrency 1 8 32]
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+
+
+def start_local_service(max_batch_size, max_wait):
+    from module.reason_service import ReasonClassifier, make_server
+
+    classifier = ReasonClassifier(str(ROOT / "lda_model"), ROOT / "model" / "topic_data.json")
+    server = make_server("127.0.0.1", 0, classifier, max_batch_size, max_wait)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def client(url, reviews, latencies, errors):
+    """
+    Posts every review on one keep-alive connection and records the latency of each request
+    """
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+    for review in reviews:
+        body = json.dumps({"review": review})
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/classify", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(review)
+    conn.close()
+
+
+def load_test(url, reviews, concurrency):
+    latencies, errors = [], []
+    shares = [reviews[i::concurrency] for i in range(concurrency)]
+    threads = [threading.Thread(target=client, args=(url, share, latencies, errors)) for share in shares]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": 1000 * np.percentile(latencies, 50),
+        "p99_ms": 1000 * np.percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="reason classification service load test")
+    parser.add_argument("--url", help="base url of a running service, an in-process one is started otherwise")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="concurrent clients")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="micro-batch size of the in-process service")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="micro-batch wait of the in-process service")
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        server, url = start_local_service(args.max_batch_size, args.max_wait_ms / 1000)
+    reviews = pd.read_csv(ROOT / "training" / "jom_review_all_result.csv")["review"].dropna().tolist()
+    reviews = (reviews * (args.requests // len(reviews) + 1))[:args.requests]
+
+    # warm the stemmer cache and the connection path before measuring
+    load_test(url, reviews[:50], 1)
+    print("{:>11} {:>9} {:>7} {:>10} {:>10}".format("concurrency", "req/s", "errors", "p50 (ms)", "p99 (ms)"))
+    for concurrency in args.concurrency:
+        result = load_test(url, reviews, concurrency)
+        print("{:>11} {:>9.1f} {:>7} {:>10.2f} {:>10.2f}".format(
+            concurrency, result["rps"], result["errors"], result["p50_ms"], result["p99_ms"]
+        ))
+
+
+if __name__ == "__main__":
+    main()
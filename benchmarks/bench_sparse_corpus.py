@@ -0,0 +1,76 @@
+"""
+Compares the bag-of-words list corpus against the CSR document-term matrix on corpora built from
+the training reviews: build time, memory per document and topic inference time, and checks both
+produce identical topic distributions
+
+usage: python benchmarks/bench_sparse_corpus.py [--sizes 10000 100000]
+"""
+import sys
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from gensim import models
+from nltk.tokenize import RegexpTokenizer
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+from module.model_loader import token_lookup  # noqa: E402
+from module.text_normalizer import TextNormalizer  # noqa: E402
+from module.topic_inference import infer_topic_distribution  # noqa: E402
+
+
+def built(func, texts):
+    """
+    Builds a corpus and returns it with the build time and the bytes it holds once built
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    corpus = func(texts)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return corpus, elapsed, size
+
+
+def timed(ldamodel, initial_state, corpus):
+    ldamodel.random_state.set_state(initial_state)
+    start = time.perf_counter()
+    result = infer_topic_distribution(ldamodel, corpus)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sparse corpus benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='corpus sizes to benchmark')
+    args = parser.parse_args()
+
+    ldamodel = models.ldamodel.LdaModel.load(str(ROOT / 'lda_model'))
+    initial_state = ldamodel.random_state.get_state()
+    lookup = token_lookup(ldamodel.id2word)
+
+    reviews = pd.read_csv(ROOT / 'training' / 'jom_review_all_result.csv')['review'].dropna()
+    tokenizer = RegexpTokenizer(r'\w+')
+    base_texts = [tokenizer.tokenize(text) for text in TextNormalizer().normalize(reviews)]
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9}".format(
+        "docs", "bow B/doc", "csr B/doc", "bow (s)", "csr (s)", "bow inf", "csr inf", "speedup"
+    ))
+    for size in args.sizes:
+        texts = (base_texts * (size // len(base_texts) + 1))[:size]
+        bows, bow_build, bow_bytes = built(lambda texts: [lookup.doc2bow(text) for text in texts], texts)
+        csr, csr_build, csr_bytes = built(lookup.doc2csr, texts)
+        expected, bow_time = timed(ldamodel, initial_state, bows)
+        result, csr_time = timed(ldamodel, initial_state, csr)
+        assert np.array_equal(result, expected), "CSR inference output differs from the bag-of-words corpus"
+        print("{:>8} {:>10.1f} {:>10.1f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>8.1f}x".format(
+            size, bow_bytes / size, csr_bytes / size, bow_build, csr_build, bow_time, csr_time,
+            (bow_build + bow_time) / (csr_build + csr_time)
+        ))
+        del bows, csr
+
+
+if __name__ == "__main__":
+    main()
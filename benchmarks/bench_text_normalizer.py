@@ -0,0 +1,94 @@
+"""
+Compares the legacy per-row typo conversion and cleansing against the batch TextNormalizer
+on the training reviews, and checks both produce identical output. The batch normalizer is timed
+cold (empty stem cache, as in a fresh process) and warm (every word already stemmed); the cold time
+is split into the Sastrawi stemming of the distinct words and the rest of the pipeline
+
+usage: python benchmarks/bench_text_normalizer.py [--scale 10]
+"""
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+import pandas as pd
+from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
+from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+from module.text_normalizer import TextNormalizer, TYPO_INDO  # noqa: E402
+
+
+def legacy_pipeline(reviews):
+    """
+    Per-row pipeline as it ran before the batch normalizer, typo table rebuilt on every call
+    """
+    stopword = StopWordRemoverFactory().create_stop_word_remover()
+    stemmer = StemmerFactory().create_stemmer()
+
+    def convert_typo(text):
+        typo_indo = dict(TYPO_INDO)
+        words = text.split()
+        for i, word in enumerate(words):
+            if word.lower() in typo_indo:
+                words[i] = typo_indo[word.lower()]
+        return ' '.join(words)
+
+    def clean_review(review):
+        review = review.lower()
+        review = re.sub(r'[^a-zA-Z]', ' ', review)
+        review = re.sub(r'\s\s+', ' ', review)
+        review = stopword.remove(review)
+        review = stemmer.stem(review)
+        return review
+
+    return reviews.apply(convert_typo).apply(clean_review)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='text normalizer benchmark')
+    parser.add_argument('--scale', type=int, default=10, help='times to replicate the training reviews')
+    args = parser.parse_args()
+
+    reviews = pd.read_csv(ROOT / 'training' / 'jom_review_all_result.csv')['review']
+    reviews = pd.concat([reviews] * args.scale, ignore_index=True)
+
+    start = time.perf_counter()
+    expected = legacy_pipeline(reviews)
+    legacy_time = time.perf_counter() - start
+
+    normalizer = TextNormalizer()
+    stem_word, stem_seconds = normalizer.stem_word, [0.0]
+
+    def timed_stem_word(word):
+        start = time.perf_counter()
+        stem = stem_word(word)
+        stem_seconds[0] += time.perf_counter() - start
+        return stem
+
+    timed_stem_word.cache_info = stem_word.cache_info
+    # every distinct word of the batch is looked up once, timing the lookups isolates the stemming
+    normalizer.stem_word = timed_stem_word
+    start = time.perf_counter()
+    result = normalizer.normalize(reviews)
+    batch_time = time.perf_counter() - start
+    misses = stem_word.cache_info().misses
+
+    start = time.perf_counter()
+    normalizer.normalize(reviews)
+    warm_time = time.perf_counter() - start
+
+    assert result.equals(expected), "batch normalizer output differs from the legacy pipeline"
+    print("reviews: {}".format(len(reviews)))
+    print("legacy : {:.3f}s ({:.0f} reviews/s)".format(legacy_time, len(reviews) / legacy_time))
+    print("batch  : {:.3f}s ({:.0f} reviews/s), cold stem cache".format(batch_time, len(reviews) / batch_time))
+    print("  stemming {} distinct words: {:.3f}s, rest of the pipeline: {:.3f}s".format(
+        misses, stem_seconds[0], batch_time - stem_seconds[0]
+    ))
+    print("warm   : {:.3f}s ({:.0f} reviews/s), every word cached".format(warm_time, len(reviews) / warm_time))
+    print("speedup: {:.1f}x cold, {:.1f}x warm".format(legacy_time / batch_time, legacy_time / warm_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the row-by-row format_topics_sentences against the batched dominant topic inference
+on corpora built from the training reviews, and checks both produce identical output
+
+usage: python benchmarks/bench_topic_inference.py [--sizes 1000 10000 100000]
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import pandas as pd
+from gensim import models
+from nltk.tokenize import RegexpTokenizer
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+from module.text_normalizer import TextNormalizer  # noqa: E402
+from module.topic_inference import dominant_topics_frame  # noqa: E402
+
+
+def legacy_format_topics_sentences(ldamodel, corpus, mapping_dict):
+    """
+    Row-by-row implementation as it ran before the batched inference
+    """
+    sent_topics_df = pd.DataFrame()
+    for i, row_list in enumerate(ldamodel[corpus]):
+        row = row_list[0] if ldamodel.per_word_topics else row_list
+        row = sorted(row, key=lambda x: (x[1]), reverse=True)
+        for j, (topic_num, prop_topic) in enumerate(row):
+            if j == 0:
+                topic_num = str(topic_num)
+                if topic_num in mapping_dict.keys():
+                    value = mapping_dict[topic_num]
+                else:
+                    value = "not found"
+                sent_topics_df = sent_topics_df._append(pd.Series([int(topic_num), round(prop_topic,4), value]), ignore_index=True)
+            else:
+                break
+    sent_topics_df.columns = ['Topic_Class', 'Perc_Contribution', 'Reason']
+    return sent_topics_df
+
+
+def timed(func, ldamodel, initial_state, *args):
+    ldamodel.random_state.set_state(initial_state)
+    start = time.perf_counter()
+    result = func(ldamodel, *args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='dominant topic inference benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='corpus sizes to benchmark')
+    args = parser.parse_args()
+
+    ldamodel = models.ldamodel.LdaModel.load(str(ROOT / 'lda_model'))
+    initial_state = ldamodel.random_state.get_state()
+    with open(ROOT / 'model' / 'topic_data.json', 'r') as json_file:
+        mapping_dict = json.load(json_file)
+
+    reviews = pd.read_csv(ROOT / 'training' / 'jom_review_all_result.csv')['review'].dropna()
+    tokenizer = RegexpTokenizer(r'\w+')
+    processed = TextNormalizer().normalize(reviews)
+    base_corpus = [ldamodel.id2word.doc2bow(tokenizer.tokenize(text)) for text in processed]
+
+    print("{:>8} {:>12} {:>12} {:>9}".format("docs", "legacy (s)", "batch (s)", "speedup"))
+    for size in args.sizes:
+        corpus = (base_corpus * (size // len(base_corpus) + 1))[:size]
+        expected, legacy_time = timed(legacy_format_topics_sentences, ldamodel, initial_state, corpus, mapping_dict)
+        result, batch_time = timed(dominant_topics_frame, ldamodel, initial_state, corpus, mapping_dict)
+        assert result.equals(expected), "batched inference output differs from format_topics_sentences"
+        print("{:>8} {:>12.3f} {:>12.3f} {:>8.1f}x".format(size, legacy_time, batch_time, legacy_time / batch_time))
+
+
+if __name__ == "__main__":
+    main()
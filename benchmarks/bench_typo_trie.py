@@ -0,0 +1,110 @@
+"""
+Compares typo and slang conversion with the phrase trie against dict lookups as the typo table grows,
+on the training reviews. Tables beyond the shipped one are synthetic: words and phrases of two and
+three words sampled from the reviews, mapped to random words. Checks every method produces identical output
+
+usage: python benchmarks/bench_typo_trie.py [--sizes 1000 5000 20000] [--phrases 0.3] [--scale 10]
+"""
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+import pandas as pd
+
+ROOT = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+from module.text_normalizer import PhraseTrie, TYPO_INDO  # noqa: E402
+
+
+def dict_loop(table, documents):
+    """
+    Per-word dict lookup as convert_typo ran before the trie, phrases of the table never match
+    """
+    typo_map = {key.lower(): value for key, value in table.items()}
+    return [' '.join([typo_map.get(word.lower(), word) for word in words]) for words in documents]
+
+
+def ngram_dict_loop(table, documents):
+    """
+    Dict lookups extended to phrases: at every word, the n-grams are looked up from the longest phrase length down
+    """
+    typo_map = {' '.join(key.lower().split()): value for key, value in table.items()}
+    max_length = max(len(key.split()) for key in typo_map)
+    output = []
+    for words in documents:
+        lowered = [word.lower() for word in words]
+        converted = []
+        i = 0
+        while i < len(words):
+            for length in range(min(max_length, len(words) - i), 0, -1):
+                replacement = typo_map.get(' '.join(lowered[i:i + length]))
+                if replacement is not None:
+                    converted.append(replacement)
+                    i += length
+                    break
+            else:
+                converted.append(words[i])
+                i += 1
+        output.append(' '.join(converted))
+    return output
+
+
+def trie_loop(table, documents):
+    trie = PhraseTrie(table)
+    return [trie.replace(words) for words in documents]
+
+
+def synthetic_table(documents, size, phrase_share, seed):
+    """
+    The shipped table grown to size entries, phrase_share of the added entries being phrases found in the reviews
+    """
+    rng = random.Random(seed)
+    vocabulary = sorted({word.lower() for words in documents for word in words})
+    phrases = sorted({
+        ' '.join(words[i:i + length]).lower()
+        for words in documents for length in (2, 3) for i in range(len(words) - length + 1)
+    })
+    table = dict(TYPO_INDO)
+    added_phrases = min(len(phrases), int((size - len(table)) * phrase_share))
+    for phrase in rng.sample(phrases, added_phrases):
+        table[phrase] = rng.choice(vocabulary)
+    words = [word for word in vocabulary if word not in table]
+    for word in rng.sample(words, min(len(words), max(0, size - len(table)))):
+        table[word] = rng.choice(vocabulary)
+    return table
+
+
+def timed(func, table, documents):
+    start = time.perf_counter()
+    result = func(table, documents)
+    return result, len(documents) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='typo phrase trie benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000], help='typo table sizes to benchmark')
+    parser.add_argument('--phrases', type=float, default=0.3, help='share of phrases among the synthetic entries')
+    parser.add_argument('--scale', type=int, default=10, help='times to replicate the training reviews')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic tables')
+    args = parser.parse_args()
+
+    reviews = pd.read_csv(ROOT / 'training' / 'jom_review_all_result.csv')['review'].dropna()
+    documents = [text.split() for text in reviews] * args.scale
+
+    print("{:>8} {:>8} {:>12} {:>12} {:>12}".format("entries", "phrases", "dict (r/s)", "n-gram (r/s)", "trie (r/s)"))
+    for size in [len(TYPO_INDO)] + args.sizes:
+        table = synthetic_table(documents, size, args.phrases, args.seed) if size > len(TYPO_INDO) else dict(TYPO_INDO)
+        expected, dict_rate = timed(dict_loop, table, documents)
+        ngram, ngram_rate = timed(ngram_dict_loop, table, documents)
+        result, trie_rate = timed(trie_loop, table, documents)
+        assert result == ngram, "trie output differs from the n-gram lookups"
+        if all(len(key.split()) == 1 for key in table):
+            assert result == expected, "trie output differs from the dict loop"
+        print("{:>8} {:>8} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+            len(table), sum(len(key.split()) > 1 for key in table), dict_rate, ngram_rate, trie_rate
+        ))
+
+
+if __name__ == "__main__":
+    main()
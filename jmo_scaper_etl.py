@@ -24,7 +24,7 @@ one_week_ago = (today - timedelta(days=7)).date()
 
 scrap_data = KubernetesPodOperator(
             image="localhost:5001/jmo_review:v1",
-            arguments=["scrap-data", "--date={}".format(one_week_ago)],
+            arguments=["scrap-data", "--date={}".format(one_week_ago), "--incremental"],
             kubernetes_conn_id = "k8s_conn",
             cluster_context="docker-desktop",
             name=f"scrap_data",
@@ -47,5 +47,17 @@ generate_reason = KubernetesPodOperator(
             dag=dag,
         )
 
+aggregate = KubernetesPodOperator(
+            image="localhost:5001/jmo_review:v1",
+            arguments=["aggregate"],
+            name=f"aggregate",
+            task_id=f"aggregate",
+            kubernetes_conn_id = "k8s_conn",
+            cluster_context="docker-desktop",
+            retries=5,
+            retry_delay=timedelta(minutes=5),
+            dag=dag,
+        )
+
 
-scrap_data >> generate_reason
\ No newline at end of file
+scrap_data >> generate_reason >> aggregate
\ No newline at end of file
@@ -1,8 +1,6 @@
 import argparse
 import logging
-from module.appstore import APPStoreScraper
-from module.reason_generation import NegReasonGeneration
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 
 service_logger = logging.getLogger(__name__)
@@ -23,37 +21,133 @@ class JMOProcessor:
         # ingest data
         ingest = subparsers.add_parser('scrap-data', help='scrap data from app store and ingest to bigquery')
         ingest.add_argument('--date', help='filter after the date', required=False)
+        ingest.add_argument('--incremental', action='store_true', help='only scrape reviews newer than the persisted watermark and skip already loaded reviews')
+        ingest.add_argument('--batch-size', type=int, default=500, help='number of reviews per staged part file, the pagination is checkpointed with every part')
+        ingest.add_argument('--target', action='append', default=[], help='app_name:country:app_id to scrape, repeat for several targets (default SCRAP_TARGETS)')
+        ingest.add_argument('--concurrency', type=int, default=4, help='number of targets scraped at the same time')
+        ingest.add_argument('--app-store-url', help='base url of an App Store stand-in, for local testing', required=False)
+        ingest.add_argument('--request-timeout', type=float, default=30, help='seconds before an App Store request is retried')
+        ingest.add_argument('--sink', choices=['bigquery', 'local'], default='bigquery', help='load to bigquery from the local parquet files, or only write the files (SINK_PATH)')
+        ingest.add_argument('--profile', help='write cProfile stats of the run to this path', required=False)
         ingest.set_defaults(func=self.scrap_data)
 
         # load data
         load = subparsers.add_parser('generate-reason', help='load reason data to bigquery')
+        load.add_argument('--workers', type=int, default=1, help='number of worker processes used to score the reviews')
+        load.add_argument('--token-cache', help='path of the on-disk token cache (default TOKEN_CACHE_PATH)', required=False)
+        load.add_argument('--model-registry', help='JSON registry of the models scored side by side (default MODEL_REGISTRY)', required=False)
+        load.add_argument('--dedup-threshold', type=float, help='infer near-duplicate reviews above this shingle similarity once (default DEDUP_THRESHOLD)', required=False)
+        load.add_argument('--from', dest='window_start', help='score the reviews of every job created from this UTC date or time instead of the latest job', required=False)
+        load.add_argument('--to', dest='window_end', help='end (exclusive) of the --from window, now when unset', required=False)
+        load.add_argument('--batch-size', type=int, default=20000, help='number of reviews scored and flushed at a time with --from')
+        load.add_argument('--sink', choices=['bigquery', 'local'], default='bigquery', help='read from and load to bigquery, or use the local parquet files only (SINK_PATH)')
+        load.add_argument('--profile', help='write cProfile stats of the run to this path', required=False)
         load.set_defaults(func=self.generate_reason)
 
+        # dashboard rollups
+        aggregate = subparsers.add_parser('aggregate', help='update the daily and weekly dashboard rollups with the jobs loaded since the last run')
+        aggregate.add_argument('--full', action='store_true', help='rebuild every rollup partition instead of those touched since the last run')
+        aggregate.add_argument('--sink', choices=['bigquery', 'local'], default='bigquery', help='read from and load to bigquery, or use the local parquet files only (SINK_PATH)')
+        aggregate.add_argument('--profile', help='write cProfile stats of the run to this path', required=False)
+        aggregate.set_defaults(func=self.aggregate)
+
+        # online model update
+        update = subparsers.add_parser('update-model', help='fold the newly scraped negative reviews into the LDA model and write it as a new version')
+        update.add_argument('--from', dest='window_start', help='UTC date or time of the first scraping job to fold in (default end of the previous update of --model)', required=False)
+        update.add_argument('--to', dest='window_end', help='end (exclusive) of the window, now when unset', required=False)
+        update.add_argument('--model', help='path of the model to update, relative to the repository root like MODEL_LDA (default MODEL_LDA)', required=False)
+        update.add_argument('--version', help='version of the new model, written next to it as <model>_<version> (default the current time)', required=False)
+        update.add_argument('--workers', type=int, default=1, help='number of worker processes of the multicore LDA update')
+        update.add_argument('--batch-size', type=int, default=20000, help='number of reviews read and folded in at a time')
+        update.add_argument('--model-registry', help='JSON registry the new version is added to, for shadow scoring (default MODEL_REGISTRY)', required=False)
+        update.add_argument('--sink', choices=['bigquery', 'local'], default='bigquery', help='read the reviews from bigquery, or from the local parquet files only (SINK_PATH)')
+        update.add_argument('--profile', help='write cProfile stats of the run to this path', required=False)
+        update.set_defaults(func=self.update_model)
+
+        # online reason classification
+        serve = subparsers.add_parser('serve', help='serve reason classification of single reviews over HTTP')
+        serve.add_argument('--host', default='0.0.0.0', help='address to listen on')
+        serve.add_argument('--port', type=int, default=8080, help='port to listen on')
+        serve.add_argument('--max-batch-size', type=int, default=64, help='maximum number of reviews inferred together')
+        serve.add_argument('--max-wait-ms', type=float, default=5, help='milliseconds a review waits for others to join its batch')
+        serve.set_defaults(func=self.serve)
+
         # Parse the args
         return parser
 
     def scrap_data(self, args=None):
+        # heavy dependencies are imported only by the subcommand that needs them
+        from module.appstore import APPStoreScraper
+        from module.as_config import SCRAP_TARGETS
+        from module.scheduler import parse_targets
+
         print("Data scrapping started")
-        try:
-            if args.date:
+        targets = parse_targets(args.target or SCRAP_TARGETS)
+        if args.date:
+            try:
                 date_obj = datetime.strptime(args.date, '%Y-%m-%d').date()
-            else:
-                # Get today's date
-                today = datetime.today()
-                # Calculate a week ago
-                date_obj = (today - timedelta(days=7)).date()
-            
-            jmo = APPStoreScraper(date_obj)
-            jmo.scrape_data()
-        except ValueError:
-            logging.ERROR("Invalid date format. Please provide date in YYYY-MM-DD format.")
+            except ValueError:
+                logging.error("Invalid date format. Please provide date in YYYY-MM-DD format.")
+                return
+        else:
+            # Get today's date
+            today = datetime.today()
+            # Calculate a week ago
+            date_obj = (today - timedelta(days=7)).date()
+
+        jmo = APPStoreScraper(date_obj, incremental=args.incremental, profile=args.profile, sink=args.sink, request_timeout=args.request_timeout)
+        if targets:
+            jmo.scrape_targets(targets, concurrency=args.concurrency, batch_size=args.batch_size, base_url=args.app_store_url)
+        else:
+            jmo.scrape_data(batch_size=args.batch_size, base_url=args.app_store_url)
         
     def generate_reason(self, args=None):
+        from module.reason_generation import NegReasonGeneration
+
         print("Data reason generation started")
-        reason = NegReasonGeneration()
-        reason.generate_reason()
+        options = {}
+        if args.token_cache:
+            options["token_cache"] = args.token_cache
+        if args.model_registry:
+            options["registry"] = args.model_registry
+        if args.dedup_threshold is not None:
+            options["dedup_threshold"] = args.dedup_threshold
+        reason = NegReasonGeneration(profile=args.profile, sink=args.sink, **options)
+        if args.window_start:
+            window_end = datetime.fromisoformat(args.window_end) if args.window_end else datetime.now(timezone.utc).replace(tzinfo=None)
+            reason.generate_reason_window(datetime.fromisoformat(args.window_start), window_end, args.batch_size, workers=args.workers)
+        else:
+            reason.generate_reason(workers=args.workers)
         
 
+    def aggregate(self, args=None):
+        from module.aggregation import ReviewAggregator
+
+        print("Rollup aggregation started")
+        aggregator = ReviewAggregator(profile=args.profile, sink=args.sink, full=args.full)
+        aggregator.aggregate()
+
+    def update_model(self, args=None):
+        from module.model_update import ModelUpdater
+
+        print("LDA model update started")
+        options = {}
+        if args.model:
+            options["model_path"] = args.model
+        if args.model_registry:
+            options["registry"] = args.model_registry
+        updater = ModelUpdater(version=args.version, workers=args.workers, batch_size=args.batch_size, profile=args.profile, sink=args.sink, **options)
+        window_start = datetime.fromisoformat(args.window_start) if args.window_start else None
+        window_end = datetime.fromisoformat(args.window_end) if args.window_end else None
+        updater.update(window_start, window_end)
+
+    def serve(self, args=None):
+        from module.as_config import reason_model, reason_map
+        from module.reason_service import serve
+
+        print("Reason classification service started")
+        serve(args.host, args.port, reason_model, reason_map, args.max_batch_size, args.max_wait_ms / 1000)
+
     def run(self):
         args = self.parser.parse_args()
         # call appropriate function for subcommand
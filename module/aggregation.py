@@ -0,0 +1,321 @@
+import logging
+import warnings
+import pytz
+import hashlib
+import pandas as pd
+import pyarrow.compute as pc
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+from datetime import datetime
+from module.as_config import BQ_CONFIG, SCRAP_CONFIG, APP_STORE_SCRAPING_TABLE, APP_STORE_LOG_TABLE, APP_STORE_NEG_REASON_RESULT_TABLE, APP_STORE_TOPIC_LOG_TABLE, APP_STORE_RATING_ROLLUP_TABLE, APP_STORE_REASON_ROLLUP_TABLE, APP_STORE_TOKEN_ROLLUP_TABLE, APP_STORE_AGGREGATE_LOG_TABLE, APP_STORE_METRICS_TABLE, sink_path
+from module.bq_connection import BQConnection
+from module.review_queries import latest_log_time, latest_aggregation, touched_review_days, reviews_between
+from module.profiling import RunProfiler, write_metrics
+from module.sink import make_sink
+
+
+logger = logging.getLogger("Review Aggregation")
+warnings.filterwarnings("ignore")
+
+TOP_TOKENS = 10
+# the rollups of every scrape target are kept apart, a review is counted once per target
+TARGET_KEY = ["app_name", "country"]
+REVIEW_KEY = TARGET_KEY + ["userName", "date", "title"]
+RATING_COLUMNS = REVIEW_KEY + ["rating"]
+REASON_COLUMNS = REVIEW_KEY + ["Reason", "review_processed", "model_version", "created_at"]
+
+RATING_ROLLUP_SCHEMA = [
+    bigquery.SchemaField("period", "STRING"),
+    bigquery.SchemaField("period_start", "DATE"),
+    bigquery.SchemaField("app_name", "STRING"),
+    bigquery.SchemaField("country", "STRING"),
+    bigquery.SchemaField("rating", "FLOAT"),
+    bigquery.SchemaField("reviews", "INTEGER"),
+    bigquery.SchemaField("period_reviews", "INTEGER"),
+    bigquery.SchemaField("avg_rating", "FLOAT"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+REASON_ROLLUP_SCHEMA = [
+    bigquery.SchemaField("period", "STRING"),
+    bigquery.SchemaField("period_start", "DATE"),
+    bigquery.SchemaField("app_name", "STRING"),
+    bigquery.SchemaField("country", "STRING"),
+    bigquery.SchemaField("model_version", "STRING"),
+    bigquery.SchemaField("Reason", "STRING"),
+    bigquery.SchemaField("reviews", "INTEGER"),
+    bigquery.SchemaField("share", "FLOAT"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+TOKEN_ROLLUP_SCHEMA = [
+    bigquery.SchemaField("period", "STRING"),
+    bigquery.SchemaField("period_start", "DATE"),
+    bigquery.SchemaField("app_name", "STRING"),
+    bigquery.SchemaField("country", "STRING"),
+    bigquery.SchemaField("model_version", "STRING"),
+    bigquery.SchemaField("Reason", "STRING"),
+    bigquery.SchemaField("rank", "INTEGER"),
+    bigquery.SchemaField("token", "STRING"),
+    bigquery.SchemaField("occurrences", "INTEGER"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+AGGREGATE_LOG_SCHEMA = [
+    bigquery.SchemaField("created_at", "DATETIME"),
+    bigquery.SchemaField("job_id", "STRING"),
+    bigquery.SchemaField("scrap_through", "DATETIME"),
+    bigquery.SchemaField("reason_through", "DATETIME"),
+]
+
+
+def with_periods(frame):
+    """
+    Repeats every review once per period, with its day and the Monday of its week as period_start
+    """
+    day = pd.to_datetime(frame["date"]).dt.normalize()
+    daily = frame.assign(period="day", period_start=day)
+    weekly = frame.assign(period="week", period_start=day - pd.to_timedelta(day.dt.weekday, unit="D"))
+    return pd.concat([daily, weekly], ignore_index=True)
+
+
+def rating_rollup(reviews):
+    """
+    Reviews by rating, reviews and average rating of every day and week, per scrape target
+    """
+    periods = with_periods(reviews)
+    keys = ["period", "period_start"] + TARGET_KEY
+    counts = periods.groupby(keys + ["rating"]).size().rename("reviews").reset_index()
+    totals = periods.groupby(keys)["rating"].agg(period_reviews="size", avg_rating="mean").reset_index()
+    return counts.merge(totals, on=keys)
+
+
+def reason_rollup(reasons):
+    """
+    Negative reviews by reason and their share of the period, per scrape target and model version
+    """
+    periods = with_periods(reasons)
+    keys = ["period", "period_start"] + TARGET_KEY + ["model_version"]
+    counts = periods.groupby(keys + ["Reason"], dropna=False).size().rename("reviews").reset_index()
+    counts["share"] = counts["reviews"] / counts.groupby(keys, dropna=False)["reviews"].transform("sum")
+    return counts
+
+
+def token_rollup(reasons, top_n=TOP_TOKENS):
+    """
+    Most frequent tokens of the processed reviews of every reason, per period, scrape target and model version
+    """
+    periods = with_periods(reasons)
+    tokens = periods.assign(token=periods["review_processed"].str.findall(r"\w+")).explode("token").dropna(subset=["token"])
+    keys = ["period", "period_start"] + TARGET_KEY + ["model_version", "Reason"]
+    counts = tokens.groupby(keys + ["token"], dropna=False).size().rename("occurrences").reset_index()
+    counts = counts.sort_values(keys + ["occurrences", "token"], ascending=[True] * len(keys) + [False, True])
+    counts["rank"] = counts.groupby(keys, dropna=False).cumcount() + 1
+    return counts[counts["rank"] <= top_n]
+
+
+def touched_months(days):
+    """
+    Monthly partitions whose daily or weekly rows change with the given review days,
+    a week belongs to the month of its Monday
+    """
+    days = pd.to_datetime(pd.Series(list(days), dtype=object)).dt.normalize()
+    mondays = days - pd.to_timedelta(days.dt.weekday, unit="D")
+    return sorted(set(days.dt.to_period("M")) | set(mondays.dt.to_period("M")))
+
+
+def month_range(month):
+    """
+    Review dates needed to rebuild a month: its days and the days of the week starting on its last Monday
+    """
+    return month.start_time, (month + 1).start_time + pd.Timedelta(days=6)
+
+
+def rollup_job_config(schema):
+    return bigquery.LoadJobConfig(
+        write_disposition="WRITE_TRUNCATE",
+        schema=schema,
+        time_partitioning=bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.MONTH, field="period_start"),
+        # app_name and country are added to rollup tables created before them
+        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+    )
+
+
+class ReviewAggregator(object):
+    def __init__(self, profile=None, sink="bigquery", full=False):
+        """
+        Maintains the daily and weekly dashboard rollups. Only the monthly partitions holding reviews of the
+        jobs logged since the last aggregation are rebuilt, full rebuilds every month with reviews
+        """
+        self.project_id = BQ_CONFIG["PROJECT"]
+        self.dataset = BQ_CONFIG["DB"]
+        self.input_table = APP_STORE_SCRAPING_TABLE
+        self.reason_table = APP_STORE_NEG_REASON_RESULT_TABLE
+        self.log_table = APP_STORE_LOG_TABLE
+        self.log_topic_table = APP_STORE_TOPIC_LOG_TABLE
+        self.rating_table = APP_STORE_RATING_ROLLUP_TABLE
+        self.reason_rollup_table = APP_STORE_REASON_ROLLUP_TABLE
+        self.token_table = APP_STORE_TOKEN_ROLLUP_TABLE
+        self.aggregate_log_table = APP_STORE_AGGREGATE_LOG_TABLE
+        self.scrap_config = SCRAP_CONFIG
+        self.full = full
+        self.bq = BQConnection()
+        self.metrics_table = APP_STORE_METRICS_TABLE
+        self.profiler = RunProfiler("aggregate", profile)
+        self.sink = make_sink(sink, sink_path, self.bq, BQ_CONFIG)
+
+    @property
+    def credential_datamart(self):
+        return BQ_CONFIG["CRED"]
+
+    def read_query(self, query, job_config):
+        return self.bq.read_bq_arrow(query, self.credential_datamart, self.project_id, job_config).to_pandas()
+
+    def log_time(self, log_table):
+        """
+        Creation time of the latest job of a success log table, None before the first job
+        """
+        if self.sink.name == "local":
+            log = self.sink.read(log_table)
+            value = None if log is None else pc.max(log["created_at"]).as_py()
+        else:
+            try:
+                value = self.read_query(*latest_log_time(self.dataset, log_table))["created_at"].iloc[0]
+            except NotFound:
+                value = None
+        return None if pd.isnull(value) else pd.Timestamp(value)
+
+    def watermark(self):
+        """
+        Latest scraping and reason job times covered by the previous aggregation, None on the first run
+        """
+        if self.full:
+            return None, None
+        if self.sink.name == "local":
+            log = self.sink.read(self.aggregate_log_table)
+            if log is None:
+                return None, None
+            log = log.to_pandas().sort_values("created_at").tail(1)
+        else:
+            try:
+                log = self.read_query(*latest_aggregation(self.dataset, self.aggregate_log_table))
+            except NotFound:
+                return None, None
+        if len(log) == 0:
+            return None, None
+        return tuple(None if pd.isnull(value) else pd.Timestamp(value) for value in log[["scrap_through", "reason_through"]].iloc[0])
+
+    def touched_days(self, table, since, through):
+        """
+        Review days with rows of the jobs created after since and up to through
+        """
+        if through is None:
+            return []
+        if self.sink.name == "local":
+            staged = self.sink.read(table)
+            if staged is None:
+                return []
+            rows = staged.select(["date", "created_at"]).to_pandas()
+            selected = rows["created_at"] <= through
+            if since is not None:
+                selected &= rows["created_at"] > since
+            days = rows.loc[selected, "date"]
+        else:
+            days = self.read_query(*touched_review_days(self.dataset, table, since, through))["day"]
+        return pd.to_datetime(days).dt.normalize().unique().tolist()
+
+    def read_reviews(self, table, columns, start, end):
+        """
+        Rows of the reviews written in [start, end), with the columns of the table among columns.
+        Rows scraped without app_name and country belong to the default app
+        """
+        if self.sink.name == "local":
+            staged = self.sink.read(table)
+            if staged is None:
+                return pd.DataFrame(columns=[column for column in columns if column != "model_version"])
+            rows = staged.select([column for column in columns if column in staged.column_names]).to_pandas()
+            rows = rows[(rows["date"] >= start) & (rows["date"] < end)]
+        else:
+            existing = self.bq.table_columns(self.dataset + "." + table, self.credential_datamart, self.project_id)
+            query, query_config = reviews_between(self.dataset, table, [column for column in columns if column in existing], start, end)
+            rows = self.read_query(query, query_config)
+        default_app, default_country = self.scrap_config["APP_NAME"], str(self.scrap_config["COUNTRY"]).lower()
+        return rows.assign(
+            app_name=rows["app_name"].fillna(default_app) if "app_name" in rows else default_app,
+            country=rows["country"].fillna(default_country) if "country" in rows else default_country,
+        )
+
+    def rollups(self, start, end):
+        """
+        Rating, reason and token rollups of every period of the reviews written in [start, end)
+        """
+        with self.profiler.stage("read") as stats:
+            reviews = self.read_reviews(self.input_table, RATING_COLUMNS, start, end)
+            reasons = self.read_reviews(self.reason_table, REASON_COLUMNS, start, end)
+            stats.rows += len(reviews) + len(reasons)
+        # a review scraped or scored by several jobs counts once, with its latest reason
+        reviews = reviews.drop_duplicates(subset=REVIEW_KEY)
+        if "model_version" not in reasons:
+            reasons["model_version"] = None
+        reasons = reasons.sort_values("created_at").drop_duplicates(subset=REVIEW_KEY + ["model_version"], keep="last")
+        with self.profiler.stage("rollup", rows=len(reviews) + len(reasons)):
+            return [
+                (self.rating_table, rating_rollup(reviews), RATING_ROLLUP_SCHEMA),
+                (self.reason_rollup_table, reason_rollup(reasons), REASON_ROLLUP_SCHEMA),
+                (self.token_table, token_rollup(reasons), TOKEN_ROLLUP_SCHEMA),
+            ]
+
+    def aggregate(self):
+        jakarta_tz = pytz.timezone("Asia/Jakarta")
+        jakarta_time = datetime.now(jakarta_tz)
+        hash_hex = hashlib.sha256(str(jakarta_time).encode()).hexdigest()
+        with self.profiler.stage("read"):
+            scrap_since, reason_since = self.watermark()
+            scrap_through = self.log_time(self.log_table) or scrap_since
+            reason_through = self.log_time(self.log_topic_table) or reason_since
+            days = self.touched_days(self.input_table, scrap_since, scrap_through)
+            days += self.touched_days(self.reason_table, reason_since, reason_through)
+        months = touched_months(days)
+        logging.info(
+            "Rebuilding {} monthly rollup partitions of {} review days at {}".format(len(months), len(set(days)), datetime.today())
+        )
+        if months:
+            start, end = month_range(months[0])[0], month_range(months[-1])[1]
+            tables = self.rollups(start, end)
+            for month in months:
+                for table, rollup, schema in tables:
+                    rows = rollup[rollup["period_start"].dt.to_period("M") == month]
+                    if len(rows) == 0:
+                        continue
+                    rows = rows.assign(period_start=rows["period_start"].dt.date, created_at=jakarta_time)
+                    with self.profiler.stage("sink_write", rows=len(rows)):
+                        self.sink.write_partition(
+                            rows[[field.name for field in schema]], table, month.strftime("%Y%m"), rollup_job_config(schema)
+                        )
+
+        log_data = pd.DataFrame({
+            "created_at": [jakarta_time],
+            "job_id": [hash_hex],
+            "scrap_through": pd.Series([scrap_through], dtype="datetime64[us]"),
+            "reason_through": pd.Series([reason_through], dtype="datetime64[us]"),
+        })
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_APPEND",
+            schema=AGGREGATE_LOG_SCHEMA,
+        )
+        with self.profiler.stage("sink_write", rows=len(log_data)):
+            self.sink.write(log_data, self.aggregate_log_table, hash_hex, jakarta_time, job_config, commit=True)
+        # the rollup partitions are loaded before the log, the next run starts after its watermarks
+        with self.profiler.stage("sink_flush"):
+            paths = self.sink.flush()
+        logging.info(
+            "Finished loading {} files of rollups and log at {}".format(
+                len(paths), datetime.today()
+            )
+        )
+        self.finish_run()
+
+    def finish_run(self):
+        """
+        Emits the per-run summary and appends it to the metrics table when one is configured
+        """
+        summary = self.profiler.finish(bigquery=self.bq.latency_summary())
+        if self.metrics_table and self.sink.name == "bigquery":
+            write_metrics(self.bq, summary, self.dataset + "." + self.metrics_table, self.credential_datamart, self.project_id)
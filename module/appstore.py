@@ -1,23 +1,53 @@
+import os
 import logging
 import warnings
 import pytz
 import hashlib
 import pandas as pd
-import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from google.cloud import bigquery
 from datetime import datetime
-from app_store_scraper import AppStore
-from module.as_config import SCRAP_CONFIG, BQ_CONFIG, APP_STORE_SCRAPING_TABLE, APP_STORE_LOG_TABLE
+from module.as_config import SCRAP_CONFIG, BQ_CONFIG, APP_STORE_SCRAPING_TABLE, APP_STORE_LOG_TABLE, APP_STORE_METRICS_TABLE, scrap_state, scrap_checkpoint, sink_path
 from module.bq_connection import BQConnection
+from module.review_queries import scraped_review_keys, target_parameters
+from module.profiling import RunProfiler, write_metrics
+from module.sink import make_sink, staged_path, write_parquet
+from module.checkpoint import CHECKPOINT_PAGES, ScrapeCheckpoint
+from module.review_stream import STREAM_BATCH_SIZE, iter_pages, to_record_batch
+from module.scheduler import REQUEST_TIMEOUT, ScrapeTarget, HostRateLimiter, RateLimitedAppStore, run_targets
+from module.watermark import ReviewWatermark, iter_new_reviews
 
 
 logger = logging.getLogger("App Store Scrapper")
 warnings.filterwarnings("ignore")
 
+# full schema of the staged Parquet files, in the staged column order
+STAGED_REVIEW_SCHEMA = [
+    bigquery.SchemaField("job_id", "STRING"),
+    bigquery.SchemaField("date", "DATETIME"),
+    bigquery.SchemaField("review", "STRING"),
+    bigquery.SchemaField("rating", "FLOAT"),
+    bigquery.SchemaField("userName", "STRING"),
+    bigquery.SchemaField("title", "STRING"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+TARGET_REVIEW_SCHEMA = STAGED_REVIEW_SCHEMA + [
+    bigquery.SchemaField("app_name", "STRING"),
+    bigquery.SchemaField("country", "STRING"),
+]
+LOG_SCHEMA = [
+    bigquery.SchemaField("created_at", "DATETIME"),
+    bigquery.SchemaField("job_id", "STRING"),
+]
+
 class APPStoreScraper(object):
     def __init__(self,
-                 date_filter):
-        self.credential_datamart = BQ_CONFIG["CRED"]
+                 date_filter,
+                 incremental=False,
+                 profile=None,
+                 sink="bigquery",
+                 request_timeout=REQUEST_TIMEOUT):
         self.project_id = BQ_CONFIG["PROJECT"]
         self.dataset = BQ_CONFIG["DB"]
         self.table = APP_STORE_SCRAPING_TABLE
@@ -25,68 +55,245 @@ class APPStoreScraper(object):
         self.scrap_config = SCRAP_CONFIG
         self.bq = BQConnection()
         self.date_filter = pd.to_datetime(date_filter)
+        self.incremental = incremental
+        self.state_path = scrap_state
+        self.checkpoint_path = scrap_checkpoint
+        self.request_timeout = request_timeout
+        self.watermarks = {}
+        self.metrics_table = APP_STORE_METRICS_TABLE
+        self.profiler = RunProfiler("scrap-data", profile)
+        self.sink = make_sink(sink, sink_path, self.bq, BQ_CONFIG)
+
+    @property
+    def credential_datamart(self):
+        return BQ_CONFIG["CRED"]
 
-    def scrape_data(self):
-        jmo = AppStore(country=self.scrap_config["COUNTRY"], app_name=self.scrap_config["APP_NAME"], app_id = self.scrap_config["APP_ID"])
-        logging.debug("Connecting to appstore scrapper")
-        jmo.review(after=self.date_filter)
-        jmodf = pd.DataFrame(np.array(jmo.reviews),columns=['review'])
-        jmodf = jmodf.join(pd.DataFrame(jmodf.pop('review').tolist()))
-        logging.info("Successfuly scraped data after {}".format(self.date_filter))
+    def new_job(self):
+        """
+        Returns the Jakarta creation time of a scraping job and its id, the SHA-256 hash of that time
+        """
         jakarta_tz = pytz.timezone("Asia/Jakarta")
         jakarta_time = datetime.now(jakarta_tz)
-        jmodf["created_at"] = jakarta_time
         # Convert datetime to string
         datetime_str = str(jakarta_time)
 
         # Calculate the SHA-256 hash
         hash_object = hashlib.sha256(datetime_str.encode())
         hash_hex = hash_object.hexdigest()
-        jmodf["job_id"] = hash_hex
+        return jakarta_time, hash_hex
+
+    def watermark_path(self, target=None):
+        """
+        State file of the default app, or of a scrape target next to it
+        """
+        if target is None:
+            return self.state_path
+        root, ext = os.path.splitext(self.state_path)
+        return "{}_{}_{}{}".format(root, target.app_id, target.country, ext)
+
+    def watermark_filter(self, target=None):
+        """
+        Extra condition selecting the rows of a scrape target in the scraping table. Rows loaded before
+        the app_name and country columns existed belong to the default app
+        """
+        if target is None:
+            return ""
+        table_id = self.dataset + "." + self.table
+        if {"app_name", "country"}.issubset(self.bq.table_columns(table_id, self.credential_datamart, self.project_id)):
+            return "and ifnull(app_name, @default_app) = @app_name and ifnull(country, @default_country) = @country"
+        if (target.app_name, target.country) == (self.scrap_config["APP_NAME"], str(self.scrap_config["COUNTRY"]).lower()):
+            return ""
+        return None
+
+    def load_watermark(self, target=None):
+        """
+        Reads the persisted watermark, or seeds it from the reviews already loaded after the date filter
+        """
+        watermark = ReviewWatermark.load(self.watermark_path(target))
+        if watermark is None and self.sink.name == "local":
+            watermark = ReviewWatermark.from_frame(self.local_review_keys(target))
+            logging.info("Seeded watermark {} with {} keys from local {}".format(watermark.high_water, len(watermark), self.table))
+        elif watermark is None:
+            target_filter = self.watermark_filter(target)
+            if target_filter is None:
+                # the target was never loaded, nothing to seed from
+                return ReviewWatermark()
+            query, query_config = scraped_review_keys(self.dataset, self.table, self.date_filter, target_filter)
+            if target_filter:
+                query_config.query_parameters += target_parameters(
+                    target, self.scrap_config["APP_NAME"], str(self.scrap_config["COUNTRY"]).lower()
+                )
+            with self.profiler.stage("bq_read"):
+                watermark = ReviewWatermark.from_frame(
+                    self.bq.read_bq_arrow(query, self.credential_datamart, self.project_id, query_config).to_pandas()
+                )
+            logging.info("Seeded watermark {} with {} keys from {}".format(watermark.high_water, len(watermark), self.table))
+        return watermark
+
+    def local_review_keys(self, target=None):
+        """
+        Dedup keys of the locally staged reviews after the date filter, the local counterpart of scraped_review_keys
+        """
+        staged = self.sink.read(self.table)
+        if staged is None:
+            return pd.DataFrame(columns=["userName", "date", "title"])
+        staged = staged.to_pandas()
+        selected = staged["date"] >= self.date_filter
+        if target is not None:
+            default_app, default_country = self.scrap_config["APP_NAME"], str(self.scrap_config["COUNTRY"]).lower()
+            app_name = staged["app_name"].fillna(default_app) if "app_name" in staged else default_app
+            country = staged["country"].fillna(default_country) if "country" in staged else default_country
+            selected &= (app_name == target.app_name) & (country == target.country)
+        return staged.loc[selected, ["userName", "date", "title"]]
+
+    def default_target(self):
+        return ScrapeTarget(self.scrap_config["APP_NAME"], str(self.scrap_config["COUNTRY"]).lower(), self.scrap_config["APP_ID"])
+
+    def commit_watermark(self):
+        """
+        Persists the watermarks, only called once the scraped reviews and the log are loaded
+        """
+        for target, watermark in self.watermarks.items():
+            watermark.save(self.watermark_path(target))
+
+    def scrape_data(self, batch_size=STREAM_BATCH_SIZE, base_url=None):
+        """
+        Scrapes the reviews of the configured app, staged in part files of at most batch_size reviews
+        """
+        return self.scrape_job([self.default_target()], tagged=False, batch_size=batch_size, base_url=base_url)
+
+    def scrape_targets(self, targets, concurrency=4, batch_size=STREAM_BATCH_SIZE, base_url=None):
+        """
+        Scrapes several app/country targets concurrently on a bounded thread pool, with per-host rate limiting
+        and backoff. Their part files are loaded in a single job with app_name and country columns
+        """
+        return self.scrape_job(targets, tagged=True, concurrency=concurrency, batch_size=batch_size, base_url=base_url)
+
+    def scrape_job(self, targets, tagged, concurrency=1, batch_size=STREAM_BATCH_SIZE, base_url=None):
+        """
+        Runs one scraping job over the targets. The reviews of every target are staged as part files and
+        the pagination is checkpointed every few pages, a job restarted with the same parameters keeps
+        its job id and only fetches the pages after the checkpoint, the part files and log it already loaded
+        are not loaded again. tagged adds the app_name and country columns
+        """
+        limiter = HostRateLimiter()
+        checkpoint = ScrapeCheckpoint(self.checkpoint_path)
+        params = {
+            "table": self.table,
+            "sink": self.sink.name,
+            "date_filter": self.date_filter.isoformat(),
+            "incremental": self.incremental,
+            "tagged": tagged,
+            "targets": [":".join(target) for target in targets],
+        }
+        if not checkpoint.resume(params):
+            jakarta_time, hash_hex = self.new_job()
+            checkpoint.start(params, hash_hex, jakarta_time)
+
+        def scrape_target(target):
+            rows = self.stage_target(
+                lambda: RateLimitedAppStore(target, limiter, base_url=base_url, timeout=self.request_timeout),
+                target,
+                tagged,
+                checkpoint,
+                batch_size,
+            )
+            logging.info("Successfuly scraped {} reviews of {} after {}".format(rows, target, self.date_filter))
+            return rows
+
+        with self.profiler.stage("scrape") as stats:
+            counts = run_targets(targets, scrape_target, concurrency)
+            stats.rows += sum(counts.values())
         job_config = bigquery.LoadJobConfig(
                 write_disposition="WRITE_APPEND",
-                schema=[
-                    bigquery.SchemaField("date", "DATETIME"),
-                    bigquery.SchemaField("rating", "FLOAT"),
-                    bigquery.SchemaField("created_at", "DATETIME"),
-                    bigquery.SchemaField("job_id", "STRING"),
-                ],
-            )
-        
-        self.bq.to_bq(
-                jmodf[["job_id", 'date', 'review', 'rating', 'userName',
-       'title','created_at']],
-                self.dataset + "." + self.table,
-                self.credential_datamart,
-                self.project_id,
-                job_config,
+                schema=TARGET_REVIEW_SCHEMA if tagged else STAGED_REVIEW_SCHEMA,
             )
+        if tagged:
+            job_config.schema_update_options = [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION]
+        # the parts are kept until the job is done, an incremental resume reads them back into the watermark
+        for part in checkpoint.parts():
+            if not checkpoint.is_loaded(part):
+                self.sink.add_file(part, self.table, job_config, keep=True, on_loaded=checkpoint.mark_loaded)
+        if not checkpoint.logged:
+            self.write_log(checkpoint.created_at, checkpoint.job_id, on_loaded=checkpoint.mark_logged)
+        self.flush_sink()
+        self.sink.release(checkpoint.parts())
+        checkpoint.clear()
+        self.commit_watermark()
+        self.finish_run()
+        return counts
+
+    def stage_target(self, make_app, target, tagged, checkpoint, batch_size):
+        """
+        Pages through the reviews of one target from its checkpointed offset and stages them in part files,
+        committing the offset with every part. In incremental mode, paging stops once it passes the
+        watermark and only reviews missing from the dedup index are staged. Returns the staged rows
+        """
+        key = ":".join(target)
+        progress = checkpoint.progress(key)
+        stop_before = None
+        if self.incremental:
+            watermark = self.load_watermark(target if tagged else None)
+            stop_before = watermark.high_water
+            # reviews staged before the restart are already part of this job
+            for part in progress["parts"]:
+                for review in pq.read_table(staged_path(part), columns=["userName", "date", "title"]).to_pylist():
+                    watermark.add(review)
+            self.watermarks[target if tagged else None] = watermark
+        if progress["done"]:
+            return progress["rows"]
+        if progress["offset"]:
+            logging.info("Resuming {} at offset {}".format(target, progress["offset"]))
+
+        pending, pages = [], 0
+        for page, next_offset in iter_pages(make_app(), after=self.date_filter, stop_before=stop_before, offset=progress["offset"]):
+            if self.incremental:
+                page = list(iter_new_reviews(page, watermark))
+            pending.extend(page)
+            pages += 1
+            if next_offset is None or pages >= CHECKPOINT_PAGES or len(pending) >= batch_size:
+                part = self.stage_part(pending, target if tagged else None, checkpoint) if pending else None
+                checkpoint.commit(key, part, len(pending), next_offset)
+                pending, pages = [], 0
+        return progress["rows"]
+
+    def stage_part(self, reviews, target, checkpoint):
+        """
+        Writes reviews to a new in-progress part file of the job, published when the job is loaded
+        """
+        path = self.sink.file_path(self.table, checkpoint.job_id, checkpoint.created_at)
+        write_parquet(pa.Table.from_batches([to_record_batch(reviews, checkpoint.job_id, checkpoint.created_at, target)]), path)
         logging.info(
-            "Finished inserting rows of scrapped data at {}".format(
-                datetime.today()
-            )
+            "Staged {} scraped reviews of {} at {}".format(len(reviews), target or "the app", datetime.today())
         )
-       
-        
+        return path
+
+    def write_log(self, jakarta_time, hash_hex, on_loaded=None):
         log_data = {'created_at': [jakarta_time], 'job_id': [hash_hex]}
         log_data = pd.DataFrame(log_data)
         job_config = bigquery.LoadJobConfig(
                 write_disposition="WRITE_APPEND",
-                schema=[
-                    bigquery.SchemaField("created_at", "DATETIME"),
-                    bigquery.SchemaField("job_id", "STRING")
-                ],
-            )
-        self.bq.to_bq(
-                log_data,
-                self.dataset + "." + self.log_table,
-                self.credential_datamart,
-                self.project_id,
-                job_config,
+                schema=LOG_SCHEMA,
             )
+        with self.profiler.stage("sink_write", rows=len(log_data)):
+            self.sink.write(log_data, self.log_table, hash_hex, jakarta_time, job_config, commit=True, on_loaded=on_loaded)
+
+    def flush_sink(self):
+        """
+        Loads the staged review files together, then the log so it only lands once every review load succeeded
+        """
+        with self.profiler.stage("sink_flush"):
+            paths = self.sink.flush()
         logging.info(
-            "Finished inserting rows of log data at {}".format(
-                datetime.today()
+            "Finished inserting {} files of scrapped data and log at {}".format(
+                len(paths), datetime.today()
             )
         )
-       
\ No newline at end of file
+
+    def finish_run(self):
+        """
+        Emits the per-run summary and appends it to the metrics table when one is configured
+        """
+        summary = self.profiler.finish(bigquery=self.bq.latency_summary())
+        if self.metrics_table and self.sink.name == "bigquery":
+            write_metrics(self.bq, summary, self.dataset + "." + self.metrics_table, self.credential_datamart, self.project_id)
@@ -4,8 +4,6 @@ import traceback
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
-from google.oauth2 import service_account
-from google.cloud import bigquery
 
 logger = logging.getLogger(__name__)
 
@@ -16,56 +14,113 @@ credential_datamart = Path(__file__).parent.parent.resolve() / str(os.getenv("BQ
 project_id_bq = os.getenv("BQ_DATAMART_PROJECT_ID")
 bq_db = os.getenv("BQ_DB")
 
-try:
-    if os.getenv("IS_SERVICE_ACCOUNT_FROM_FILE").lower() == "true":
-        logger.info("Reading BigQuery credentials from files - churn pipeline")
-        credential_datamart = service_account.Credentials.from_service_account_file(
-            credential_datamart
-        )
-    else:
-        credential_datamart = service_account.Credentials.from_service_account_info(
-            json.loads(credential_datamart)
+
+def load_credentials():
+    """
+    Reads the BigQuery service account credentials, called on first use of BQ_CONFIG["CRED"]
+    """
+    from google.oauth2 import service_account
+
+    try:
+        if os.getenv("IS_SERVICE_ACCOUNT_FROM_FILE").lower() == "true":
+            logger.info("Reading BigQuery credentials from files - churn pipeline")
+            credentials = service_account.Credentials.from_service_account_file(
+                credential_datamart
+            )
+        else:
+            credentials = service_account.Credentials.from_service_account_info(
+                json.loads(credential_datamart)
+            )
+            logger.info("Credentials are not from files")
+    except Exception as e:
+        logger.error(
+            "query or credentials for retrieving dataset for churn pipeline is not available. error {e}, traceback {tr}".format(
+            e=e,
+            tr=traceback.format_exc()
+            )
         )
-        logger.info("Credentials are not from files")
-except Exception as e:
-    logger.error(
-        "query or credentials for retrieving dataset for churn pipeline is not available. error {e}, traceback {tr}".format(
-        e=e,
-        tr=traceback.format_exc()
+        raise ValueError(
+            "query or credentials for churn pipeline is not available, {}".format(e)
         )
-    )
-    raise ValueError(
-        "query or credentials for churn pipeline is not available, {}".format(e)
-    )
+    return credentials
+
+
+class LazyConfig(dict):
+    def __init__(self, loaders, **values):
+        """
+        Config dict whose keys in loaders are resolved by calling the loader on first access
+        """
+        super().__init__(**values)
+        self.loaders = loaders
+
+    def __missing__(self, key):
+        if key not in self.loaders:
+            raise KeyError(key)
+        value = self.loaders[key]()
+        self[key] = value
+        return value
+
 
 SCRAP_CONFIG = {
     "APP_NAME": os.getenv("APP_NAME"),
     "COUNTRY": os.getenv("COUNTRY"),
     "APP_ID": str(os.getenv("APP_ID")),
 }
-BQ_CONFIG = {
-    "CRED" : credential_datamart,
-    "PROJECT" : project_id_bq,
-    "DB" : bq_db
-}
-# reason / topic model path
-# reason_model = Path(__file__).parent.parent.resolve() / str(os.getenv("MODEL_LDA"))
-reason_model = str(os.getenv("MODEL_LDA"))
+# optional list of app_name:country:app_id targets scraped concurrently, comma separated
+SCRAP_TARGETS = [target.strip() for target in os.getenv("SCRAP_TARGETS", "").split(",") if target.strip()]
+BQ_CONFIG = LazyConfig(
+    {"CRED" : load_credentials},
+    PROJECT = project_id_bq,
+    DB = bq_db,
+)
+# reason / topic model path, relative paths are resolved from the repository root like every other path
+reason_model = str(Path(__file__).parent.parent.resolve() / str(os.getenv("MODEL_LDA")))
 reason_map = Path(__file__).parent.parent.resolve() / str(os.getenv("REASON_MAP"))
+# version written with the results of MODEL_LDA, its file name when unset
+reason_model_version = os.getenv("MODEL_VERSION")
+# optional registry of several models scored side by side, replaces MODEL_LDA and REASON_MAP when set
+model_registry = str(Path(__file__).parent.parent.resolve() / os.getenv("MODEL_REGISTRY")) if os.getenv("MODEL_REGISTRY") else None
+# MinHash similarity above which near-duplicate reviews share one topic inference, disabled when unset
+dedup_threshold = float(os.getenv("DEDUP_THRESHOLD")) if os.getenv("DEDUP_THRESHOLD") else None
+# optional on-disk cache of normalized review tokens, disabled when unset
+token_cache_path = str(Path(__file__).parent.parent.resolve() / os.getenv("TOKEN_CACHE_PATH")) if os.getenv("TOKEN_CACHE_PATH") else None
+# incremental scraping state (watermark and review dedup index)
+scrap_state = str(Path(__file__).parent.parent.resolve() / os.getenv("SCRAP_STATE_PATH", "state/scrap_state.npz"))
+# pagination checkpoint of the running scraping job, a restarted job resumes from it
+scrap_checkpoint = str(Path(__file__).parent.parent.resolve() / os.getenv("SCRAP_CHECKPOINT_PATH", "state/scrap_checkpoint.json"))
+# local parquet copies of every output table, loaded to bigquery from there unless the sink is local
+sink_path = str(Path(__file__).parent.parent.resolve() / os.getenv("SINK_PATH", "sink"))
 
 # table
 APP_STORE_SCRAPING_TABLE = os.getenv("APP_STORE_SCRAPING_TABLE")
 APP_STORE_NEG_REASON_RESULT_TABLE = os.getenv("APP_STORE_NEG_REASON_RESULT_TABLE")
 APP_STORE_LOG_TABLE = os.getenv("APP_STORE_LOG_TABLE")
 APP_STORE_TOPIC_LOG_TABLE = os.getenv("APP_STORE_TOPIC_LOG_TABLE")
-# job config
-job_config_batch = bigquery.QueryJobConfig(
-    # Run at batch priority, which won't count toward concurrent rate limit.
-    priority=bigquery.QueryPriority.BATCH
-)
+# optional table receiving the per-stage run metrics
+APP_STORE_METRICS_TABLE = os.getenv("APP_STORE_METRICS_TABLE")
+# dashboard rollups maintained by the aggregate subcommand and its success log
+APP_STORE_RATING_ROLLUP_TABLE = os.getenv("APP_STORE_RATING_ROLLUP_TABLE")
+APP_STORE_REASON_ROLLUP_TABLE = os.getenv("APP_STORE_REASON_ROLLUP_TABLE")
+APP_STORE_TOKEN_ROLLUP_TABLE = os.getenv("APP_STORE_TOKEN_ROLLUP_TABLE")
+APP_STORE_AGGREGATE_LOG_TABLE = os.getenv("APP_STORE_AGGREGATE_LOG_TABLE")
+# optional explanation side table of the reasons (top tokens and confidence) and per-topic keyword index
+APP_STORE_REASON_EXPLANATION_TABLE = os.getenv("APP_STORE_REASON_EXPLANATION_TABLE")
+APP_STORE_TOPIC_KEYWORD_TABLE = os.getenv("APP_STORE_TOPIC_KEYWORD_TABLE")
 
-job_config_large_rows = bigquery.QueryJobConfig(
-    # Run at batch priority, which won't count toward concurrent rate limit.
-    allow_large_results=True,
-    priority=bigquery.QueryPriority.BATCH,
-)
+
+# job config, built on first use so importing the config does not import bigquery
+def __getattr__(name):
+    if name not in ("job_config_batch", "job_config_large_rows"):
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+    from google.cloud import bigquery
+
+    if name == "job_config_batch":
+        return bigquery.QueryJobConfig(
+            # Run at batch priority, which won't count toward concurrent rate limit.
+            priority=bigquery.QueryPriority.BATCH
+        )
+    return bigquery.QueryJobConfig(
+        # Run at batch priority, which won't count toward concurrent rate limit.
+        allow_large_results=True,
+        priority=bigquery.QueryPriority.BATCH,
+    )
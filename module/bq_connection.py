@@ -1,48 +1,229 @@
 from google.cloud import bigquery
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+from collections import defaultdict
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# size of the HTTP connection pool shared by every call of a client
+HTTP_POOL_SIZE = 16
+# load jobs uploaded and awaited at the same time
+LOAD_CONCURRENCY = 8
+
 
 class BQConnection:
-    def __init__(self):
-        pass
-
-    def read_bq(self, query, credentials, project_id, job_config):
-        client = bigquery.Client(credentials=credentials, project=project_id)
-        query_job = client.query(query, job_config=job_config)
-        query_job = client.get_job(
-            query_job.job_id, location=query_job.location
-        )  # Make an API request.
+    # one client per (credentials, project) for the whole process, shared by every BQConnection
+    _clients = {}
+    _clients_lock = threading.Lock()
+    # BigQuery Storage Read API clients, keyed by credentials
+    _storage_clients = {}
+
+    def __init__(self, api_endpoint=None, http=None):
+        """
+        api_endpoint and http allow pointing the clients to a local fake BigQuery transport
+        """
+        self.api_endpoint = api_endpoint
+        self.http = http
+        self.latency = defaultdict(list)
+
+    def get_client(self, credentials, project_id):
+        """
+        Returns the shared client of the credentials and project, creating it on first use
+        """
+        key = (credentials, project_id, self.api_endpoint, self.http)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                logger.info("Creating BigQuery client for project {}".format(project_id))
+                client_options = {"api_endpoint": self.api_endpoint} if self.api_endpoint else None
+                client = bigquery.Client(
+                    credentials=credentials,
+                    project=project_id,
+                    client_options=client_options,
+                    _http=self.http or self.pooled_session(credentials),
+                )
+                self._clients[key] = client
+        return client
+
+    def get_storage_client(self, credentials):
+        """
+        Returns the shared Storage Read API client of the credentials, None when google-cloud-bigquery-storage
+        is not installed or the clients point to a local fake BigQuery
+        """
+        if self.api_endpoint or self.http:
+            return None
+        try:
+            from google.cloud import bigquery_storage
+        except ImportError:
+            return None
+        with self._clients_lock:
+            client = self._storage_clients.get(credentials)
+            if client is None:
+                logger.info("Creating BigQuery Storage read client")
+                client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+                self._storage_clients[credentials] = client
+        return client
+
+    @staticmethod
+    def pooled_session(credentials):
+        """
+        Authorized HTTP session keeping up to HTTP_POOL_SIZE connections alive between calls
+        """
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.latency[name].append(elapsed)
+            logger.info("BigQuery {} took {:.3f}s".format(name, elapsed))
+
+    def latency_summary(self):
+        """
+        Number of calls, total and max latency in seconds of every BigQuery call type
+        """
+        return {
+            name: {"calls": len(values), "total": round(sum(values), 3), "max": round(max(values), 3)}
+            for name, values in self.latency.items()
+        }
+
+    def read_bq(self, query, credentials, project_id, job_config=None):
+        client = self.get_client(credentials, project_id)
+        with self.timed("read_bq"):
+            query_job = client.query(query, job_config=job_config)
+            logger.info(
+                "Job {} is currently in state {}".format(query_job.job_id, query_job.state)
+            )
+            results = query_job.result()
+            df = results.to_dataframe()
+        return df
+
+    def read_bq_arrow(self, query, credentials, project_id, job_config=None):
+        """
+        Runs a query and downloads the result as an Arrow table, through the Storage Read API when
+        the result spans several pages and over REST otherwise
+        """
+        client = self.get_client(credentials, project_id)
+        with self.timed("read_bq_arrow"):
+            query_job = client.query(query, job_config=job_config)
+            results = query_job.result()
+            table = results.to_arrow(
+                bqstorage_client=self.get_storage_client(credentials), create_bqstorage_client=False
+            )
         logger.info(
-            "Job {} is currently in state {}".format(query_job.job_id, query_job.state)
+            "Job {} read {} rows, {} bytes processed".format(query_job.job_id, table.num_rows, query_job.total_bytes_processed)
         )
-        results = query_job.result()
-        df = results.to_dataframe()
-        return df
+        return table
+
+    def read_bq_batches(self, query, credentials, project_id, job_config=None, page_size=None):
+        """
+        Runs a query and yields the result as Arrow record batches while it is downloaded, through the
+        Storage Read API when installed and page by page over REST otherwise. Only a bounded queue of
+        batches is held in memory, whatever the size of the result
+        """
+        client = self.get_client(credentials, project_id)
+        with self.timed("read_bq_batches"):
+            query_job = client.query(query, job_config=job_config)
+            results = query_job.result(page_size=page_size)
+        logger.info(
+            "Job {} streams {} rows, {} bytes processed".format(query_job.job_id, results.total_rows, query_job.total_bytes_processed)
+        )
+        for batch in results.to_arrow_iterable(bqstorage_client=self.get_storage_client(credentials)):
+            yield batch
 
     def create_table_feature(self, query, credential, project_id, dataset, table_name):
-        client = bigquery.Client(credentials=credential, project=project_id)
+        client = self.get_client(credential, project_id)
         logger.info(
             "Creating temporary table {}.{}.{}".format(project_id, dataset, table_name)
         )
 
         # Set up job_config
         job_config = bigquery.QueryJobConfig()
-        table_ref = client.dataset(dataset).table(table_name)
+        table_ref = bigquery.DatasetReference(project_id, dataset).table(table_name)
         job_config.destination = table_ref
         job_config.write_disposition = "WRITE_TRUNCATE"
 
         # Start the query, passing in the extra configuration.
-        query_job = client.query(query, job_config=job_config)  # Make an API request.
-        query_job.result()
+        with self.timed("create_table_feature"):
+            query_job = client.query(query, job_config=job_config)  # Make an API request.
+            query_job.result()
 
     def to_bq(self, df, table_id, credentials, project_id, job_config):
-        client = bigquery.Client(credentials=credentials, project=project_id)
-        job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-        job.result()
+        client = self.get_client(credentials, project_id)
+        with self.timed("to_bq"):
+            job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+            job.result()
+
+    def file_to_bq(self, path, table_id, credentials, project_id, job_config):
+        """
+        Loads a local file in a single load job, the source format is taken from job_config
+        """
+        client = self.get_client(credentials, project_id)
+        with self.timed("file_to_bq"):
+            with open(path, "rb") as source_file:
+                job = client.load_table_from_file(source_file, table_id, job_config=job_config)
+            job.result()
+
+    def submit_file_load(self, path, table_id, credentials, project_id, job_config):
+        """
+        Uploads a local file and starts its load job without waiting for the job to finish
+        """
+        client = self.get_client(credentials, project_id)
+        with open(path, "rb") as source_file:
+            # a known size lets small files go up in a single multipart request instead of a resumable session
+            return client.load_table_from_file(source_file, table_id, size=os.path.getsize(path), job_config=job_config)
+
+    def load_files(self, loads, credentials, project_id, max_concurrent=LOAD_CONCURRENCY, on_loaded=None):
+        """
+        Uploads and runs the load jobs of (path, table_id, job_config) tuples concurrently and waits for all of them.
+        Every job is awaited before the first failure is raised, so no load is left running unobserved.
+        on_loaded is called with the index of every load as soon as its job succeeded
+        """
+        if not loads:
+            return []
+        def load(index, path, table_id, job_config):
+            job = self.submit_file_load(path, table_id, credentials, project_id, job_config)
+            job.result()
+            if on_loaded is not None:
+                on_loaded(index)
+            return job
+
+        with self.timed("load_files"):
+            with ThreadPoolExecutor(max_workers=min(max_concurrent, len(loads))) as executor:
+                futures = [executor.submit(load, index, *args) for index, args in enumerate(loads)]
+                errors = [future.exception() for future in futures]
+        for (path, table_id, _), error in zip(loads, errors):
+            if error is not None:
+                logger.error("Loading {} to {} failed: {}".format(path, table_id, error))
+        failed = [error for error in errors if error is not None]
+        if failed:
+            raise failed[0]
+        return [future.result() for future in futures]
+
+    def table_columns(self, table_id, credentials, project_id):
+        """
+        Column names of an existing table
+        """
+        client = self.get_client(credentials, project_id)
+        with self.timed("table_columns"):
+            table = client.get_table(table_id)
+        return [field.name for field in table.schema]
 
     def dml_bq(self, query, credentials, project_id):
-        client = bigquery.Client(credentials=credentials, project=project_id)
-        job = client.query(query)
-        job.result()
+        client = self.get_client(credentials, project_id)
+        with self.timed("dml_bq"):
+            job = client.query(query)
+            job.result()
@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+import threading
+import pandas as pd
+from module.sink import published_path, staged_path
+
+
+logger = logging.getLogger(__name__)
+
+# pages scraped between two checkpoints, at most this many pages of a target are fetched again after a restart
+CHECKPOINT_PAGES = 10
+
+
+class ScrapeCheckpoint(object):
+    def __init__(self, path):
+        """
+        Progress of a scraping job, saved every few pages: the job id and creation time and, per target,
+        the offset of the next page and the staged part files holding the reviews fetched so far, then the
+        part files and log already loaded. A restarted job with the same parameters resumes from it instead
+        of the first page and does not load them again
+        """
+        self.path = path
+        self.state = None
+        self.lock = threading.Lock()
+
+    def resume(self, params):
+        """
+        Loads the saved checkpoint when it belongs to a job with the same parameters and returns True.
+        The part files of a checkpoint of other parameters are removed
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as checkpoint_file:
+            state = json.load(checkpoint_file)
+        if state.get("params") != params:
+            logger.info("Discarding checkpoint {} of job {}, the parameters changed".format(self.path, state.get("job_id")))
+            for progress in state.get("targets", {}).values():
+                for part in progress["parts"]:
+                    part = staged_path(part)
+                    if os.path.exists(part):
+                        os.remove(part)
+            self.clear()
+            return False
+        self.state = state
+        self.state.setdefault("loaded", [])
+        self.state.setdefault("logged", False)
+        logger.info(
+            "Resuming job {} from checkpoint {} with {} staged reviews".format(
+                state["job_id"], self.path, sum(progress["rows"] for progress in state["targets"].values())
+            )
+        )
+        return True
+
+    def start(self, params, job_id, created_at):
+        self.state = {
+            "params": params,
+            "job_id": job_id,
+            "created_at": pd.Timestamp(created_at).isoformat(),
+            "targets": {},
+            "loaded": [],
+            "logged": False,
+        }
+        self.save()
+
+    @property
+    def job_id(self):
+        return self.state["job_id"]
+
+    @property
+    def created_at(self):
+        return pd.Timestamp(self.state["created_at"])
+
+    def progress(self, key):
+        """
+        Offset of the next page, part files, staged rows and completion of one target
+        """
+        with self.lock:
+            return self.state["targets"].setdefault(key, {"offset": 0, "parts": [], "rows": 0, "done": False})
+
+    def parts(self):
+        return [part for progress in self.state["targets"].values() for part in progress["parts"]]
+
+    def commit(self, key, part, rows, offset):
+        """
+        Records a staged part file and the offset of the page following it, offset None marks the target done
+        """
+        with self.lock:
+            progress = self.state["targets"][key]
+            if part is not None:
+                progress["parts"].append(part)
+                progress["rows"] += rows
+            progress["offset"] = offset or 0
+            progress["done"] = offset is None
+            self.save()
+
+    def is_loaded(self, part):
+        return published_path(part) in self.state["loaded"]
+
+    def mark_loaded(self, path):
+        """
+        Records a part file loaded to the sink, called from the load threads
+        """
+        with self.lock:
+            self.state["loaded"].append(published_path(path))
+            self.save()
+
+    @property
+    def logged(self):
+        return self.state["logged"]
+
+    def mark_logged(self, path):
+        """
+        Records that the log of the job is loaded, only the watermark and the cleanup are left
+        """
+        with self.lock:
+            self.state["logged"] = True
+            self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so a crash never leaves a truncated checkpoint behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.state = None
@@ -0,0 +1,98 @@
+import logging
+import threading
+import numpy as np
+from datetime import datetime
+from gensim import models
+from module.sparse_corpus import texts_to_csr
+
+
+logger = logging.getLogger(__name__)
+
+# loaded models of this process, keyed by path
+_models = {}
+_models_lock = threading.Lock()
+# token lookups of the dictionaries in use, keyed by id with the dictionary kept alive alongside
+_lookups = {}
+
+
+class TokenLookup(object):
+    def __init__(self, dictionary):
+        """
+        Precompiled token to id table of a gensim Dictionary, used in place of the Dictionary for doc2bow.
+        The vocabulary index and id array serve the vectorized lookup of doc2csr, tokens maps ids back to words
+        """
+        self.token2id = dict(dictionary.token2id)
+        self.ids = np.fromiter(self.token2id.values(), dtype=np.int64, count=len(self.token2id))
+        self.num_terms = int(self.ids.max()) + 1 if len(self.ids) else 0
+        self.tokens = np.empty(self.num_terms, dtype=object)
+        self.tokens[self.ids] = np.array(list(self.token2id.keys()), dtype=object)
+        self._vocabulary = None
+
+    @property
+    def vocabulary(self):
+        """
+        pandas Index of the tokens in the order of ids. Built by the first doc2csr, so loading a model
+        does not import pandas
+        """
+        if self._vocabulary is None:
+            import pandas as pd
+
+            self._vocabulary = pd.Index(self.tokens[self.ids], dtype=object)
+        return self._vocabulary
+
+    def __len__(self):
+        return len(self.token2id)
+
+    def doc2bow(self, tokens):
+        """
+        Same output as Dictionary.doc2bow: (token id, count) pairs sorted by id, unknown tokens ignored
+        """
+        token2id = self.token2id
+        counts = {}
+        for token in tokens:
+            token_id = token2id.get(token)
+            if token_id is not None:
+                counts[token_id] = counts.get(token_id, 0) + 1
+        return sorted(counts.items())
+
+    def doc2csr(self, texts):
+        """
+        Document-term CSR matrix of a list of tokenized documents, row d holds doc2bow(texts[d])
+        """
+        return texts_to_csr(texts, self)
+
+
+class LoadedModel(object):
+    def __init__(self, ldamodel):
+        self.ldamodel = ldamodel
+        self.random_state = ldamodel.random_state.get_state()
+
+
+def load_lda_model(path, mmap="r"):
+    """
+    Loads an LDA model once per process with its large arrays memory-mapped. Every call returns the
+    cached model with its random state reset to the saved one, so inference matches a fresh load
+    """
+    with _models_lock:
+        loaded = _models.get(path)
+        if loaded is None:
+            loaded = LoadedModel(models.ldamodel.LdaModel.load(path, mmap=mmap))
+            _models[path] = loaded
+            logging.info(
+                "Success: load lda model {} with {} tokens at {}".format(
+                    path, len(token_lookup(loaded.ldamodel.id2word)), datetime.today()
+                )
+            )
+        loaded.ldamodel.random_state.set_state(loaded.random_state)
+    return loaded.ldamodel
+
+
+def token_lookup(dictionary):
+    """
+    Precompiled token to id table of a gensim Dictionary, built once per dictionary
+    """
+    cached = _lookups.get(id(dictionary))
+    if cached is None or cached[0] is not dictionary:
+        cached = (dictionary, TokenLookup(dictionary))
+        _lookups[id(dictionary)] = cached
+    return cached[1]
@@ -0,0 +1,73 @@
+import os
+import json
+from collections import namedtuple
+from pathlib import Path
+
+
+ROOT = Path(__file__).parent.parent.resolve()
+
+RegisteredModel = namedtuple("RegisteredModel", ["version", "model_path", "reason_map"])
+
+
+def resolve_path(path):
+    """
+    Normalized path of a model, reason map or registry, relative paths are resolved from the repository
+    root like MODEL_LDA and REASON_MAP whatever the working directory
+    """
+    return os.path.normpath(str(ROOT / path))
+
+
+def load_registry(path):
+    """
+    Reads a model registry, a JSON file listing the LDA models scored side by side:
+    {"models": [{"version": "v1", "model": "lda_model", "reason_map": "model/topic_data.json"}, ...]}
+    Relative paths are resolved from the repository root, like MODEL_LDA and REASON_MAP
+    """
+    with open(path, "r") as registry_file:
+        entries = json.load(registry_file).get("models", [])
+    models = []
+    for entry in entries:
+        if not all(entry.get(key) for key in ("version", "model", "reason_map")):
+            raise ValueError("Invalid model registry entry {}, expected version, model and reason_map".format(entry))
+        models.append(RegisteredModel(str(entry["version"]), resolve_path(entry["model"]), resolve_path(entry["reason_map"])))
+    versions = [model.version for model in models]
+    if not models or len(set(versions)) != len(versions):
+        raise ValueError("Model registry {} must list at least one model with unique versions".format(path))
+    return models
+
+
+def default_registry(model_path, reason_map, version=None):
+    """
+    Registry of the single model configured by MODEL_LDA and REASON_MAP, versioned by its file name
+    """
+    return [RegisteredModel(version or os.path.basename(os.path.normpath(model_path)), model_path, reason_map)]
+
+
+def load_reason_maps(models):
+    """
+    Topic to reason mapping of every registered model, by version
+    """
+    mappings = {}
+    for model in models:
+        with open(model.reason_map, "r") as json_file:
+            mappings[model.version] = json.load(json_file)
+    return mappings
+
+
+
+def write_registry(path, models):
+    """
+    Writes a model registry listing models, paths are stored relative to the repository root
+    """
+    entries = [
+        {
+            "version": model.version,
+            "model": os.path.relpath(resolve_path(model.model_path), ROOT),
+            "reason_map": os.path.relpath(resolve_path(model.reason_map), ROOT),
+        }
+        for model in models
+    ]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as registry_file:
+        json.dump({"models": entries}, registry_file, indent=2)
+    os.replace(tmp_path, path)
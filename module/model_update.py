@@ -0,0 +1,201 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from gensim.models import LdaModel, LdaMulticore
+from gensim.models.coherencemodel import CoherenceModel
+from module.as_config import reason_model, reason_map, token_cache_path, model_registry, dedup_threshold as default_dedup_threshold
+from module.model_loader import token_lookup
+from module.model_registry import ROOT, RegisteredModel, resolve_path, write_registry
+from module.profiling import RunProfiler
+from module.reason_generation import NegReasonGeneration
+
+
+logger = logging.getLogger(__name__)
+
+# negative reviews read, normalized and folded into the model at a time
+UPDATE_BATCH_SIZE = 20000
+# every n-th review of the delta is held out to measure the drift instead of being trained on
+HOLDOUT_EVERY = 10
+MAX_HOLDOUT = 5000
+COHERENCE_TOP_N = 10
+# suffix of the metadata file written next to an updated model
+UPDATE_METADATA_SUFFIX = ".update.json"
+
+
+def versioned_path(model_path, version):
+    return "{}_{}".format(os.path.normpath(model_path), version)
+
+
+def read_update_metadata(model_path):
+    """
+    Metadata of a model written by update-model, None for a model trained in the notebook
+    """
+    path = model_path + UPDATE_METADATA_SUFFIX
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as metadata_file:
+        return json.load(metadata_file)
+
+
+def multicore_copy(ldamodel, workers):
+    """
+    LdaMulticore sharing the topic state of an LdaModel, its E-step is spread over worker processes.
+    The learned alpha and eta are passed as arrays, the online update keeps them fixed
+    """
+    multicore = LdaMulticore(
+        num_topics=ldamodel.num_topics, id2word=ldamodel.id2word, workers=workers, chunksize=ldamodel.chunksize,
+        passes=ldamodel.passes, alpha=ldamodel.alpha, eta=ldamodel.eta, decay=ldamodel.decay, offset=ldamodel.offset,
+        eval_every=None, iterations=ldamodel.iterations, gamma_threshold=ldamodel.gamma_threshold,
+        random_state=ldamodel.random_state, minimum_probability=ldamodel.minimum_probability, dtype=ldamodel.dtype,
+    )
+    multicore.state = ldamodel.state
+    multicore.num_updates = ldamodel.num_updates
+    multicore.sync_state()
+    return multicore
+
+
+def evaluate(ldamodel, holdout):
+    """
+    Perplexity of the held-out bag-of-words and UMass coherence of every topic over them
+    """
+    perplexity = float(np.exp2(-ldamodel.log_perplexity(holdout)))
+    coherence = CoherenceModel(
+        model=ldamodel, corpus=holdout, dictionary=ldamodel.id2word, coherence="u_mass", topn=COHERENCE_TOP_N
+    ).get_coherence_per_topic()
+    return {"perplexity": round(perplexity, 4), "coherence": [round(float(value), 4) for value in coherence]}
+
+
+def topic_drift(old_topics, new_topics):
+    """
+    Hellinger distance between the word distribution of every topic before and after the update
+    """
+    return np.sqrt(0.5 * ((np.sqrt(old_topics) - np.sqrt(new_topics)) ** 2).sum(axis=1))
+
+
+class ModelUpdater(object):
+    def __init__(self, model_path=reason_model, version=None, workers=1, batch_size=UPDATE_BATCH_SIZE,
+                 registry=model_registry, token_cache=token_cache_path, dedup_threshold=default_dedup_threshold,
+                 profile=None, sink="bigquery"):
+        """
+        Folds the negative reviews scraped since the last update into an LDA model with gensim's online
+        update and writes the result as a new version next to it. The topics keep their ids, so the
+        reason map of the model still applies; the drift report tells whether it should be revisited
+        """
+        self.model_path = resolve_path(model_path)
+        self.version = version or datetime.now().strftime("%Y%m%d%H%M%S")
+        self.workers = workers
+        self.batch_size = batch_size
+        self.registry = resolve_path(registry) if registry else None
+        # the reason pipeline reads and normalizes the reviews exactly as they are scored
+        self.reason = NegReasonGeneration(
+            token_cache=token_cache, sink=sink, dedup_threshold=dedup_threshold,
+            registry=self.registry if self.registry and os.path.exists(self.registry) else None,
+        )
+        self.profiler = RunProfiler("update-model", profile)
+        self.reason.profiler = self.profiler
+
+    def window_start(self, start):
+        """
+        Start of the reviews to fold in, by default the end of the window of the previous update
+        """
+        if start is not None:
+            return start
+        metadata = read_update_metadata(self.model_path)
+        if metadata is None:
+            raise ValueError("{} was not written by update-model, pass the start of the reviews to fold in".format(self.model_path))
+        return datetime.fromisoformat(metadata["trained_through"])
+
+    def iter_delta(self, start, end, dictionary):
+        """
+        Bag-of-words of the negative reviews of the jobs created in [start, end), in batches. Near-duplicate
+        reviews count once when deduplication is configured and reviews without a known word are skipped
+        """
+        for review in self.reason.iter_window_reviews(start, end, self.batch_size):
+            reviews = review["review"].dropna()
+            if len(reviews) == 0:
+                continue
+            processed = self.reason.preprocess(reviews)
+            _, processed = self.reason.cluster_representatives(processed)
+            bows = self.reason.doc2bow(self.reason.tokenize_review(processed), dictionary)
+            yield [bow for bow in bows if bow]
+
+    def update(self, start=None, end=None):
+        """
+        Updates the model with the reviews of the jobs created in [start, end) and returns the path of the new version
+        """
+        start = self.window_start(start)
+        end = end or datetime.now(timezone.utc).replace(tzinfo=None)
+        ldamodel = LdaModel.load(self.model_path)
+        old_topics = ldamodel.get_topics()
+        trainer = multicore_copy(ldamodel, self.workers) if self.workers > 1 else ldamodel
+        dictionary = token_lookup(ldamodel.id2word)
+        holdout = []
+        seen = trained = 0
+        for bows in self.iter_delta(start, end, dictionary):
+            train = []
+            for bow in bows:
+                if seen % HOLDOUT_EVERY == 0 and len(holdout) < MAX_HOLDOUT:
+                    holdout.append(bow)
+                else:
+                    train.append(bow)
+                seen += 1
+            if not train:
+                continue
+            with self.profiler.stage("lda_update", rows=len(train)):
+                if trainer is ldamodel:
+                    ldamodel.update(train, eval_every=0)
+                else:
+                    trainer.update(train)
+            trained += len(train)
+            logging.info(
+                "Success: fold {} reviews into the model, {} so far at {}".format(len(train), trained, datetime.today())
+            )
+        if trained == 0:
+            logging.info("No new reviews to update the model with {}".format(datetime.today()))
+            self.profiler.finish()
+            return None
+        if trainer is not ldamodel:
+            ldamodel.state = trainer.state
+            ldamodel.num_updates = trainer.num_updates
+            ldamodel.sync_state()
+
+        with self.profiler.stage("evaluation", rows=len(holdout)):
+            before = evaluate(LdaModel.load(self.model_path), holdout) if holdout else None
+            after = evaluate(ldamodel, holdout) if holdout else None
+        drift = topic_drift(old_topics, ldamodel.get_topics())
+        path = versioned_path(self.model_path, self.version)
+        report = {
+            "version": self.version,
+            "base_model": os.path.relpath(self.model_path, ROOT),
+            "model": os.path.relpath(path, ROOT),
+            "trained_from": pd.Timestamp(start).isoformat(),
+            "trained_through": pd.Timestamp(end).isoformat(),
+            "reviews": trained,
+            "holdout_reviews": len(holdout),
+            "before": before,
+            "after": after,
+            "topic_drift": [round(float(value), 4) for value in drift],
+        }
+        with self.profiler.stage("save"):
+            ldamodel.save(path)
+            with open(path + UPDATE_METADATA_SUFFIX, "w") as metadata_file:
+                json.dump(report, metadata_file, indent=2)
+        if self.registry:
+            # the registry starts from the models scored so far, MODEL_LDA alone when it does not exist yet
+            models = [model for model in self.reason.models if model.version != self.version]
+            write_registry(self.registry, models + [RegisteredModel(self.version, path, self.reason_map())])
+        logging.info("Success: write model {} at {}".format(path, datetime.today()))
+        self.profiler.finish(model_update=report)
+        return path
+
+    def reason_map(self):
+        """
+        Reason map of the base model, from the registry when it is registered there
+        """
+        for model in self.reason.models:
+            if resolve_path(model.model_path) == self.model_path:
+                return model.reason_map
+        return reason_map
@@ -0,0 +1,125 @@
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from itertools import chain
+from datetime import datetime
+from scipy.sparse.csgraph import connected_components
+
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 64
+SHINGLE_SIZE = 2
+# documents hashed together, bounds the (NUM_PERM, shingles) hash matrix of a chunk
+MINHASH_CHUNK_SIZE = 5000
+# odd 64-bit multiplier combining word ids into shingle ids and signature rows into band keys
+MIX = np.uint64(0x9E3779B97F4A7C15)
+EMPTY_HASH = np.iinfo(np.uint32).max
+
+
+def shingle_ids(texts, size=SHINGLE_SIZE):
+    """
+    64-bit ids of the shingles of size consecutive words of every tokenized document, as a flat array
+    with the document of every shingle. A document shorter than size is a single shingle of all its words
+    """
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codes, _ = pd.factorize(pd.Series(list(chain.from_iterable(texts)), dtype=object))
+    codes = codes.astype(np.uint64) + np.uint64(1)
+    docs = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    position = np.arange(len(codes), dtype=np.int64) - starts[docs]
+    remaining = lengths[docs] - position
+    shingles = codes.copy()
+    for offset in range(1, size):
+        extend = np.flatnonzero(remaining[:-offset] > offset)
+        shingles[extend] = shingles[extend] * MIX + codes[extend + offset]
+    valid = (remaining >= size) | ((position == 0) & (lengths[docs] < size))
+    return shingles[valid], docs[valid]
+
+
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1, chunk_size=MINHASH_CHUNK_SIZE):
+    """
+    (documents, num_perm) uint32 MinHash signatures of the word shingles of tokenized documents. Shingle
+    ids are mixed down to 32 bits once, the permutations are random odd multipliers and offsets modulo 2**32.
+    Documents without words get the all-max signature
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(0, EMPTY_HASH, size=(num_perm, 1), dtype=np.uint32, endpoint=True) | np.uint32(1)
+    increments = rng.integers(0, EMPTY_HASH, size=(num_perm, 1), dtype=np.uint32, endpoint=True)
+    shingles, docs = shingle_ids(texts, shingle_size)
+    shingles = ((shingles * MIX) >> np.uint64(32)).astype(np.uint32)
+    signatures = np.full((len(texts), num_perm), EMPTY_HASH, dtype=np.uint32)
+    bounds = np.searchsorted(docs, np.arange(0, len(texts) + chunk_size, chunk_size))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        # permutations along the rows so the per-document minimum reduces contiguous memory
+        hashes = multipliers * shingles[start:end]
+        hashes += increments
+        chunk_docs = docs[start:end]
+        firsts = np.flatnonzero(np.r_[True, chunk_docs[1:] != chunk_docs[:-1]])
+        signatures[chunk_docs[firsts]] = np.minimum.reduceat(hashes, firsts, axis=1).T
+    return signatures
+
+
+def lsh_bands(threshold, num_perm=NUM_PERM):
+    """
+    Number of bands and rows per band whose LSH S-curve, (1 / bands) ** (1 / rows), is closest to threshold
+    """
+    return min(
+        ((bands, num_perm // bands) for bands in range(1, num_perm + 1)),
+        key=lambda band: abs((1 / band[0]) ** (1 / band[1]) - threshold),
+    )
+
+
+def candidate_pairs(signatures, bands, rows):
+    """
+    Pairs of documents sharing at least one LSH band, every document is paired with the first
+    document of its bucket. Returns (documents, firsts) index arrays without repeated pairs
+    """
+    pairs = []
+    for band in range(bands):
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        for column in signatures[:, band * rows:(band + 1) * rows].T:
+            keys = keys * MIX + column.astype(np.uint64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bucket_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        firsts = order[np.flatnonzero(bucket_start)[np.cumsum(bucket_start) - 1]]
+        paired = firsts != order
+        pairs.append(order[paired].astype(np.int64) * len(signatures) + firsts[paired])
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.concatenate(pairs))
+    return pairs // len(signatures), pairs % len(signatures)
+
+
+def near_duplicate_clusters(texts, threshold, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+    """
+    Clusters tokenized documents whose estimated shingle Jaccard similarity is at least threshold.
+    LSH candidates are checked against their signatures and linked transitively. Returns, for every
+    document, the position of the first document of its cluster
+    """
+    if len(texts) == 0:
+        return np.empty(0, dtype=np.int64)
+    signatures = minhash_signatures(texts, num_perm, shingle_size)
+    bands, rows = lsh_bands(threshold, num_perm)
+    documents, firsts = candidate_pairs(signatures, bands, rows)
+    similar = np.empty(len(documents), dtype=bool)
+    for start in range(0, len(documents), MINHASH_CHUNK_SIZE):
+        end = start + MINHASH_CHUNK_SIZE
+        agreement = (signatures[documents[start:end]] == signatures[firsts[start:end]]).mean(axis=1)
+        similar[start:end] = agreement >= threshold
+    graph = scipy.sparse.csr_matrix(
+        (np.ones(similar.sum(), dtype=np.int8), (documents[similar], firsts[similar])), shape=(len(texts), len(texts))
+    )
+    _, labels = connected_components(graph, directed=False)
+    _, representatives = np.unique(labels, return_index=True)
+    clusters = representatives[labels]
+    logging.info(
+        "Success: cluster {} documents into {} near-duplicate clusters at {}".format(
+            len(texts), len(representatives), datetime.today()
+        )
+    )
+    return clusters
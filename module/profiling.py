@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def current_rss_mb():
+    """
+    Resident set size of this process in MB, the peak RSS where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+class StageStats(object):
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.peak_rss_mb = 0.0
+        # largest RSS growth of a single call over the RSS at its start
+        self.rss_growth_mb = 0.0
+
+    def merge(self, stats):
+        self.seconds += stats["seconds"]
+        self.calls += stats["calls"]
+        self.rows += stats["rows"]
+        self.peak_rss_mb = max(self.peak_rss_mb, stats["peak_rss_mb"])
+        self.rss_growth_mb = max(self.rss_growth_mb, stats.get("rss_growth_mb", 0.0))
+
+    def to_dict(self):
+        return {
+            "seconds": round(self.seconds, 4),
+            "calls": self.calls,
+            "rows": self.rows,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "rss_growth_mb": round(self.rss_growth_mb, 1),
+        }
+
+
+class RunProfiler(object):
+    def __init__(self, job, profile_path=None):
+        """
+        Stage timers, row counts and peak RSS of one pipeline run, with optional cProfile capture.
+        RSS is sampled by a background thread while a stage is running, every running stage call keeps
+        its own peak from the RSS at its start
+        """
+        self.job = job
+        self.profile_path = profile_path
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.profile = None
+        # [baseline, peak] RSS of every running stage call
+        self.running = {}
+        self.lock = threading.Lock()
+        self.sampler = None
+        if profile_path:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def _sample(self):
+        while True:
+            rss = current_rss_mb()
+            with self.lock:
+                if not self.running:
+                    # a stage starting after this point starts a new sampler
+                    self.sampler = None
+                    return
+                for usage in self.running.values():
+                    usage[1] = max(usage[1], rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Times a pipeline stage. The yielded stats accept a row count, stats.rows = n
+        """
+        with self.lock:
+            stats = self.stages.setdefault(name, StageStats())
+            baseline = current_rss_mb()
+            usage = [baseline, baseline]
+            self.running[id(usage)] = usage
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample, daemon=True)
+                self.sampler.start()
+        rows_before = stats.rows
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                del self.running[id(usage)]
+                peak = max(usage[1], current_rss_mb())
+                stats.seconds += elapsed
+                stats.calls += 1
+                if rows is not None and stats.rows == rows_before:
+                    stats.rows += rows
+                stats.peak_rss_mb = max(stats.peak_rss_mb, peak)
+                stats.rss_growth_mb = max(stats.rss_growth_mb, peak - baseline)
+
+    def merge(self, stages):
+        """
+        Adds the stage stats of another profiler, e.g. of a worker process
+        """
+        with self.lock:
+            for name, stats in stages.items():
+                self.stages.setdefault(name, StageStats()).merge(stats)
+
+    def stage_summary(self):
+        return {name: stats.to_dict() for name, stats in self.stages.items()}
+
+    def summary(self, **extra):
+        summary = {
+            "job": self.job,
+            "finished_at": str(datetime.today()),
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1),
+            "stages": self.stage_summary(),
+        }
+        summary.update(extra)
+        return summary
+
+    def finish(self, **extra):
+        """
+        Stops the profile capture and writes the run summary as one JSON line to stdout
+        """
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_path)
+            logger.info("cProfile stats written to {}".format(self.profile_path))
+        summary = self.summary(**extra)
+        sys.stdout.write(json.dumps(summary) + "\n")
+        sys.stdout.flush()
+        return summary
+
+
+def summary_rows(summary):
+    """
+    One row per stage of a run summary, the layout of the metrics table
+    """
+    return [
+        {
+            "job": summary["job"],
+            "stage": name,
+            "seconds": stats["seconds"],
+            "calls": stats["calls"],
+            "rows": stats["rows"],
+            "peak_rss_mb": stats["peak_rss_mb"],
+            "total_seconds": summary["total_seconds"],
+        }
+        for name, stats in summary["stages"].items()
+    ]
+
+
+def write_metrics(bq, summary, table_id, credentials, project_id):
+    """
+    Appends the per-stage rows of a run summary to the metrics table
+    """
+    import pandas as pd
+    from google.cloud import bigquery
+
+    metrics = pd.DataFrame(summary_rows(summary))
+    metrics["created_at"] = pd.Timestamp(summary["finished_at"])
+    job_config = bigquery.LoadJobConfig(
+        write_disposition="WRITE_APPEND",
+        schema=[bigquery.SchemaField("created_at", "DATETIME")],
+    )
+    bq.to_bq(metrics, table_id, credentials, project_id, job_config)
@@ -1,64 +1,217 @@
 import logging
 import warnings
 import pytz
-import re
 import hashlib
 import pandas as pd
 import numpy as np
 import json
+import pyarrow as pa
+import pyarrow.compute as pc
+from concurrent.futures import ProcessPoolExecutor
 from google.cloud import bigquery
-from datetime import datetime
-from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
-from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+from google.api_core.exceptions import NotFound
+from datetime import datetime, time
 from nltk.tokenize import RegexpTokenizer
-from gensim import corpora, models
-from module.as_config import BQ_CONFIG, APP_STORE_SCRAPING_TABLE, APP_STORE_LOG_TABLE, APP_STORE_NEG_REASON_RESULT_TABLE, APP_STORE_TOPIC_LOG_TABLE, reason_model, reason_map
+from module.as_config import BQ_CONFIG, SCRAP_CONFIG, APP_STORE_SCRAPING_TABLE, APP_STORE_LOG_TABLE, APP_STORE_NEG_REASON_RESULT_TABLE, APP_STORE_TOPIC_LOG_TABLE, reason_model, reason_map, token_cache_path, APP_STORE_METRICS_TABLE, APP_STORE_REASON_EXPLANATION_TABLE, APP_STORE_TOPIC_KEYWORD_TABLE, sink_path, model_registry, reason_model_version, dedup_threshold as default_dedup_threshold
 from module.bq_connection import BQConnection
+from module.review_queries import REASON_INPUT_COLUMNS, TARGET_COLUMNS, NEGATIVE_RATING, latest_scrape_job, negative_reviews, negative_reviews_between, indexed_model_versions
+from module.review_stream import rebatch
+from module.sink import make_sink
+from module.text_normalizer import TextNormalizer
+from module.topic_inference import dominant_topics_frame, topic_keywords
+from module.profiling import RunProfiler, write_metrics
+from module.model_loader import load_lda_model, token_lookup
+from module.model_registry import load_registry, default_registry, load_reason_maps, resolve_path
+from module.near_duplicates import near_duplicate_clusters
+from module.sparse_corpus import bows_to_csr
+from module.token_cache import TokenCache, review_hash, dictionary_fingerprint
+from module.watermark import review_key
 
 
 logger = logging.getLogger("Negative Review Reason Generation")
 warnings.filterwarnings("ignore")
 
+REASON_RESULT_SCHEMA = [
+    bigquery.SchemaField("job_id", "STRING"),
+    bigquery.SchemaField("date", "DATETIME"),
+    bigquery.SchemaField("review", "STRING"),
+    bigquery.SchemaField("rating", "FLOAT"),
+    bigquery.SchemaField("userName", "STRING"),
+    bigquery.SchemaField("title", "STRING"),
+    bigquery.SchemaField("review_processed", "STRING"),
+    bigquery.SchemaField("Topic_Class", "INTEGER"),
+    bigquery.SchemaField("Topic_Perc_Contrib", "FLOAT"),
+    bigquery.SchemaField("Reason", "STRING"),
+    bigquery.SchemaField("model_version", "STRING"),
+    bigquery.SchemaField("cluster_id", "INTEGER"),
+    bigquery.SchemaField("review_key", "INTEGER"),
+    bigquery.SchemaField("app_name", "STRING"),
+    bigquery.SchemaField("country", "STRING"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+# explanation of every result row, joined to it on (job_id, review_key, model_version)
+REASON_EXPLANATION_SCHEMA = [
+    bigquery.SchemaField("job_id", "STRING"),
+    bigquery.SchemaField("review_key", "INTEGER"),
+    bigquery.SchemaField("model_version", "STRING"),
+    bigquery.SchemaField("Topic_Class", "INTEGER"),
+    bigquery.SchemaField("Confidence", "FLOAT"),
+    bigquery.SchemaField("Top_Tokens", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("Token_Weights", "FLOAT", mode="REPEATED"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+# the list columns are written as Parquet lists, loaded as REPEATED fields with list inference
+REASON_EXPLANATION_ARROW_SCHEMA = pa.schema([
+    ("job_id", pa.string()),
+    ("review_key", pa.int64()),
+    ("model_version", pa.string()),
+    ("Topic_Class", pa.int64()),
+    ("Confidence", pa.float64()),
+    ("Top_Tokens", pa.list_(pa.string())),
+    ("Token_Weights", pa.list_(pa.float64())),
+    ("created_at", pa.timestamp("us")),
+])
+TOPIC_KEYWORD_SCHEMA = [
+    bigquery.SchemaField("model_version", "STRING"),
+    bigquery.SchemaField("Topic_Class", "INTEGER"),
+    bigquery.SchemaField("rank", "INTEGER"),
+    bigquery.SchemaField("token", "STRING"),
+    bigquery.SchemaField("weight", "FLOAT"),
+    bigquery.SchemaField("Reason", "STRING"),
+    bigquery.SchemaField("created_at", "DATETIME"),
+]
+# reviews scored and flushed together by generate_reason_window, bounds its memory
+WINDOW_BATCH_SIZE = 20000
+TOPIC_LOG_SCHEMA = [
+    bigquery.SchemaField("created_at", "DATETIME"),
+    bigquery.SchemaField("scrap_job_id", "STRING"),
+    bigquery.SchemaField("job_id", "STRING"),
+]
+
+def result_job_config():
+    return bigquery.LoadJobConfig(
+        write_disposition="WRITE_APPEND",
+        schema=REASON_RESULT_SCHEMA,
+        # model_version, cluster_id, review_key, app_name and country are added to result tables created before them
+        schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+    )
+
+
+def explanation_job_config():
+    parquet_options = bigquery.ParquetOptions()
+    parquet_options.enable_list_inference = True
+    return bigquery.LoadJobConfig(
+        write_disposition="WRITE_APPEND",
+        schema=REASON_EXPLANATION_SCHEMA,
+        parquet_options=parquet_options,
+    )
+
+
+def with_target_columns(reviews, default_app, default_country):
+    """
+    Arrow table or record batch of reviews with the REASON_INPUT_COLUMNS, in that order. Reviews scraped
+    without app_name and country, before multi-target scraping, belong to the default app
+    """
+    defaults = {"app_name": default_app, "country": default_country}
+    columns = []
+    for column in REASON_INPUT_COLUMNS:
+        if column in defaults:
+            values = reviews.column(column).cast(pa.string()) if column in reviews.schema.names else pa.nulls(reviews.num_rows, pa.string())
+            values = pc.fill_null(values, pa.scalar(defaults[column], pa.string()))
+        else:
+            values = reviews.column(column)
+        columns.append(values)
+    return type(reviews).from_arrays(columns, names=REASON_INPUT_COLUMNS)
+
+
+# per process state of the reason generation workers, filled once by _init_worker
+_worker = {}
+
+
+def _init_worker(models, mapping_dicts, token_cache):
+    """
+    Loads every registered LDA model and the text pipeline once per worker process
+    """
+    _worker["reason"] = NegReasonGeneration(token_cache=token_cache)
+    _worker["models"] = {}
+    for model in models:
+        ldamodel = load_lda_model(model.model_path)
+        _worker["models"][model.version] = (ldamodel, ldamodel.random_state.get_state())
+    _worker["mapping_dicts"] = mapping_dicts
+
+
+def _preprocess_chunk(reviews):
+    """
+    Normalizes one chunk of reviews in a worker process
+    """
+    reason = _worker["reason"]
+    reason.profiler = RunProfiler("generate-reason worker")
+    processed = reason.preprocess(reviews)
+    return processed, reason.profiler.stage_summary()
+
+
+def _score_chunk(version, offset, reviews, processed):
+    """
+    Scores one chunk of normalized reviews with one model in a worker process. The model random state is
+    moved to the position the serial run would have after `offset` documents, so the inferred topics match the serial path
+    """
+    ldamodel, random_state = _worker["models"][version]
+    ldamodel.random_state.set_state(random_state)
+    # inference draws one initial gamma row per document
+    ldamodel.random_state.gamma(100., 1. / 100., (offset, ldamodel.num_topics))
+    reason = _worker["reason"]
+    reason.profiler = RunProfiler("generate-reason worker")
+    topics = reason.infer_topics(reviews, processed, ldamodel, _worker["mapping_dicts"][version])
+    return topics, reason.profiler.stage_summary()
+
+
 class NegReasonGeneration(object):
-    def __init__(self):
-        self.credential_datamart = BQ_CONFIG["CRED"]
+    def __init__(self, token_cache=token_cache_path, profile=None, sink="bigquery", registry=model_registry, dedup_threshold=default_dedup_threshold):
         self.project_id = BQ_CONFIG["PROJECT"]
         self.dataset = BQ_CONFIG["DB"]
         self.input_table = APP_STORE_SCRAPING_TABLE
+        # app_name and country of the reviews scraped before multi-target scraping
+        self.scrap_config = SCRAP_CONFIG
         self.log_table = APP_STORE_LOG_TABLE
         self.log_topic_table = APP_STORE_TOPIC_LOG_TABLE
         self.output_table = APP_STORE_NEG_REASON_RESULT_TABLE
         self.model = reason_model
         self.reason_map = reason_map
+        # models scored side by side, the single MODEL_LDA model unless a registry is configured
+        self.models = load_registry(resolve_path(registry)) if registry else default_registry(reason_model, reason_map, reason_model_version)
+        # near-duplicate reviews above this shingle similarity are inferred once, disabled when None
+        self.dedup_threshold = dedup_threshold
         self.bq = BQConnection()
-        self.stopword = StopWordRemoverFactory().create_stop_word_remover()
-        self.stemmer = StemmerFactory().create_stemmer()
+        self.normalizer = TextNormalizer()
         self.regex = RegexpTokenizer(r'\w+')
+        self.token_cache_path = token_cache
+        self.token_cache = TokenCache(token_cache, self.normalizer.fingerprint()) if token_cache else None
+        self.metrics_table = APP_STORE_METRICS_TABLE
+        # top tokens and confidence of the reasons, and the keyword index of the models, skipped when unset
+        self.explanation_table = APP_STORE_REASON_EXPLANATION_TABLE
+        self.keyword_table = APP_STORE_TOPIC_KEYWORD_TABLE
+        self.profiler = RunProfiler("generate-reason", profile)
+        self.sink = make_sink(sink, sink_path, self.bq, BQ_CONFIG)
+
+    @property
+    def credential_datamart(self):
+        return BQ_CONFIG["CRED"]
 
     def clean_review(self,review):
         """
         Converts review to lowercase, removes non-alphabetic characters and stopwords, applies stemming
         """
-        review = review.lower()
-        review = re.sub(r'[^a-zA-Z]', ' ', review)
-        review = re.sub(r'\s\s+', ' ', review)
-        review = self.stopword.remove(review)
-        review = self.stemmer.stem(review)
-        logging.info(
-                "Success: cleanse data at {}".format(
-                    datetime.today()
-                )
-            )
-        return review
+        return self.normalizer.clean_review(review)
     
     def tokenize_review(self, clean_review_df):
         """
         Tokenizes reviews, using a tokenizer object, and appends tokens to a list
         """
-        texts = []
-        for i in clean_review_df:
-            tokens = self.regex.tokenize(i)
-            texts.append(tokens)
+        with self.profiler.stage("tokenization", rows=len(clean_review_df)):
+            texts = []
+            for i in clean_review_df:
+                tokens = self.regex.tokenize(i)
+                texts.append(tokens)
         logging.info(
                 "Success: generate token at {}".format(
                     datetime.today()
@@ -67,130 +220,387 @@ class NegReasonGeneration(object):
         return texts
     
     def convert_typo(self, text):
-        # Typo conversion dictionary
-        typo_indo = {
-            "apk" : "aplikasi",
-            "gak" : "tidak",
-            "ga" : "tidak",
-            "gk" : "tidak",
-            "gabisa" : "tidak bisa",
-            "claim" : "klaim",
-            "smua" : "semua",
-            "application" : "aplikasi",
-            "bner" : "benar",
-            "bener" : "benar",
-            "mw" : "mau",
-            "ngak" : "tidak",
-            "udah" : "sudah",
-            "udh" : "sudah",
-            "kalo" : "kalau",
-            "can" : "bisa",
-            "cannot" : "tidak bisa",
-            "cant" : "tidak bisa",
-            "yg" : "yang",
-            "tp" : "tapi",
-            "gw" : "saya",
-            "aq" : "saya",
-            "aku" : "saya",
-            "ak" : "saya",
-            "gua" : "saya",
-            "gue" : "saya",
-            "apps" : "aplikasi",
-            "app" : "aplikasi",
-            "not" : "tidak",
-            "login" : "buka",
-            "logout" : "keluar",
-            "eror" : "error",
-            "aja" : "saja",
-            "bikin" : "daftar",
-            "buat" : "daftar"
-        }
-        
-        # Split the text into words
-        words = text.split()
-        # Iterate through each word
-        for i, word in enumerate(words):
-            # Check if the word exists in the typo_indo dictionary
-            if word.lower() in typo_indo:
-                # Replace the word with its corresponding value from the dictionary
-                words[i] = typo_indo[word.lower()]
-
-        # Join the words back into a single string
-        converted_text = ' '.join(words)
-        logging.info(
-                "Success: convert typo data at {}".format(
-                    datetime.today()
-                )
-            )
-        return converted_text
+        return self.normalizer.convert_typo(text)
 
     def format_topics_sentences(self, ldamodel, corpus, mapping_dict):
-        # Init output
-        sent_topics_df = pd.DataFrame()
-
-        # Get main topic in each document
-        for i, row_list in enumerate(ldamodel[corpus]):
-            row = row_list[0] if ldamodel.per_word_topics else row_list
-            row = sorted(row, key=lambda x: (x[1]), reverse=True)
-            # Get the Dominant topic, Perc Contribution and Keywords for each document
-            for j, (topic_num, prop_topic) in enumerate(row):
-                if j == 0:
-                    topic_num = str(topic_num)
-                    if topic_num in mapping_dict.keys():
-                        value = mapping_dict[topic_num]
-                    else:
-                        value = "not found"
-                    sent_topics_df = sent_topics_df._append(pd.Series([int(topic_num), round(prop_topic,4), value]), ignore_index=True)
-                else:
-                    break
-        sent_topics_df.columns = ['Topic_Class', 'Perc_Contribution', 'Reason']
+        """
+        Returns the dominant topic, its contribution and the mapped reason of every document, with its
+        confidence and top contributing tokens when the explanation table is configured
+        """
+        sent_topics_df = dominant_topics_frame(ldamodel, corpus, mapping_dict, explain=bool(self.explanation_table))
         logging.info(
                 "Success: generate reason data at {}".format(
                     datetime.today()
                 )
             )
-        # Add original text to the end of the output
         return(sent_topics_df)
-    
 
-    def generate_reason(self):
-        client = bigquery.Client(
-                credentials=self.credential_datamart, project=self.project_id
+    def preprocess(self, reviews):
+        """
+        Normalized text of every review, shared by all registered models. Reviews whose normalized text
+        is empty are dropped, the index of the result is that of the kept reviews
+        """
+        if self.token_cache is None:
+            return self.normalize_reviews(reviews).dropna()
+        return self.cached_processed(reviews.dropna())
+
+    def infer_topics(self, reviews, processed, ldamodel, mapping_dict):
+        """
+        Dominant topic of every normalized review for one model, reviews are the raw texts of processed
+        """
+        corpus = self.build_corpus(reviews.loc[processed.index], processed, token_lookup(ldamodel.id2word))
+        with self.profiler.stage("lda_inference", rows=corpus.shape[0]):
+            return self.format_topics_sentences(ldamodel=ldamodel, corpus=corpus, mapping_dict=mapping_dict)
+
+    def normalize_reviews(self, reviews):
+        with self.profiler.stage("text_normalization", rows=len(reviews)):
+            return self.normalizer.normalize(reviews)
+
+    def doc2bow(self, texts, dictionary):
+        """
+        Converts tokenized documents into a document-term matrix
+        """
+        with self.profiler.stage("doc2bow", rows=len(texts)):
+            return [dictionary.doc2bow(text) for text in texts]
+
+    def doc2csr(self, texts, dictionary):
+        """
+        Converts tokenized documents into a CSR document-term matrix
+        """
+        with self.profiler.stage("doc2csr", rows=len(texts)):
+            return dictionary.doc2csr(list(texts))
+
+    def build_corpus(self, reviews, processed, dictionary):
+        """
+        CSR document-term matrix of the normalized reviews for one dictionary. With the token cache the
+        bag-of-words are taken from it by raw review text, only the missing reviews are tokenized
+        """
+        if self.token_cache is None:
+            return self.doc2csr(self.tokenize_review(processed), dictionary)
+        keys = [review_hash(text) for text in reviews]
+        dictionary_id = dictionary_fingerprint(dictionary)
+        with self.profiler.stage("token_cache"):
+            bows = self.token_cache.get_bows(keys, dictionary_id)
+        missing = [i for i, key in enumerate(keys) if key not in bows]
+        if missing:
+            texts = self.tokenize_review(processed.iloc[missing])
+            items = list(zip([keys[i] for i in missing], self.doc2bow(texts, dictionary)))
+            self.token_cache.put_bows(items, dictionary_id)
+            bows.update(items)
+        logging.info(
+                "Success: token cache bag-of-words hits {} of {} reviews at {}".format(
+                    len(reviews) - len(missing), len(reviews), datetime.today()
+                )
+            )
+        return bows_to_csr([bows[key] for key in keys], dictionary.num_terms)
+
+    def cached_processed(self, reviews):
+        """
+        Normalized texts of the reviews, taken from the token cache when the same review text was
+        processed before. Only the missing reviews go through the text pipeline
+        """
+        with self.profiler.stage("token_cache", rows=len(reviews)):
+            keys = [review_hash(text) for text in reviews]
+            cached = self.token_cache.get_processed(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if missing:
+            fresh = self.normalize_reviews(reviews.iloc[missing])
+            items = list(zip([keys[i] for i in missing], fresh))
+            self.token_cache.put_processed(items)
+            cached.update(items)
+        logging.info(
+                "Success: token cache hits {} of {} reviews at {}".format(
+                    len(reviews) - len(missing), len(reviews), datetime.today()
+                )
+            )
+        return pd.Series([cached[key] for key in keys], index=reviews.index, name=reviews.name, dtype=object)
+
+    def near_duplicates(self, processed):
+        """
+        Position of the first review of the near-duplicate cluster of every normalized review, found with
+        MinHash LSH over its word shingles. Every review is its own cluster when deduplication is disabled
+        """
+        if self.dedup_threshold is None:
+            return np.arange(len(processed))
+        texts = self.tokenize_review(processed)
+        with self.profiler.stage("dedup", rows=len(texts)):
+            return near_duplicate_clusters(texts, self.dedup_threshold)
+
+    def worker_pool(self, workers):
+        """
+        Process pool of score_reviews, every worker loads the registered models and the token cache once
+        """
+        return ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(self.models, load_reason_maps(self.models), self.token_cache_path),
+        )
+
+    def score_reviews(self, reviews, workers=1, executor=None):
+        """
+        Assigns topics to a review column with every registered model. The reviews are normalized once,
+        clustered by near-duplicates and the first review of every cluster is scored by each model, its
+        topic is fanned out to the other members. Returns the normalized reviews, the topics by model
+        version and the cluster of every normalized review. With several workers the normalization is
+        sharded across processes, then the inference of every (model, chunk) pair; chunks are merged back
+        in document order and match the serial output. The processes are those of executor, a pool of
+        worker_pool reused across batches, else a pool is started for this call
+        """
+        workers = max(1, min(workers, len(reviews)))
+        if workers == 1:
+            mapping_dicts = load_reason_maps(self.models)
+            processed = self.preprocess(reviews)
+            clusters, unique = self.cluster_representatives(processed)
+            topics = {}
+            for model in self.models:
+                ldamodel = load_lda_model(model.model_path)
+                topics[model.version] = self.infer_topics(reviews, unique, ldamodel, mapping_dicts[model.version])
+            return processed, self.fan_out(topics, clusters), clusters
+        if executor is None:
+            with self.worker_pool(workers) as executor:
+                return self.score_reviews(reviews, workers, executor)
+
+        bounds = np.linspace(0, len(reviews), workers + 1).astype(int)
+        chunks = [reviews.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        results = list(executor.map(_preprocess_chunk, chunks))
+        processed = pd.concat([result[0] for result in results])
+        clusters, unique = self.cluster_representatives(processed)
+        bounds = np.linspace(0, len(unique), workers + 1).astype(int)
+        tasks = [
+            (model.version, start, reviews.loc[unique.index[start:end]], unique.iloc[start:end])
+            for model in self.models
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+        scored = list(executor.map(_score_chunk, *zip(*tasks)))
+        for result in results + scored:
+            self.profiler.merge(result[-1])
+        topics = {
+            model.version: pd.concat(
+                [result[0] for task, result in zip(tasks, scored) if task[0] == model.version], ignore_index=True
+            )
+            for model in self.models
+        }
+        logging.info(
+                "Success: score {} reviews with {} models and {} workers at {}".format(
+                    len(reviews), len(self.models), workers, datetime.today()
+                )
+            )
+        return processed, self.fan_out(topics, clusters), clusters
+
+    def cluster_representatives(self, processed):
+        """
+        Near-duplicate cluster of every normalized review, as a series named cluster_id, and the normalized
+        reviews that are the first of their cluster, the only ones going through topic inference
+        """
+        clusters = pd.Series(self.near_duplicates(processed), index=processed.index, name="cluster_id")
+        return clusters, processed.iloc[np.unique(clusters.values)]
+
+    def fan_out(self, topics, clusters):
+        """
+        Topics of every normalized review from the topics of the first review of its cluster
+        """
+        representatives = np.unique(clusters.values)
+        if len(representatives) == len(clusters):
+            return topics
+        members = np.searchsorted(representatives, clusters.values)
+        return {version: frame.iloc[members].reset_index(drop=True) for version, frame in topics.items()}
+
+    def score_frame(self, review, workers=1, executor=None):
+        """
+        Result rows of a frame of reviews with a review text, one set of rows per registered model
+        """
+        processed_review, model_topics, clusters = self.score_reviews(review['review'], workers, executor)
+        review['review_processed'] = processed_review
+        # near-duplicate reviews share the cluster id and the topic of the first review of the cluster
+        review['cluster_id'] = clusters.astype("Int64")
+        # key of the review shared with the explanation table, the 64-bit hash stored as a signed integer
+        review['review_key'] = np.array(
+            [review_key(*key) for key in zip(review['userName'], review['date'], review['title'])], dtype=np.uint64
+        ).view(np.int64)
+        # Format, one set of rows per registered model
+        scored = []
+        for version, df_topic_sents_keywords in model_topics.items():
+            df_dominant_topic = df_topic_sents_keywords.reset_index().rename(
+                columns={'index': 'Document_No', 'Perc_Contribution': 'Topic_Perc_Contrib'}
+            )
+            scored.append(
+                review.reset_index().merge(df_dominant_topic, how = 'left', left_index = True, right_index = True).drop(columns=['index','Document_No']).assign(model_version=version)
+            )
+        return pd.concat(scored, ignore_index=True)
+
+    def write_results(self, result, job_id, created_at):
+        """
+        Writes the result rows of a job and, when configured, their explanations to the side table
+        """
+        columns = [field.name for field in REASON_RESULT_SCHEMA]
+        with self.profiler.stage("sink_write", rows=len(result)):
+            self.sink.write(result[columns], self.output_table, job_id, created_at, result_job_config())
+        if self.explanation_table:
+            explanation = result[[field.name for field in REASON_EXPLANATION_SCHEMA]]
+            with self.profiler.stage("sink_write", rows=len(explanation)):
+                self.sink.write(
+                    explanation, self.explanation_table, job_id, created_at, explanation_job_config(),
+                    schema=REASON_EXPLANATION_ARROW_SCHEMA,
+                )
+
+    def indexed_versions(self):
+        """
+        Model versions already in the topic keyword index
+        """
+        if self.sink.name == "local":
+            index = self.sink.read(self.keyword_table)
+            return set() if index is None else set(index["model_version"].to_pylist())
+        query, query_config = indexed_model_versions(self.dataset, self.keyword_table)
+        try:
+            index = self.bq.read_bq_arrow(query, self.credential_datamart, self.project_id, query_config)
+        except NotFound:
+            return set()
+        return set(index["model_version"].to_pylist())
+
+    def write_keyword_index(self, job_id, created_at):
+        """
+        Writes the top words of every topic of the registered models missing from the keyword index,
+        once per model version
+        """
+        if not self.keyword_table:
+            return
+        indexed = self.indexed_versions()
+        mapping_dicts = load_reason_maps(self.models)
+        for model in self.models:
+            if model.version in indexed:
+                continue
+            keywords = topic_keywords(load_lda_model(model.model_path), mapping_dicts[model.version])
+            keywords.insert(0, "model_version", model.version)
+            keywords["created_at"] = created_at
+            job_config = bigquery.LoadJobConfig(write_disposition="WRITE_APPEND", schema=TOPIC_KEYWORD_SCHEMA)
+            with self.profiler.stage("sink_write", rows=len(keywords)):
+                self.sink.write(keywords, self.keyword_table, job_id, created_at, job_config)
+            logging.info(
+                "Success: index the keywords of model {} at {}".format(model.version, datetime.today())
             )
+
+    def read_latest_job(self, since):
+        """
+        job_id and created_at of the most recent scraping job logged after the start of the day of since
+        """
+        if self.sink.name == "local":
+            log = self.sink.read(self.log_table)
+            if log is None:
+                return pd.DataFrame(columns=["job_id", "created_at"])
+            log = log.select(["job_id", "created_at"]).to_pandas()
+            log = log[log["created_at"] > datetime.combine(since.date(), time.min)]
+            return log.sort_values("created_at", ascending=False).head(1)
+        query, query_config = latest_scrape_job(self.dataset, self.log_table, since)
+        return self.bq.read_bq_arrow(query, self.credential_datamart, self.project_id, query_config).to_pandas()
+
+    def input_columns(self):
+        """
+        REASON_INPUT_COLUMNS of the scraping table, without the target columns of a table scraped before them
+        """
+        existing = self.bq.table_columns(self.dataset + "." + self.input_table, self.credential_datamart, self.project_id)
+        return [column for column in REASON_INPUT_COLUMNS if column not in TARGET_COLUMNS or column in existing]
+
+    def with_target_columns(self, reviews):
+        return with_target_columns(reviews, self.scrap_config["APP_NAME"], str(self.scrap_config["COUNTRY"]).lower())
+
+    def read_job_reviews(self, job_id, job_created_at):
+        """
+        Negative reviews of one scraping job, with the columns the reason pipeline uses
+        """
+        if self.sink.name == "local":
+            staged = self.sink.read(self.input_table, job_id)
+            if staged is None:
+                return pd.DataFrame(columns=REASON_INPUT_COLUMNS)
+            review = self.with_target_columns(staged).to_pandas()
+            return review[review["rating"] <= NEGATIVE_RATING].reset_index(drop=True)
+        query, query_config = negative_reviews(self.dataset, self.input_table, job_id, job_created_at, self.input_columns())
+        return self.with_target_columns(self.bq.read_bq_arrow(query, self.credential_datamart, self.project_id, query_config)).to_pandas()
+
+    def iter_window_reviews(self, start, end, batch_size=WINDOW_BATCH_SIZE):
+        """
+        Negative reviews of the scraping jobs created in [start, end), streamed as frames of batch_size
+        reviews. Pages are only read as frames are consumed, one frame is held at a time
+        """
+        if self.sink.name == "local":
+            batches = (
+                batch.filter(pc.less_equal(batch["rating"], NEGATIVE_RATING))
+                for batch in self.sink.iter_batches(self.input_table, REASON_INPUT_COLUMNS, start, end)
+            )
+        else:
+            query, query_config = negative_reviews_between(self.dataset, self.input_table, start, end, self.input_columns())
+            batches = self.bq.read_bq_batches(query, self.credential_datamart, self.project_id, query_config, page_size=batch_size)
+        tables = rebatch((self.with_target_columns(batch) for batch in batches), batch_size)
+        while True:
+            with self.profiler.stage("read") as stats:
+                table = next(tables, None)
+                if table is None:
+                    return
+                stats.rows += table.num_rows
+            yield table.to_pandas()
+
+    def generate_reason_window(self, start, end, batch_size=WINDOW_BATCH_SIZE, workers=1):
+        """
+        Scores the negative reviews of every scraping job created in [start, end), e.g. to re-score months
+        of history with a new model. Reviews are streamed in batches of batch_size, each batch is scored
+        and flushed to the sink before the next one is read so memory does not grow with the window.
+        The log row is written once every batch is loaded. With several workers one process pool scores
+        every batch, the models are loaded once per window
+        """
         jakarta_tz = pytz.timezone("Asia/Jakarta")
         jakarta_time = datetime.now(jakarta_tz)
-        query = """
-                SELECT  *
-                FROM
-                `{dataset}.{log_table}`
-                WHERE
-                created_at > date('{date}')
-                qualify row_number() over (order by created_at desc)=1
-                """.format(
-            dataset = self.dataset, log_table = self.log_table, date = jakarta_time
+        hash_hex = hashlib.sha256(str(jakarta_time).encode()).hexdigest()
+        scored = 0
+        executor = self.worker_pool(workers) if workers > 1 else None
+        try:
+            for review in self.iter_window_reviews(start, end, batch_size):
+                review.dropna(subset=['review'], inplace=True)
+                if len(review) == 0:
+                    continue
+                result = self.score_frame(review, workers, executor)
+                result["created_at"] = jakarta_time
+                self.write_results(result, hash_hex, jakarta_time)
+                with self.profiler.stage("sink_flush"):
+                    self.sink.flush()
+                scored += len(review)
+                logging.info(
+                    "Success: score {} reviews of the window, {} so far at {}".format(
+                        len(review), scored, datetime.today()
+                    )
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.write_keyword_index(hash_hex, jakarta_time)
+        log_data = pd.DataFrame({'created_at': [jakarta_time], 'scrap_job_id': [''], 'job_id': [hash_hex]})
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_APPEND",
+            schema=TOPIC_LOG_SCHEMA,
         )
-        query_job = client.query(query)
-        log = query_job.result()
-        log = log.to_dataframe()
+        with self.profiler.stage("sink_write", rows=len(log_data)):
+            self.sink.write(log_data, self.log_topic_table, hash_hex, jakarta_time, job_config, commit=True)
+        with self.profiler.stage("sink_flush"):
+            self.sink.flush()
+        logging.info(
+            "Finished scoring {} reviews of the jobs created from {} to {} at {}".format(
+                scored, start, end, datetime.today()
+            )
+        )
+        self.finish_run()
+
+    def generate_reason(self, workers=1):
+        jakarta_tz = pytz.timezone("Asia/Jakarta")
+        jakarta_time = datetime.now(jakarta_tz)
+        log_data = None
+        with self.profiler.stage("read"):
+            log = self.read_latest_job(jakarta_time)
         logging.info(
             "Success: load log data at {}".format(
                 datetime.today()
             )
         )
         if len(log)>0:
-            query = """
-                SELECT  *
-                FROM
-                `{dataset}.{input_table}`
-                WHERE
-                job_id = '{id}'
-                and rating<=2
-                """.format(
-            dataset = self.dataset, input_table = self.input_table, id = log["job_id"].values[0]
-            )
-            query_job = client.query(query)
-            review = query_job.result()
-            review = review.to_dataframe()
+            with self.profiler.stage("read") as stats:
+                review = self.read_job_reviews(log["job_id"].values[0], log["created_at"].iloc[0].to_pydatetime())
+                stats.rows += len(review)
             logging.info(
                 "Success: load log data at {}".format(
                     datetime.today()
@@ -198,48 +608,16 @@ class NegReasonGeneration(object):
             )
 
             if len(review)>0:
-                processed_review = review['review'].apply(lambda x: self.convert_typo(x))
-                review['review_processed'] = processed_review
-                review['review_processed'] = review['review_processed'].apply(lambda x: self.clean_review(x))
-                # drop nan value
-                review.dropna(subset=['review_processed'], inplace=True)
+                # drop nan value, these are the only reviews without a processed text
+                review.dropna(subset=['review'], inplace=True)
                 if len(review)>0:
-                    clean_token_neg = self.tokenize_review(review['review_processed'])
-                    ldamodel = models.ldamodel.LdaModel.load(self.model)
-                    dictionary = ldamodel.id2word
-                    # convert tokenized documents into a document-term matrix
-                    corpus = [dictionary.doc2bow(text) for text in clean_token_neg]
-                    with open(self.reason_map, "r") as json_file:
-                        loaded_data = json.load(json_file)
-                    df_topic_sents_keywords = self.format_topics_sentences(ldamodel=ldamodel, corpus=corpus,  mapping_dict=loaded_data)
-                    # Format
-                    df_dominant_topic = df_topic_sents_keywords.reset_index()
-                    df_dominant_topic.columns = ['Document_No', 'Topic_Class', 'Topic_Perc_Contrib', 'Reason']
-                    review = review.reset_index().merge(df_dominant_topic, how = 'left', left_index = True, right_index = True).drop(columns=['index','Document_No', 'created_at'])
+                    review = self.score_frame(review, workers)
                     jakarta_tz = pytz.timezone("Asia/Jakarta")
                     jakarta_time = datetime.now(jakarta_tz)
                     review["created_at"] = jakarta_time
                     
-                    job_config = bigquery.LoadJobConfig(
-                        write_disposition="WRITE_APPEND",
-                        schema=[
-                            bigquery.SchemaField("created_at", "DATETIME"),
-                            bigquery.SchemaField("job_id", "STRING")
-                        ],
-                    )
-                    self.bq.to_bq(
-                            review,
-                            self.dataset + "." + self.output_table,
-                            self.credential_datamart,
-                            self.project_id,
-                            job_config,
-                        )
-                    logging.info(
-                        "Success: ingest reason data at {}".format(
-                            datetime.today()
-                        )
-                    )
                     scrap_id = review["job_id"].values[0]
+                    self.write_results(review, scrap_id, jakarta_time)
                     # Convert datetime to string
                     datetime_str = str(jakarta_time)
 
@@ -248,25 +626,10 @@ class NegReasonGeneration(object):
                     hash_hex = hash_object.hexdigest()
                     log_data = {'created_at': [jakarta_time], 'scrap_job_id': [scrap_id], 'job_id': [hash_hex]}
                     log_data = pd.DataFrame(log_data)
-                    
+                    self.write_keyword_index(hash_hex, jakarta_time)
 
-            else:
-                logging.info(
-                    "No data to predict the reason {}".format(
-                        datetime.today()
-                    )
-                )
-                jakarta_tz = pytz.timezone("Asia/Jakarta")
-                jakarta_time = datetime.now(jakarta_tz)
-                # Convert datetime to string
-                datetime_str = str(jakarta_time)
-
-                # Calculate the SHA-256 hash
-                hash_object = hashlib.sha256(datetime_str.encode())
-                hash_hex = hash_object.hexdigest()
-                log_data = {'created_at': [jakarta_time], 'scrap_job_id': [''], 'job_id': [hash_hex]}
-                log_data = pd.DataFrame(log_data)
-        else:
+        # no job, no review or only reviews without text: nothing was scored
+        if log_data is None:
             logging.info(
                 "No data to predict the reason {}".format(
                     datetime.today()
@@ -286,21 +649,25 @@ class NegReasonGeneration(object):
 
         job_config = bigquery.LoadJobConfig(
                             write_disposition="WRITE_APPEND",
-                            schema=[
-                                bigquery.SchemaField("created_at", "DATETIME"),
-                                bigquery.SchemaField("job_id", "STRING")
-                            ],
+                            schema=TOPIC_LOG_SCHEMA,
                         )
                     
-        self.bq.to_bq(
-                            log_data,
-                            self.dataset + "." + self.log_topic_table,
-                            self.credential_datamart,
-                            self.project_id,
-                            job_config,
-                        )
+        with self.profiler.stage("sink_write", rows=len(log_data)):
+            self.sink.write(log_data, self.log_topic_table, hash_hex, jakarta_time, job_config, commit=True)
+        # the reasons are loaded before the log, a log row means the job is done
+        with self.profiler.stage("sink_flush"):
+            paths = self.sink.flush()
         logging.info(
-            "Finished inserting rows of log data at {}".format(
-                datetime.today()
+            "Finished inserting {} files of reason and log data at {}".format(
+                len(paths), datetime.today()
             )
         )
+        self.finish_run()
+
+    def finish_run(self):
+        """
+        Emits the per-run summary and appends it to the metrics table when one is configured
+        """
+        summary = self.profiler.finish(bigquery=self.bq.latency_summary())
+        if self.metrics_table and self.sink.name == "bigquery":
+            write_metrics(self.bq, summary, self.dataset + "." + self.metrics_table, self.credential_datamart, self.project_id)
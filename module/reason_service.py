@@ -0,0 +1,182 @@
+import json
+import time
+import queue
+import logging
+import threading
+import pandas as pd
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from nltk.tokenize import RegexpTokenizer
+from module.model_loader import load_lda_model, token_lookup
+from module.text_normalizer import TextNormalizer
+from module.token_cache import review_hash
+from module.topic_inference import dominant_topics, seeded_gamma
+
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 64
+# seconds the first request of a micro-batch waits for more requests to join it
+MAX_BATCH_WAIT = 0.005
+MAX_REQUEST_BYTES = 1 << 20
+
+
+class ReasonClassifier(object):
+    def __init__(self, model_path, reason_map):
+        """
+        Reason generation pipeline of a single process: the LDA model, the token lookup and the
+        Sastrawi stemmer are loaded once and reused for every batch
+        """
+        self.ldamodel = load_lda_model(model_path)
+        self.dictionary = token_lookup(self.ldamodel.id2word)
+        self.normalizer = TextNormalizer()
+        self.tokenizer = RegexpTokenizer(r'\w+')
+        with open(reason_map, "r") as json_file:
+            self.mapping_dict = json.load(json_file)
+
+    def classify(self, reviews):
+        """
+        Returns the topic class, its contribution and the mapped reason of every review text. The inference
+        of a review starts from a gamma seeded by its text, so its result does not depend on the other
+        reviews of its micro-batch nor on the order of the requests
+        """
+        processed = self.normalizer.normalize(pd.Series(reviews, dtype=object))
+        corpus = self.dictionary.doc2csr([self.tokenizer.tokenize(text) for text in processed])
+        seeds = [int.from_bytes(review_hash(review)[:4], "little") for review in reviews]
+        topics = dominant_topics(self.ldamodel, corpus, self.mapping_dict, initial_gamma=seeded_gamma(self.ldamodel, seeds))
+        return [
+            {
+                "review_processed": text,
+                "topic_class": int(topic_class),
+                "topic_perc_contrib": round(float(contribution), 4),
+                "reason": reason,
+            }
+            for text, topic_class, contribution, reason in zip(
+                processed, topics["Topic_Class"], topics["Perc_Contribution"], topics["Reason"]
+            )
+        ]
+
+
+class MicroBatcher(object):
+    def __init__(self, classify, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT):
+        """
+        Groups reviews submitted from concurrent requests into batches of at most max_batch_size,
+        classified by a single background thread. A batch closes max_wait seconds after its first review
+        """
+        self.classify = classify
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, review):
+        future = Future()
+        self.pending.put((review, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            futures = [future for _, future in batch]
+            try:
+                results = self.classify([review for review, _ in batch])
+            except Exception as e:
+                logger.exception("Failed to classify a batch of {} reviews".format(len(batch)))
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+class ReasonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # responses are small, send them without waiting for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        """
+        POST /classify with {"review": text} returns one result, with {"reviews": [text, ...]} a list of results
+        """
+        if self.path != "/classify":
+            self._send(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_REQUEST_BYTES:
+            self._send(413, {"error": "request body too large"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length))
+            reviews = body["reviews"] if "reviews" in body else [body["review"]]
+            if not all(isinstance(review, str) for review in reviews):
+                raise ValueError("reviews must be strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": "expected {{\"review\": text}} or {{\"reviews\": [text, ...]}}, {}".format(e)})
+            return
+        futures = [self.server.batcher.submit(review) for review in reviews]
+        try:
+            results = [future.result() for future in futures]
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+        self._send(200, {"results": results} if "reviews" in body else results[0])
+
+
+class ReasonHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(host, port, classifier, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT):
+    """
+    HTTP server classifying reviews with micro-batching, port 0 picks a free port
+    """
+    server = ReasonHTTPServer((host, port), ReasonRequestHandler)
+    server.batcher = MicroBatcher(classifier.classify, max_batch_size, max_wait)
+    return server
+
+
+def serve(host, port, model_path, reason_map, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT):
+    classifier = ReasonClassifier(model_path, reason_map)
+    server = make_server(host, port, classifier, max_batch_size, max_wait)
+    logging.info(
+        "Serving reason classification on {}:{} at {}".format(
+            server.server_address[0], server.server_address[1], datetime.today()
+        )
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
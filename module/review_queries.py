@@ -0,0 +1,212 @@
+from datetime import datetime, time
+from google.cloud import bigquery
+
+
+# columns of the scraping table the reason pipeline reads and loads back to the result table
+REASON_INPUT_COLUMNS = ["job_id", "date", "review", "rating", "userName", "title", "app_name", "country"]
+# scrape target columns, missing from the rows and tables loaded before multi-target scraping
+TARGET_COLUMNS = ["app_name", "country"]
+NEGATIVE_RATING = 2
+
+
+def latest_scrape_job(dataset, log_table, since):
+    """
+    Query of the most recent scraping job logged after the start of the day of since.
+    Only job_id and created_at are read, created_at is the partitioning column of the log table
+    """
+    query = """
+        SELECT job_id, created_at
+        FROM
+        `{dataset}.{log_table}`
+        WHERE
+        created_at > @since
+        ORDER BY created_at DESC
+        LIMIT 1
+        """.format(
+        dataset = dataset, log_table = log_table
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("since", "DATETIME", datetime.combine(since.date(), time.min)),
+        ]
+    )
+    return query, job_config
+
+
+def negative_reviews(dataset, input_table, job_id, job_created_at, columns=REASON_INPUT_COLUMNS):
+    """
+    Query of the negative reviews of one scraping job. Every row of a job carries the job creation time,
+    the created_at bound prunes the partitions and the job_id filter the clustered blocks
+    """
+    query = """
+        SELECT {columns}
+        FROM
+        `{dataset}.{input_table}`
+        WHERE
+        created_at >= @created_at
+        and job_id = @job_id
+        and rating <= @rating
+        """.format(
+        columns = ", ".join(columns), dataset = dataset, input_table = input_table
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("created_at", "DATETIME", job_created_at),
+            bigquery.ScalarQueryParameter("job_id", "STRING", job_id),
+            bigquery.ScalarQueryParameter("rating", "FLOAT64", NEGATIVE_RATING),
+        ]
+    )
+    return query, job_config
+
+
+def negative_reviews_between(dataset, input_table, start, end, columns=REASON_INPUT_COLUMNS):
+    """
+    Query of the negative reviews of the scraping jobs created in [start, end), the window prunes the partitions
+    """
+    query = """
+        SELECT {columns}
+        FROM
+        `{dataset}.{input_table}`
+        WHERE
+        created_at >= @start
+        and created_at < @end
+        and rating <= @rating
+        """.format(
+        columns = ", ".join(columns), dataset = dataset, input_table = input_table
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("start", "DATETIME", start),
+            bigquery.ScalarQueryParameter("end", "DATETIME", end),
+            bigquery.ScalarQueryParameter("rating", "FLOAT64", NEGATIVE_RATING),
+        ]
+    )
+    return query, job_config
+
+
+def scraped_review_keys(dataset, table, date_filter, target_filter=""):
+    """
+    Query of the dedup keys of the reviews loaded after date_filter, target_filter is an extra
+    condition whose parameters come from target_parameters
+    """
+    query = """
+        SELECT userName, date, title
+        FROM
+        `{dataset}.{table}`
+        WHERE
+        date >= @date_filter
+        {target_filter}
+        """.format(
+        dataset = dataset, table = table, target_filter = target_filter
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("date_filter", "DATETIME", date_filter.to_pydatetime()),
+        ]
+    )
+    return query, job_config
+
+
+def target_parameters(target, default_app, default_country):
+    """
+    Parameters of the scrape target condition, rows without app_name and country belong to the default app
+    """
+    return [
+        bigquery.ScalarQueryParameter("app_name", "STRING", target.app_name),
+        bigquery.ScalarQueryParameter("country", "STRING", target.country),
+        bigquery.ScalarQueryParameter("default_app", "STRING", default_app),
+        bigquery.ScalarQueryParameter("default_country", "STRING", default_country),
+    ]
+
+
+def latest_log_time(dataset, log_table):
+    """
+    Query of the creation time of the most recent job of a success log table
+    """
+    query = """
+        SELECT MAX(created_at) AS created_at
+        FROM
+        `{dataset}.{log_table}`
+        """.format(
+        dataset = dataset, log_table = log_table
+    )
+    return query, bigquery.QueryJobConfig()
+
+
+def touched_review_days(dataset, table, since, through):
+    """
+    Query of the review days with rows loaded by the jobs created after since and up to through,
+    since None selects every job up to through
+    """
+    query = """
+        SELECT DISTINCT DATE(date) AS day
+        FROM
+        `{dataset}.{table}`
+        WHERE
+        created_at > @since
+        and created_at <= @through
+        """.format(
+        dataset = dataset, table = table
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("since", "DATETIME", since or datetime.min),
+            bigquery.ScalarQueryParameter("through", "DATETIME", through),
+        ]
+    )
+    return query, job_config
+
+
+def reviews_between(dataset, table, columns, start, end):
+    """
+    Query of the rows of the reviews written in [start, end). Reviews are scraped after they are
+    written, the created_at bound prunes the partitions loaded before start
+    """
+    query = """
+        SELECT {columns}
+        FROM
+        `{dataset}.{table}`
+        WHERE
+        created_at >= @start
+        and date >= @start
+        and date < @end
+        """.format(
+        columns = ", ".join(columns), dataset = dataset, table = table
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("start", "DATETIME", start),
+            bigquery.ScalarQueryParameter("end", "DATETIME", end),
+        ]
+    )
+    return query, job_config
+
+
+def latest_aggregation(dataset, log_table):
+    """
+    Query of the watermarks of the most recent aggregation job
+    """
+    query = """
+        SELECT scrap_through, reason_through
+        FROM
+        `{dataset}.{log_table}`
+        ORDER BY created_at DESC
+        LIMIT 1
+        """.format(
+        dataset = dataset, log_table = log_table
+    )
+    return query, bigquery.QueryJobConfig()
+
+
+def indexed_model_versions(dataset, keyword_table):
+    """
+    Query of the model versions already in the topic keyword index
+    """
+    query = """
+        SELECT DISTINCT model_version
+        FROM
+        `{dataset}.{keyword_table}`
+        """.format(
+        dataset = dataset, keyword_table = keyword_table
+    )
+    return query, bigquery.QueryJobConfig()
@@ -0,0 +1,95 @@
+import logging
+import pandas as pd
+import pyarrow as pa
+
+
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 500
+REVIEW_COLUMNS = ["date", "review", "rating", "userName", "title"]
+# same column order and types as the scraping table load
+REVIEW_ARROW_SCHEMA = pa.schema([
+    ("job_id", pa.string()),
+    ("date", pa.timestamp("us")),
+    ("review", pa.string()),
+    ("rating", pa.float64()),
+    ("userName", pa.string()),
+    ("title", pa.string()),
+    ("created_at", pa.timestamp("us")),
+])
+# scraping table rows of a multi-target scrape
+TARGET_REVIEW_ARROW_SCHEMA = REVIEW_ARROW_SCHEMA.append(pa.field("app_name", pa.string())).append(pa.field("country", pa.string()))
+
+
+def iter_pages(app, after=None, stop_before=None, offset=0):
+    """
+    Pages through the App Store reviews of an AppStore scraper from offset and yields the reviews of
+    every page with the offset of the next one, None after the last page. Nothing is kept on the scraper
+    between pages and, unlike AppStore.review, request errors are raised.
+    Paging stops after the first page whose reviews are all older than stop_before. That relies on the
+    review endpoint returning the reviews newest first, which the scraper does not ask for: the order is
+    checked on every page and, once a review is newer than one before it, paging goes on to the last page
+    and the dedup index of the watermark is left to skip the reviews already loaded
+    """
+    if offset:
+        app._request_offset = offset
+        app._request_params.update({"offset": offset})
+    newest_first, oldest = True, None
+    while True:
+        app._get(
+            app._request_url,
+            headers=app._request_headers,
+            params=app._request_params,
+        )
+        app._parse_data(None)
+        page, app.reviews = app.reviews, []
+        app._parse_next()
+        next_offset = app._request_offset
+        dates = [review["date"] for review in page]
+        if newest_first and stop_before is not None and dates:
+            if (oldest is not None and dates[0] > oldest) or any(date < later for date, later in zip(dates, dates[1:])):
+                logging.warning("Reviews are not returned newest first, paging through all of them")
+                newest_first = False
+            oldest = dates[-1]
+        if next_offset is not None and newest_first and stop_before is not None and dates and max(dates) < stop_before:
+            logging.info("Stopped paging at offset {}, reviews are older than {}".format(next_offset, stop_before))
+            next_offset = None
+        yield [review for review in page if after is None or review["date"] >= after], next_offset
+        if next_offset is None:
+            break
+
+
+def to_record_batch(reviews, job_id, created_at, target=None):
+    """
+    Converts a list of review dicts to an Arrow record batch of the scraping table.
+    created_at is stored as its UTC wall time, as the DataFrame load does for DATETIME columns.
+    With a scrape target, the app_name and country columns are added
+    """
+    created_at = pd.Timestamp(created_at).tz_convert(None).to_pydatetime()
+    columns = {column: [review.get(column) for review in reviews] for column in REVIEW_COLUMNS}
+    columns["job_id"] = [job_id] * len(reviews)
+    columns["created_at"] = [created_at] * len(reviews)
+    if target is None:
+        return pa.RecordBatch.from_pydict(columns, schema=REVIEW_ARROW_SCHEMA)
+    columns["app_name"] = [target.app_name] * len(reviews)
+    columns["country"] = [target.country] * len(reviews)
+    return pa.RecordBatch.from_pydict(columns, schema=TARGET_REVIEW_ARROW_SCHEMA)
+
+
+def rebatch(batches, size):
+    """
+    Regroups a stream of Arrow record batches of any size into tables of size rows, the last one holding
+    the remaining rows. At most size rows and one incoming batch are held at a time
+    """
+    pending, rows = [], 0
+    for batch in batches:
+        while batch.num_rows:
+            take = min(size - rows, batch.num_rows)
+            pending.append(batch.slice(0, take))
+            rows += take
+            batch = batch.slice(take)
+            if rows == size:
+                yield pa.Table.from_batches(pending)
+                pending, rows = [], 0
+    if rows:
+        yield pa.Table.from_batches(pending)
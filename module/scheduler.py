@@ -0,0 +1,149 @@
+import time
+import random
+import logging
+import threading
+import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from app_store_scraper import AppStore
+
+
+logger = logging.getLogger(__name__)
+
+# minimum seconds between two requests to the same host, shared by every target
+MIN_REQUEST_INTERVAL = 0.5
+# the spacing grows up to this many seconds while a host keeps throttling
+MAX_REQUEST_INTERVAL = 30
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+ScrapeTarget = namedtuple("ScrapeTarget", ["app_name", "country", "app_id"])
+
+
+def parse_targets(specs):
+    """
+    Parses app_name:country:app_id target specs, e.g. jmo-jamsostek-mobile:id:1444834757
+    """
+    targets = []
+    for spec in specs:
+        parts = spec.split(":")
+        if len(parts) != 3 or not all(parts):
+            raise ValueError("Invalid scrape target {}, expected app_name:country:app_id".format(spec))
+        targets.append(ScrapeTarget(parts[0], parts[1].lower(), parts[2]))
+    return targets
+
+
+def parse_retry_after(value):
+    """
+    Seconds of a Retry-After header, None when it is missing or an HTTP date
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class HostRateLimiter(object):
+    def __init__(self, min_interval=MIN_REQUEST_INTERVAL, max_interval=MAX_REQUEST_INTERVAL, clock=time.monotonic, sleep=time.sleep):
+        """
+        Spaces the requests to each host across all threads. The spacing starts at min_interval,
+        doubles up to max_interval every time the host throttles and shrinks back after successful requests.
+        clock and sleep can be replaced by a fake clock in tests
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.intervals = {}
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def interval(self, host):
+        return self.intervals.get(host, self.min_interval)
+
+    def wait(self, host):
+        """
+        Waits for the next request slot of the host and returns it
+        """
+        with self.lock:
+            now = self.clock()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval(host)
+        if slot > now:
+            self.sleep(slot - now)
+        return slot
+
+    def throttled(self, host, retry_after=None):
+        """
+        Slows down a host after a throttled or failed request, retry_after holds back every request to it
+        """
+        with self.lock:
+            self.intervals[host] = min(self.max_interval, self.interval(host) * 2)
+            if retry_after:
+                self.next_slot[host] = max(self.next_slot.get(host, 0), self.clock() + retry_after)
+        logger.info("Spacing requests to {} by {:.1f}s".format(host, self.interval(host)))
+
+    def succeeded(self, host):
+        with self.lock:
+            self.intervals[host] = max(self.min_interval, self.interval(host) * 0.9)
+
+
+class RateLimitedAppStore(AppStore):
+    def __init__(self, target, limiter, base_url=None, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, timeout=REQUEST_TIMEOUT):
+        """
+        AppStore scraper whose requests go through a shared per-host rate limiter, keep one HTTP session
+        and back off exponentially with jitter on throttling, timeouts and server errors.
+        base_url points both the landing page and the review API to a local stand-in server
+        """
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter())
+        self.session.mount("https://", HTTPAdapter())
+        if base_url:
+            parsed = urlparse(base_url)
+            self._scheme = parsed.scheme
+            self._landing_host = parsed.netloc
+            self._request_host = parsed.netloc
+        super().__init__(country=target.country, app_name=target.app_name, app_id=target.app_id)
+
+    def _get(self, url, headers=None, params=None, **kwargs):
+        host = urlparse(url).netloc
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait(host)
+            retry_after = None
+            try:
+                response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    self.limiter.succeeded(host)
+                    self._response = response
+                    return
+                error = requests.HTTPError("{} returned {}".format(url, response.status_code), response=response)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            self.limiter.throttled(host, retry_after)
+            if attempt == self.max_retries:
+                break
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.warning("Request to {} failed ({}), retrying in {:.1f}s".format(host, error, delay))
+            time.sleep(delay)
+        raise error
+
+
+def run_targets(targets, scrape_target, concurrency):
+    """
+    Runs scrape_target for every target on a bounded thread pool and returns {target: result}.
+    The first failing target fails the whole run
+    """
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {target: executor.submit(scrape_target, target) for target in targets}
+        return {target: future.result() for target, future in futures.items()}
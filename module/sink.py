@@ -0,0 +1,301 @@
+import os
+import glob
+import json
+import uuid
+import logging
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger(__name__)
+
+SINKS = ("bigquery", "local")
+# rows read at a time from a Parquet file by iter_batches
+READ_BATCH_SIZE = 10000
+# files being written carry this suffix until add_file publishes them
+IN_PROGRESS_SUFFIX = ".inprogress"
+
+# a published file waiting for the next flush, commit files are loaded once every other file is
+StagedFile = namedtuple("StagedFile", ["path", "table", "job_config", "commit", "keep", "on_loaded"])
+
+
+def published_path(path):
+    """
+    Path of a file once add_file published it
+    """
+    return path[:-len(IN_PROGRESS_SUFFIX)] if path.endswith(IN_PROGRESS_SUFFIX) else path
+
+
+def staged_path(path):
+    """
+    Current path of a file returned by file_path, its in-progress path until it is published
+    """
+    return path if os.path.exists(path) else published_path(path)
+
+
+def partition_dir(root, table, job_id, created_at):
+    """
+    Directory of the files of one job, partitioned by scrape date then job id
+    """
+    scrape_date = pd.Timestamp(created_at).strftime("%Y-%m-%d")
+    return os.path.join(root, table, "scrape_date={}".format(scrape_date), "job_id={}".format(job_id))
+
+
+def to_arrow_table(frame, schema=None):
+    """
+    Converts a DataFrame to an Arrow table. Timezone-aware columns are stored as their UTC wall time,
+    as the DataFrame load does for DATETIME columns
+    """
+    columns = {
+        column: frame[column].dt.tz_convert(None)
+        for column in frame.columns
+        if isinstance(frame[column].dtype, pd.DatetimeTZDtype)
+    }
+    if columns:
+        frame = frame.assign(**columns)
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+
+def write_parquet(table, path):
+    """
+    Dictionary-encoded Parquet with microsecond timestamps, the precision BigQuery loads
+    """
+    pq.write_table(table, path, use_dictionary=True, coerce_timestamps="us", allow_truncated_timestamps=True)
+
+
+def merge_files(paths, path):
+    """
+    Concatenates Parquet files into one, batch by batch so only one batch is in memory. The column types
+    of the files are unified and the columns missing from a file are null
+    """
+    schema = pa.unify_schemas([pq.read_schema(source) for source in paths], promote_options="permissive").remove_metadata()
+    with pq.ParquetWriter(path, schema, use_dictionary=True, coerce_timestamps="us", allow_truncated_timestamps=True) as writer:
+        for source in paths:
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=READ_BATCH_SIZE):
+                columns = [
+                    batch.column(field.name).cast(field.type)
+                    if field.name in batch.schema.names
+                    else pa.nulls(batch.num_rows, field.type)
+                    for field in schema
+                ]
+                writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+
+def read_files(paths):
+    tables = [pq.read_table(path, memory_map=True) for path in paths]
+    if not tables:
+        return None
+    return pa.concat_tables(tables, promote_options="default")
+
+
+class LocalSink(object):
+    name = "local"
+
+    def __init__(self, root):
+        """
+        Writes every output table as Parquet files under root/<table>/scrape_date=<date>/job_id=<id>/
+        """
+        self.root = root
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def file_path(self, table, job_id, created_at):
+        """
+        In-progress path of the next file of a job, for callers writing the Parquet file themselves.
+        Readers only see the file once it is published with add_file
+        """
+        directory = partition_dir(self.root, table, job_id, created_at)
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            # loaded files are removed by the BigQuery sink, number after the last remaining part
+            parts = [int(os.path.basename(path)[5:10]) for path in glob.glob(os.path.join(directory, "part-*"))]
+            part = max(parts) + 1 if parts else 0
+            path = os.path.join(directory, "part-{:05d}.parquet{}".format(part, IN_PROGRESS_SUFFIX))
+            # reserve the part number until the file is written
+            open(path, "wb").close()
+        return path
+
+    def discard(self, path):
+        os.remove(path)
+
+    def write(self, frame, table, job_id, created_at, job_config=None, schema=None, commit=False, on_loaded=None):
+        """
+        Writes a DataFrame as a new file of the job, schema optionally fixes the Arrow column types
+        """
+        path = self.file_path(table, job_id, created_at)
+        write_parquet(to_arrow_table(frame, schema), path)
+        return self.add_file(path, table, job_config, commit, on_loaded=on_loaded)
+
+    def write_partition(self, frame, table, partition, job_config=None, schema=None):
+        """
+        Replaces one partition of a table, e.g. 202403 of a monthly partitioned table. The file is
+        loaded to table$partition, job_config is expected to truncate it
+        """
+        directory = os.path.join(self.root, table, "partition={}".format(partition))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "data.parquet{}".format(IN_PROGRESS_SUFFIX))
+        write_parquet(to_arrow_table(frame, schema), path)
+        return self.add_file(path, "{}${}".format(table, partition), job_config)
+
+    def add_file(self, path, table, job_config=None, commit=False, keep=False, on_loaded=None):
+        """
+        Publishes a written file and registers it for the next flush, job_config is the BigQuery load
+        configuration of its table. Commit files (success logs) are only loaded once every other file is.
+        on_loaded is called with the published path once the file is loaded, keep leaves a loaded file
+        in place until it is released. Returns the published path
+        """
+        published = published_path(path)
+        # the file of a resumed job may already be published
+        if published != path and os.path.exists(path):
+            os.replace(path, published)
+        path = published
+        with self.lock:
+            self.pending.append(StagedFile(path, table, job_config, commit, keep, on_loaded))
+        logging.info(
+            "Staged {} for {} at {}".format(path, table, datetime.today())
+        )
+        return path
+
+    def flush(self):
+        """
+        Files are the output of the local sink, flushing only clears the pending list
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for staged in pending:
+            if staged.on_loaded is not None:
+                staged.on_loaded(staged.path)
+        return [staged.path for staged in pending]
+
+    def release(self, paths):
+        """
+        Files are the output of the local sink, they are never removed
+        """
+
+    def read(self, table, job_id=None):
+        """
+        Reads the files of a table, or of one of its jobs, as one Arrow table with memory-mapped buffers.
+        Returns None when nothing was written
+        """
+        pattern = os.path.join(self.root, table, "scrape_date=*", "job_id={}".format(job_id or "*"), "part-*.parquet")
+        return read_files(sorted(glob.glob(pattern)))
+
+    def iter_batches(self, table, columns, start=None, end=None, batch_size=READ_BATCH_SIZE):
+        """
+        Streams the columns of the rows of a table created in [start, end) as Arrow record batches, one
+        file at a time. Partitions are skipped by their scrape date, a day of margin covers the timezone
+        of the job creation time the partitions are named after. Columns missing from a file are left out
+        of its batches
+        """
+        pattern = os.path.join(self.root, table, "scrape_date=*", "job_id=*", "part-*.parquet")
+        for path in sorted(glob.glob(pattern)):
+            scrape_date = datetime.strptime(path.split("scrape_date=")[1].split(os.sep)[0], "%Y-%m-%d")
+            if start is not None and scrape_date < start - timedelta(days=1):
+                continue
+            if end is not None and scrape_date > end + timedelta(days=1):
+                continue
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=list(columns) + ["created_at"]):
+                mask = pc.is_valid(batch["created_at"])
+                if start is not None:
+                    mask = pc.and_(mask, pc.greater_equal(batch["created_at"], pa.scalar(start, batch["created_at"].type)))
+                if end is not None:
+                    mask = pc.and_(mask, pc.less(batch["created_at"], pa.scalar(end, batch["created_at"].type)))
+                yield batch.filter(mask).select([column for column in columns if column in batch.schema.names])
+
+    def read_partitions(self, table):
+        """
+        Reads the partitions of a table written with write_partition, None when nothing was written
+        """
+        return read_files(sorted(glob.glob(os.path.join(self.root, table, "partition=*", "data.parquet"))))
+
+
+class BigQuerySink(LocalSink):
+    name = "bigquery"
+
+    def __init__(self, root, bq, config):
+        """
+        Local sink whose files are loaded to BigQuery on flush, the data files concurrently then the commit files,
+        with one load job per table. Loaded files are removed, BigQuery holds the data.
+        config is BQ_CONFIG, the credentials are only read on the first flush
+        """
+        super().__init__(root)
+        self.bq = bq
+        self.config = config
+
+    def load(self, files):
+        """
+        Runs one load job per table and load configuration, the files of a table are merged into one
+        bundle under root/_loads/ first and the bundles are removed once their jobs finished. The files
+        of every job are released as soon as it succeeded, the files of failed jobs stay pending
+        """
+        from google.cloud import bigquery
+
+        groups = {}
+        for staged in files:
+            job_config = staged.job_config or bigquery.LoadJobConfig(write_disposition="WRITE_APPEND")
+            job_config.source_format = bigquery.SourceFormat.PARQUET
+            key = (staged.table, json.dumps(job_config.to_api_repr(), sort_keys=True, default=str))
+            groups.setdefault(key, (staged.table, job_config, []))[2].append(staged)
+        groups = list(groups.values())
+        loads, bundles = [], []
+        for table, job_config, group in groups:
+            path = group[0].path
+            if len(group) > 1:
+                directory = os.path.join(self.root, "_loads")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, "{}.parquet".format(uuid.uuid4().hex))
+                bundles.append(path)
+                merge_files([staged.path for staged in group], path)
+            loads.append((path, self.config["DB"] + "." + table, job_config))
+        try:
+            self.bq.load_files(
+                loads, self.config["CRED"], self.config["PROJECT"], on_loaded=lambda index: self.loaded(groups[index][2])
+            )
+        finally:
+            for path in bundles:
+                os.remove(path)
+
+    def loaded(self, files):
+        """
+        Drops loaded files from the pending list and removes them, unless they are kept
+        """
+        with self.lock:
+            self.pending = [staged for staged in self.pending if staged not in files]
+        for staged in files:
+            if staged.on_loaded is not None:
+                staged.on_loaded(staged.path)
+            if not staged.keep:
+                os.remove(staged.path)
+
+    def release(self, paths):
+        """
+        Removes loaded files kept with add_file(keep=True)
+        """
+        for path in paths:
+            path = staged_path(path)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def flush(self):
+        """
+        Loads every data file at once and, once all of them succeeded, the commit files.
+        On failure only the files of the failed jobs stay pending and no commit file is loaded
+        """
+        with self.lock:
+            pending = list(self.pending)
+        self.load([staged for staged in pending if not staged.commit])
+        self.load([staged for staged in pending if staged.commit])
+        return [staged.path for staged in pending]
+
+
+def make_sink(name, root, bq=None, config=None):
+    if name == "local":
+        return LocalSink(root)
+    if name == "bigquery":
+        return BigQuerySink(root, bq, config)
+    raise ValueError("Unknown sink {}, expected one of {}".format(name, ", ".join(SINKS)))
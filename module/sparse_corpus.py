@@ -0,0 +1,69 @@
+import itertools
+import numpy as np
+import scipy.sparse
+from gensim.models.ldamodel import dirichlet_expectation, mean_absolute_difference
+
+
+def texts_to_csr(texts, lookup):
+    """
+    Converts tokenized documents straight into a CSR document-term matrix with int32 indices and counts.
+    Tokens are looked up in one vectorized pass over the whole batch, unknown tokens are ignored and
+    the term ids of every row are sorted, the order Dictionary.doc2bow returns them in
+    """
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    positions = lookup.vocabulary.get_indexer(list(itertools.chain.from_iterable(texts)))
+    known = positions >= 0
+    docs = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)[known]
+    keys = docs * lookup.num_terms + lookup.ids[positions[known]]
+    keys, counts = np.unique(keys, return_counts=True)
+    indptr = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // lookup.num_terms, minlength=len(texts)), out=indptr[1:])
+    return scipy.sparse.csr_matrix(
+        (counts.astype(np.int32), (keys % lookup.num_terms).astype(np.int32), indptr),
+        shape=(len(texts), lookup.num_terms),
+    )
+
+
+def bows_to_csr(bows, num_terms):
+    """
+    Packs a list of gensim bag-of-words documents into a CSR document-term matrix
+    """
+    indptr = np.zeros(len(bows) + 1, dtype=np.int64)
+    np.cumsum([len(bow) for bow in bows], out=indptr[1:])
+    indices = np.fromiter((token_id for bow in bows for token_id, _ in bow), dtype=np.int32, count=indptr[-1])
+    data = np.fromiter((count for bow in bows for _, count in bow), dtype=np.int32, count=indptr[-1])
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(bows), num_terms))
+
+
+def csr_inference(ldamodel, chunk, gamma=None):
+    """
+    gensim LdaModel.inference on the rows of a CSR matrix. Same E-step, random draws and float arithmetic
+    as the bag-of-words path, so the returned gamma is bit for bit identical, without building Python
+    (id, count) tuples for every token. gamma is the initial gamma of the rows, drawn from the model
+    random state when None
+    """
+    dtype = ldamodel.dtype
+    if gamma is None:
+        gamma = ldamodel.random_state.gamma(100., 1. / 100., (chunk.shape[0], ldamodel.num_topics))
+    gamma = np.array(gamma, dtype=dtype)
+    Elogtheta = dirichlet_expectation(gamma)
+    expElogtheta = np.exp(Elogtheta)
+    epsilon = np.finfo(dtype).eps
+    indptr, indices, data = chunk.indptr, chunk.indices, chunk.data.astype(dtype)
+    for d in range(chunk.shape[0]):
+        ids = indices[indptr[d]:indptr[d + 1]]
+        cts = data[indptr[d]:indptr[d + 1]]
+        gammad = gamma[d, :]
+        expElogthetad = expElogtheta[d, :]
+        expElogbetad = ldamodel.expElogbeta[:, ids]
+        phinorm = np.dot(expElogthetad, expElogbetad) + epsilon
+        for _ in range(ldamodel.iterations):
+            lastgamma = gammad
+            gammad = ldamodel.alpha + expElogthetad * np.dot(cts / phinorm, expElogbetad.T)
+            Elogthetad = dirichlet_expectation(gammad)
+            expElogthetad = np.exp(Elogthetad)
+            phinorm = np.dot(expElogthetad, expElogbetad) + epsilon
+            if mean_absolute_difference(gammad, lastgamma) < ldamodel.gamma_threshold:
+                break
+        gamma[d, :] = gammad
+    return gamma
@@ -0,0 +1,206 @@
+import re
+import json
+import string
+import hashlib
+import logging
+import pandas as pd
+from itertools import chain
+from functools import lru_cache
+from datetime import datetime
+from pathlib import Path
+from Sastrawi.Dictionary.ArrayDictionary import ArrayDictionary
+from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
+from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+from Sastrawi.Stemmer.Stemmer import Stemmer
+
+
+logger = logging.getLogger(__name__)
+
+# typo, slang and phrase conversion table, keys are whitespace separated words matched case-insensitively
+TYPO_PATH = Path(__file__).parent.parent.resolve() / "model" / "typo_indo.json"
+
+
+def load_typo_map(path=TYPO_PATH):
+    with open(path, "r") as json_file:
+        return json.load(json_file)
+
+
+TYPO_INDO = load_typo_map()
+
+# only ascii letters survive clean_review, every other character is a separator
+WORD_PATTERN = re.compile(r'[a-zA-Z]+')
+# byte table applied to every distinct token of a batch, maps everything except ascii letters to a space
+KEPT_BYTES = frozenset(string.ascii_letters.encode('ascii'))
+CLEAN_TABLE = bytes(byte if byte in KEPT_BYTES else ord(' ') for byte in range(256))
+STEM_CACHE_SIZE = 100000
+
+
+class PhraseTrie(object):
+    def __init__(self, table):
+        """
+        Token trie of a phrase replacement table. Every node maps a lowercased word to a
+        [replacement, children] pair, replacement is None when no phrase ends at that word.
+        Documents without the first word of any phrase only need the single word lookups
+        """
+        self.root = {}
+        self.max_length = 0
+        for phrase, replacement in table.items():
+            words = phrase.lower().split()
+            if not words:
+                continue
+            node = self.root
+            for word in words[:-1]:
+                node = node.setdefault(word, [None, {}])[1]
+            node.setdefault(words[-1], [None, {}])[0] = replacement
+            self.max_length = max(self.max_length, len(words))
+        self.words = {word: entry[0] for word, entry in self.root.items() if entry[0] is not None}
+        self.phrase_starts = frozenset(word for word, entry in self.root.items() if entry[1])
+
+    def replace(self, words, lowercase=False):
+        """
+        Replaces the longest phrase starting at every word, left to right in a single pass, and joins
+        the words back into a single string. Replacements are not matched again.
+        lowercase tells the words are already lowercase and skips lowering them one by one
+        """
+        single = self.words
+        if lowercase:
+            lowered = words
+            if self.phrase_starts.isdisjoint(lowered):
+                return ' '.join([single.get(word, word) for word in words])
+        elif not self.phrase_starts:
+            return ' '.join([single.get(word.lower(), word) for word in words])
+        else:
+            lowered = list(map(str.lower, words))
+            if self.phrase_starts.isdisjoint(lowered):
+                return ' '.join([single.get(key, word) for key, word in zip(lowered, words)])
+        root = self.root
+        output = []
+        i, count = 0, len(words)
+        while i < count:
+            entry = root.get(lowered[i])
+            if entry is None:
+                output.append(words[i])
+                i += 1
+                continue
+            match, end = entry[0], i + 1
+            children, j = entry[1], i + 1
+            while children and j < count:
+                entry = children.get(lowered[j])
+                if entry is None:
+                    break
+                j += 1
+                if entry[0] is not None:
+                    match, end = entry[0], j
+                children = entry[1]
+            if match is None:
+                output.append(words[i])
+                i += 1
+            else:
+                output.append(match)
+                i = end
+        return ' '.join(output)
+
+
+class TextNormalizer(object):
+    def __init__(self, typo_map=TYPO_INDO, stopwords=None, cache_size=STEM_CACHE_SIZE):
+        """
+        Compiles the typo table into a phrase trie and the stopword table once and keeps a bounded LRU cache
+        of stemmed words shared across every document normalized by this instance
+        """
+        self.typo_map = {' '.join(key.lower().split()): value for key, value in typo_map.items()}
+        self.typo_trie = PhraseTrie(self.typo_map)
+        # normalize lowercases the text anyway, it converts lowered reviews with lowered replacements
+        self.lower_typo_trie = PhraseTrie({key: value.lower() for key, value in self.typo_map.items()})
+        if stopwords is None:
+            stopwords = StopWordRemoverFactory().get_stop_words()
+        self.stopwords = frozenset(stopwords)
+        # plain Sastrawi stemmer, the unbounded Sastrawi word cache is replaced by the LRU below.
+        # Words are lowercase ascii letters without hyphens, so the text normalization and plural
+        # check of Stemmer.stem are skipped and the singular word is stemmed directly
+        self.stemmer = Stemmer(ArrayDictionary(StemmerFactory().get_words()))
+        self.stem_word = lru_cache(maxsize=cache_size)(self.stemmer.stem_singular_word)
+
+    def fingerprint(self):
+        """
+        Hash of the typo, stopword and stemmer tables, changes whenever the normalized output may change
+        """
+        tables = {
+            "typo": sorted(self.typo_map.items()),
+            "stopwords": sorted(self.stopwords),
+            "stems": sorted(self.stemmer.get_dictionary().words),
+        }
+        return hashlib.sha256(json.dumps(tables).encode()).hexdigest()
+
+    def replace_typo(self, words):
+        """
+        Replaces every word and phrase found in the typo table and joins the words back into a single string
+        """
+        return self.typo_trie.replace(words)
+
+    def stem_tokens(self, tokens):
+        """
+        Removes stopwords from the tokens and stems the rest through the shared word cache
+        """
+        stopwords = self.stopwords
+        stem_word = self.stem_word
+        return ' '.join([stem_word(token) for token in tokens if token not in stopwords])
+
+    def convert_typo(self, text):
+        """
+        Converts typo and slang words and phrases of a single review
+        """
+        return self.replace_typo(text.split())
+
+    def clean_review(self, review):
+        """
+        Converts a single review to lowercase, removes non-alphabetic characters and stopwords, applies stemming
+        """
+        return self.stem_tokens(WORD_PATTERN.findall(review.lower()))
+
+    def normalize_tokens(self, tokens, typo):
+        """
+        Normalized text of every whitespace token of lowered reviews after its typo conversion:
+        non-alphabetic characters split it, stopwords are dropped and the words are stemmed
+        """
+        stopwords = self.stopwords
+        stem_word = self.stem_word
+        normalized = {}
+        for token in tokens:
+            words = typo.get(token, token).encode('ascii', 'replace').translate(CLEAN_TABLE).decode('ascii').split()
+            normalized[token] = ' '.join([stem_word(word) for word in words if word not in stopwords])
+        return normalized
+
+    def normalize(self, reviews):
+        """
+        Applies typo conversion and cleansing to a whole review column,
+        output is identical to convert_typo followed by clean_review on every row
+        """
+        texts = reviews.dropna()
+        if len(texts) == 0:
+            return reviews.copy()
+        # lowering a review before the typo conversion gives the lowered convert_typo output
+        trie = self.lower_typo_trie
+        rows = [text.lower().split() for text in texts]
+        phrase_rows = set()
+        if trie.phrase_starts:
+            for i, row in enumerate(rows):
+                if not trie.phrase_starts.isdisjoint(row):
+                    # the words of a converted phrase are not converted again
+                    rows[i] = trie.replace(row, lowercase=True).split()
+                    phrase_rows.add(i)
+
+        # every distinct whitespace token of the batch is converted, cleaned and stemmed once
+        vocabulary = set(chain.from_iterable(rows))
+        converted = self.normalize_tokens(vocabulary, trie.words)
+        plain = self.normalize_tokens(vocabulary, {}) if phrase_rows else converted
+        normalized = [
+            ' '.join(filter(None, map((plain if i in phrase_rows else converted).__getitem__, row)))
+            for i, row in enumerate(rows)
+        ]
+
+        logging.info(
+                "Success: normalize {} reviews at {}, stem cache {}".format(
+                    len(texts), datetime.today(), self.stem_word.cache_info()
+                )
+            )
+        return pd.Series(normalized, index=texts.index, name=reviews.name).reindex(reviews.index)
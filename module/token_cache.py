@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_MAX_ENTRIES = 1000000
+# sqlite limits the number of bound parameters per statement
+SQL_BATCH_SIZE = 500
+
+
+def review_hash(text):
+    """
+    Content hash of a raw review text
+    """
+    return hashlib.sha256(text.encode()).digest()
+
+
+def dictionary_fingerprint(dictionary):
+    """
+    Fingerprint of a gensim Dictionary token to id mapping
+    """
+    return hashlib.sha256(json.dumps(sorted(dictionary.token2id.items())).encode()).hexdigest()
+
+
+class TokenCache(object):
+    def __init__(self, path, fingerprint, max_entries=TOKEN_CACHE_MAX_ENTRIES):
+        """
+        On-disk SQLite cache from the content hash of a raw review to its normalized text and its
+        bag-of-words ids. Everything is dropped when the normalizer fingerprint changes, and the least
+        recently used reviews are evicted beyond max_entries
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (key BLOB PRIMARY KEY, processed TEXT, last_used REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS tokens_last_used ON tokens (last_used)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bows (key BLOB, dictionary TEXT, ids BLOB, counts BLOB, PRIMARY KEY (key, dictionary))"
+            )
+            row = self.conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                if row is not None:
+                    logger.info("Normalizer tables changed, invalidating token cache {}".format(path))
+                self.conn.execute("DELETE FROM tokens")
+                self.conn.execute("DELETE FROM bows")
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def _select(self, query, keys, *params):
+        rows = []
+        for start in range(0, len(keys), SQL_BATCH_SIZE):
+            batch = keys[start:start + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(self.conn.execute(query.format(placeholders=placeholders), (*params, *batch)).fetchall())
+        return rows
+
+    def get_processed(self, keys):
+        """
+        Returns {key: normalized text} for the cached keys and marks them as recently used
+        """
+        keys = list(set(keys))
+        found = dict(self._select("SELECT key, processed FROM tokens WHERE key IN ({placeholders})", keys))
+        if found:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany("UPDATE tokens SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_processed(self, items):
+        """
+        Stores (key, normalized text) pairs and evicts the least recently used reviews beyond max_entries
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", [(key, processed, now) for key, processed in items])
+            self.evict()
+
+    def get_bows(self, keys, dictionary_id):
+        """
+        Returns {key: bag-of-words} of the cached keys for one dictionary
+        """
+        rows = self._select(
+            "SELECT key, ids, counts FROM bows WHERE dictionary = ? AND key IN ({placeholders})", list(set(keys)), dictionary_id
+        )
+        return {
+            key: list(zip(np.frombuffer(ids, dtype=np.int32).tolist(), np.frombuffer(counts, dtype=np.int32).tolist()))
+            for key, ids, counts in rows
+        }
+
+    def put_bows(self, items, dictionary_id):
+        """
+        Stores (key, bag-of-words) pairs for one dictionary as int32 id and count arrays
+        """
+        rows = []
+        for key, bow in items:
+            ids = np.array([token_id for token_id, _ in bow], dtype=np.int32)
+            counts = np.array([count for _, count in bow], dtype=np.int32)
+            rows.append((key, dictionary_id, ids.tobytes(), counts.tobytes()))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO bows VALUES (?, ?, ?, ?)", rows)
+
+    def evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM tokens WHERE key IN (SELECT key FROM tokens ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self.conn.execute("DELETE FROM bows WHERE key NOT IN (SELECT key FROM tokens)")
+            logger.info("Evicted {} reviews from token cache {}".format(count - self.max_entries, self.path))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,204 @@
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import scipy.special
+from datetime import datetime
+from gensim.models.ldamodel import dirichlet_expectation
+from module.model_loader import token_lookup
+from module.sparse_corpus import csr_inference, bows_to_csr
+
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_CHUNKSIZE = 2000
+NOT_FOUND_REASON = "not found"
+# words explaining the dominant topic of a review, and words of the per-topic keyword index
+EXPLAIN_TOP_N = 5
+KEYWORD_TOP_N = 20
+# quadrature points of the dominance probability, about 1e-3 from the exact integral
+CONFIDENCE_POINTS = 32
+
+
+def reason_lookup(mapping_dict, num_topics):
+    """
+    Builds an array indexed by topic id holding the mapped reason of every topic
+    """
+    return np.array(
+        [mapping_dict.get(str(topic_num), NOT_FOUND_REASON) for topic_num in range(num_topics)],
+        dtype=object,
+    )
+
+
+def topic_total(gamma):
+    """
+    Row sums of gamma, accumulated left to right in float64 and cast back to the model dtype,
+    the same arithmetic gensim get_document_topics uses so the normalized values match bit for bit
+    """
+    total = np.zeros(len(gamma), dtype=np.float64)
+    for topic_num in range(gamma.shape[1]):
+        total += gamma[:, topic_num]
+    return total.astype(gamma.dtype)
+
+
+def seeded_gamma(ldamodel, seeds):
+    """
+    Initial gamma of every document drawn from a random state of its own seed, e.g. a hash of the review,
+    so the topics of a document do not depend on the documents inferred before or with it
+    """
+    gamma = np.empty((len(seeds), ldamodel.num_topics))
+    for row, seed in enumerate(seeds):
+        gamma[row] = np.random.RandomState(seed).gamma(100., 1. / 100., ldamodel.num_topics)
+    return gamma
+
+
+def iter_topic_distribution(ldamodel, corpus, chunksize=INFERENCE_CHUNKSIZE, initial_gamma=None):
+    """
+    Runs gensim inference over the corpus in chunks and yields every chunk with its gamma and normalized
+    doc-topic rows. The corpus is a list of bag-of-words documents or a CSR document-term matrix, inferred
+    chunk by chunk in row order, so the model random state advances exactly as with ldamodel[corpus].
+    With initial_gamma, e.g. from seeded_gamma, the model random state is not used
+    """
+    sparse = scipy.sparse.issparse(corpus)
+    n_docs = corpus.shape[0] if sparse else len(corpus)
+    for start in range(0, n_docs, chunksize):
+        chunk = corpus[start:start + chunksize]
+        if initial_gamma is not None:
+            if not sparse:
+                chunk = bows_to_csr(chunk, ldamodel.num_terms)
+            gamma = csr_inference(ldamodel, chunk, initial_gamma[start:start + chunksize])
+        elif sparse:
+            gamma = csr_inference(ldamodel, chunk)
+        else:
+            gamma, _ = ldamodel.inference(chunk)
+        yield chunk, gamma, gamma / topic_total(gamma)[:, np.newaxis]
+
+
+def infer_topic_distribution(ldamodel, corpus, chunksize=INFERENCE_CHUNKSIZE, initial_gamma=None):
+    """
+    Dense, normalized doc-topic matrix of the corpus, see iter_topic_distribution
+    """
+    n_docs = corpus.shape[0] if scipy.sparse.issparse(corpus) else len(corpus)
+    distribution = np.empty((n_docs, ldamodel.num_topics), dtype=ldamodel.dtype)
+    start = 0
+    for _, _, rows in iter_topic_distribution(ldamodel, corpus, chunksize, initial_gamma):
+        distribution[start:start + len(rows)] = rows
+        start += len(rows)
+    return distribution
+
+
+def dominance_probability(gamma, topic_class, points=CONFIDENCE_POINTS):
+    """
+    Probability that the dominant topic holds the largest share of a document under its Dirichlet(gamma)
+    posterior, a confidence that accounts for the length of the review. The shares are normalized
+    independent Gamma(gamma_k) variables, so it is the integral over u in (0, 1) of the product of
+    P(X_j < x) for the other topics at the u-quantile x of the dominant one, taken with the midpoint rule
+    """
+    gamma = gamma.astype(np.float64)
+    rows = np.arange(len(gamma))
+    quantiles = scipy.special.gammaincinv(
+        gamma[rows, topic_class][:, np.newaxis], ((np.arange(points) + 0.5) / points)[np.newaxis, :]
+    )
+    cdf = scipy.special.gammainc(gamma[:, np.newaxis, :], quantiles[:, :, np.newaxis])
+    cdf[rows, :, topic_class] = 1.0
+    return cdf.prod(axis=2).mean(axis=1)
+
+
+def top_contributing_tokens(ldamodel, chunk, gamma, topic_class, top_n=EXPLAIN_TOP_N):
+    """
+    Words of every document with the largest expected count assigned to its dominant topic, the per-word
+    topic assignment of the E-step at the inferred gamma. chunk is a CSR document-term matrix, returns the
+    row offsets, word ids and weights of the top words, by decreasing weight within a row
+    """
+    expElogtheta = np.exp(dirichlet_expectation(gamma))
+    lengths = np.diff(chunk.indptr)
+    rows = np.repeat(np.arange(chunk.shape[0]), lengths)
+    words = chunk.indices
+    expElogbeta = ldamodel.expElogbeta[:, words]
+    phinorm = (expElogtheta[rows] * expElogbeta.T).sum(axis=1) + np.finfo(ldamodel.dtype).eps
+    topics = topic_class[rows]
+    weight = chunk.data * expElogtheta[rows, topics] * expElogbeta[topics, np.arange(len(words))] / phinorm
+    order = np.lexsort((-weight, rows))
+    keep = order[np.arange(len(order)) - chunk.indptr[rows[order]] < top_n]
+    offsets = np.concatenate([[0], np.cumsum(np.minimum(lengths, top_n))])
+    return offsets, words[keep], weight[keep]
+
+
+def explained_topics(ldamodel, corpus, mapping_dict, chunksize=INFERENCE_CHUNKSIZE, top_n=EXPLAIN_TOP_N):
+    """
+    dominant_topics with, from the same inference pass, the confidence of the dominant topic and the
+    top_n words contributing to it with their weights, as lists per document
+    """
+    tokens = token_lookup(ldamodel.id2word).tokens
+    columns = {"Topic_Class": [], "Perc_Contribution": [], "Confidence": [], "Top_Tokens": [], "Token_Weights": []}
+    for chunk, gamma, distribution in iter_topic_distribution(ldamodel, corpus, chunksize):
+        if not scipy.sparse.issparse(chunk):
+            chunk = bows_to_csr(chunk, ldamodel.num_terms)
+        topic_class = distribution.argmax(axis=1)
+        offsets, words, weights = top_contributing_tokens(ldamodel, chunk, gamma, topic_class, top_n)
+        columns["Topic_Class"].append(topic_class)
+        columns["Perc_Contribution"].append(np.round(distribution[np.arange(len(distribution)), topic_class], 4))
+        columns["Confidence"].append(np.round(dominance_probability(gamma, topic_class), 4))
+        columns["Top_Tokens"].extend(np.split(tokens[words], offsets[1:-1]))
+        columns["Token_Weights"].extend(np.split(np.round(weights.astype(np.float64), 4), offsets[1:-1]))
+    topic_class = np.concatenate(columns["Topic_Class"]) if columns["Topic_Class"] else np.empty(0, dtype=np.int64)
+    logging.info(
+            "Success: infer and explain dominant topic of {} documents at {}".format(
+                len(topic_class), datetime.today()
+            )
+        )
+    return {
+        "Topic_Class": topic_class.astype(np.int64),
+        "Perc_Contribution": np.concatenate(columns["Perc_Contribution"]) if len(topic_class) else np.empty(0, dtype=ldamodel.dtype),
+        "Reason": reason_lookup(mapping_dict, ldamodel.num_topics)[topic_class],
+        "Confidence": np.concatenate(columns["Confidence"]) if len(topic_class) else np.empty(0),
+        "Top_Tokens": [list(words) for words in columns["Top_Tokens"]],
+        "Token_Weights": [list(weights) for weights in columns["Token_Weights"]],
+    }
+
+
+def topic_keywords(ldamodel, mapping_dict, top_n=KEYWORD_TOP_N):
+    """
+    Keyword index of a model: the top_n words of every topic by their expElogbeta weight normalized
+    over the topic, with the topic reason, one row per (topic, rank)
+    """
+    weights = ldamodel.expElogbeta / ldamodel.expElogbeta.sum(axis=1, keepdims=True)
+    top = np.argsort(-weights, axis=1, kind="stable")[:, :top_n]
+    topics = np.repeat(np.arange(ldamodel.num_topics), top.shape[1])
+    return pd.DataFrame({
+        "Topic_Class": topics.astype(np.int64),
+        "rank": np.tile(np.arange(1, top.shape[1] + 1), ldamodel.num_topics).astype(np.int64),
+        "token": token_lookup(ldamodel.id2word).tokens[top.ravel()],
+        "weight": np.round(weights[topics, top.ravel()].astype(np.float64), 6),
+        "Reason": reason_lookup(mapping_dict, ldamodel.num_topics)[topics],
+    })
+
+
+def dominant_topics(ldamodel, corpus, mapping_dict, chunksize=INFERENCE_CHUNKSIZE, initial_gamma=None):
+    """
+    Returns the dominant topic, its contribution and its reason for every document as columnar arrays
+    """
+    distribution = infer_topic_distribution(ldamodel, corpus, chunksize, initial_gamma)
+    topic_class = distribution.argmax(axis=1)
+    contribution = np.round(distribution[np.arange(len(distribution)), topic_class], 4)
+    reason = reason_lookup(mapping_dict, ldamodel.num_topics)[topic_class]
+    logging.info(
+            "Success: infer dominant topic of {} documents at {}".format(
+                len(distribution), datetime.today()
+            )
+        )
+    return {
+        "Topic_Class": topic_class.astype(np.int64),
+        "Perc_Contribution": contribution,
+        "Reason": reason,
+    }
+
+
+def dominant_topics_frame(ldamodel, corpus, mapping_dict, chunksize=INFERENCE_CHUNKSIZE, explain=False):
+    """
+    Same as dominant_topics, as a DataFrame with one row per document. With explain, the columns of
+    explained_topics are added
+    """
+    if explain:
+        return pd.DataFrame(explained_topics(ldamodel, corpus, mapping_dict, chunksize))
+    return pd.DataFrame(dominant_topics(ldamodel, corpus, mapping_dict, chunksize))
@@ -0,0 +1,103 @@
+import os
+import logging
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# keys of reviews older than the watermark minus this window are dropped from the index
+INDEX_RETENTION = pd.Timedelta(days=30)
+
+
+def review_key(user_name, date, title):
+    """
+    64-bit hash of the (userName, date, title) key of a review
+    """
+    key = "{}\x1f{}\x1f{}".format(user_name, pd.Timestamp(date).isoformat(), title)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class ReviewWatermark(object):
+    def __init__(self, high_water=None, keys=None, dates=None):
+        """
+        Newest review date seen so far and a hash index of the reviews already emitted,
+        the index keeps the review date of every key so it can be pruned
+        """
+        self.high_water = high_water
+        keys = [] if keys is None else keys
+        dates = [] if dates is None else dates
+        self.index = dict(zip((int(key) for key in keys), (int(date) for date in dates)))
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Builds the watermark from a frame with userName, date and title columns
+        """
+        if len(df) == 0:
+            return cls()
+        dates = pd.to_datetime(df["date"])
+        keys = [review_key(*row) for row in zip(df["userName"], dates, df["title"])]
+        return cls(dates.max(), keys, dates.astype("datetime64[s]").astype("int64"))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a watermark saved with save, returns None when there is no saved state
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            high_water = pd.Timestamp(int(state["high_water"]), unit="s") if state["high_water"] >= 0 else None
+            watermark = cls(high_water, state["keys"], state["dates"])
+        logger.info("Loaded watermark {} with {} keys from {}".format(watermark.high_water, len(watermark), path))
+        return watermark
+
+    def save(self, path):
+        """
+        Writes the watermark and the pruned index as a compact numpy archive
+        """
+        self.prune()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        high_water = -1 if self.high_water is None else pd.Timestamp(self.high_water).value // 10**9
+        # write to a temporary file first so a failed write never leaves a truncated state behind
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            high_water=np.int64(high_water),
+            keys=np.fromiter(self.index.keys(), dtype=np.uint64, count=len(self.index)),
+            dates=np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index)),
+        )
+        os.replace(tmp_path, path)
+        logger.info("Saved watermark {} with {} keys to {}".format(self.high_water, len(self), path))
+
+    def __len__(self):
+        return len(self.index)
+
+    def is_new(self, review):
+        return review_key(review["userName"], review["date"], review["title"]) not in self.index
+
+    def add(self, review):
+        date = pd.Timestamp(review["date"])
+        self.index[review_key(review["userName"], date, review["title"])] = date.value // 10**9
+        if self.high_water is None or date > self.high_water:
+            self.high_water = date
+
+    def prune(self):
+        if self.high_water is None:
+            return
+        oldest = (pd.Timestamp(self.high_water) - INDEX_RETENTION).value // 10**9
+        self.index = {key: date for key, date in self.index.items() if date >= oldest}
+
+
+def iter_new_reviews(reviews, watermark):
+    """
+    Yields only the reviews missing from the watermark index and records them in it
+    """
+    for review in reviews:
+        if watermark.is_new(review):
+            watermark.add(review)
+            yield review
@@ -0,0 +1,105 @@
+"""
+Local stand-in of the App Store landing page and review API, for RateLimitedAppStore(base_url=...)
+"""
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LANDING_PAGE = b'<meta name="web-experience-app/config/environment" content="%7B%22token%22%3A%22test%22%7D">'
+PAGE_SIZE = 20
+
+
+class FakeAppStore(object):
+    def __init__(self, pages=3, newest=datetime(2024, 3, 1)):
+        """
+        Serves pages of PAGE_SIZE reviews, one hour apart and newest first. Queued failures are answered
+        to the next review requests, or to the next requests of one offset, before the reviews are served
+        again: an error status, or a page served only after a delay to time the client out.
+        Every review request is recorded with its arrival time, path, offset and answered status
+        """
+        self.pages = pages
+        self.newest = newest
+        self.failures = []
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, status, times=1, retry_after=None, offset=None):
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+        with self.lock:
+            self.failures.extend([(offset, status, headers, 0)] * times)
+
+    def stall(self, seconds, times=1, offset=None):
+        """
+        Serves the next pages after a delay, longer than the request timeout of the client to time it out
+        """
+        with self.lock:
+            self.failures.extend([(offset, 200, {}, seconds)] * times)
+
+    def next_failure(self, offset):
+        for index, failure in enumerate(self.failures):
+            if failure[0] is None or failure[0] == offset:
+                return self.failures.pop(index)[1:]
+        return 200, {}, 0
+
+    def reviews(self, country, offset):
+        return [
+            {"attributes": {
+                "date": (self.newest - timedelta(hours=offset + i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "review": "review {} {}".format(country, offset + i),
+                "rating": 1,
+                "userName": "user{}".format(offset + i),
+                "title": "title",
+                "isEdited": False,
+            }}
+            for i in range(PAGE_SIZE)
+        ]
+
+    def handler(self):
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def respond(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.endswith("/reviews"):
+                    return self.respond(200, LANDING_PAGE)
+                offset = int(parse_qs(url.query).get("offset", ["0"])[0])
+                with store.lock:
+                    status, headers, delay = store.next_failure(offset)
+                    store.requests.append((time.monotonic(), url.path, offset, status))
+                time.sleep(delay)
+                if status != 200:
+                    return self.respond(status, headers=headers)
+                body = {"data": store.reviews(url.path.split("/")[3], offset)}
+                if offset // PAGE_SIZE + 1 < store.pages:
+                    body["next"] = "{}?offset={}".format(url.path, offset + PAGE_SIZE)
+                self.respond(200, json.dumps(body).encode(), {"Content-Type": "application/json"})
+
+        return Handler
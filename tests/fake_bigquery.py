@@ -0,0 +1,81 @@
+"""
+Stand-ins of BQConnection.load_files recording the loaded rows of every table, for BigQuerySink,
+and of the BigQuery REST API for the clients of BQConnection
+"""
+import re
+import json
+import threading
+import requests
+import pyarrow.parquet as pq
+from urllib.parse import urlparse
+
+
+class FakeBigQuery(object):
+    def __init__(self, failing=()):
+        """
+        The first load of every table of failing raises, after the other loads of its call ran
+        """
+        self.loads = []
+        self.failing = set(failing)
+
+    def load_files(self, loads, credentials, project_id, on_loaded=None):
+        failed = None
+        for index, (path, table_id, _) in enumerate(loads):
+            if table_id in self.failing:
+                self.failing.discard(table_id)
+                failed = RuntimeError("load of {} failed".format(table_id))
+                continue
+            self.loads.append((table_id, pq.read_table(path).to_pandas()))
+            if on_loaded is not None:
+                on_loaded(index)
+        if failed is not None:
+            raise failed
+
+    def latency_summary(self):
+        return {}
+
+
+class FakeBigQueryHttp(object):
+    """
+    HTTP session standing in for the BigQuery REST API, for BQConnection(http=...). Answers table
+    metadata and multipart load job requests, the load jobs of the tables in failing end with an error.
+    Every request is recorded as (method, path)
+    """
+    def __init__(self, columns=(), failing=()):
+        self.columns = list(columns)
+        self.failing = set(failing)
+        self.requests = []
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None, timeout=None, **kwargs):
+        path = urlparse(url).path
+        with self.lock:
+            self.requests.append((method, path))
+        if "/tables/" in path:
+            project, dataset, table = re.search(r"/projects/([^/]+)/datasets/([^/]+)/tables/([^/?]+)", path).groups()
+            return self.response(200, {
+                "tableReference": {"projectId": project, "datasetId": dataset, "tableId": table},
+                "schema": {"fields": [{"name": name, "type": "STRING"} for name in self.columns]},
+            })
+        if method == "POST" and path.startswith("/upload/"):
+            body = data.decode("latin-1") if isinstance(data, bytes) else data
+            resource = json.loads(body[body.index("{"):body.index("\r\n", body.index("{"))])
+            table = resource["configuration"]["load"]["destinationTable"]["tableId"]
+            resource["status"] = {"state": "DONE"}
+            if table in self.failing:
+                resource["status"]["errorResult"] = {"reason": "invalid", "message": "load of {} failed".format(table)}
+            with self.lock:
+                self.jobs[resource["jobReference"]["jobId"]] = resource
+            return self.response(200, resource)
+        if method == "GET" and "/jobs/" in path:
+            return self.response(200, self.jobs[path.rsplit("/", 1)[1]])
+        return self.response(404, {"error": {"code": 404, "message": "{} {} not found".format(method, path)}})
+
+    @staticmethod
+    def response(status, body):
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        return response
@@ -0,0 +1,57 @@
+from datetime import datetime
+import pandas as pd
+from module.aggregation import ReviewAggregator
+from module.sink import LocalSink
+
+JOB_ID = "job"
+
+
+def scraped(app_name, country, ratings, day="2024-03-05"):
+    frame = pd.DataFrame({
+        "job_id": JOB_ID,
+        "date": pd.Timestamp(day),
+        "review": "review",
+        "rating": [float(rating) for rating in ratings],
+        "userName": ["user{}".format(i) for i in range(len(ratings))],
+        "title": "title",
+    })
+    if app_name is not None:
+        frame = frame.assign(app_name=app_name, country=country)
+    return frame
+
+
+def reasons(frame, reason):
+    return frame.assign(review_processed="tidak bisa login", Reason=reason, model_version="v1")
+
+
+def test_rollups_keep_the_scrape_targets_of_a_month_apart(tmp_path):
+    aggregator = ReviewAggregator(sink="local")
+    aggregator.sink = LocalSink(str(tmp_path))
+    aggregator.input_table, aggregator.reason_table = "scraping", "result"
+    aggregator.log_table, aggregator.log_topic_table, aggregator.aggregate_log_table = "log", "topic_log", "aggregate_log"
+    aggregator.rating_table, aggregator.reason_rollup_table, aggregator.token_table = "rating", "reason", "token"
+    aggregator.metrics_table = None
+    aggregator.scrap_config = {"APP_NAME": "jmo", "COUNTRY": "ID", "APP_ID": "1"}
+    created_at = datetime.now()
+    # the same user names on the same day in both targets, the default app partly scraped before the target columns
+    frames = [scraped(None, None, [1, 1]), scraped("jmo", "id", [1]), scraped("other-app", "sg", [2, 4, 4])]
+    for frame in frames:
+        aggregator.sink.write(frame.assign(created_at=created_at), "scraping", JOB_ID, created_at)
+    for frame, reason in zip(frames[1:], ["login", "saldo"]):
+        aggregator.sink.write(reasons(frame, reason).assign(created_at=created_at), "result", JOB_ID, created_at)
+    for table in ("log", "topic_log"):
+        aggregator.sink.write(pd.DataFrame({"created_at": [created_at], "job_id": [JOB_ID]}), table, JOB_ID, created_at)
+    aggregator.sink.flush()
+
+    aggregator.aggregate()
+
+    rating = aggregator.sink.read_partitions("rating").to_pandas()
+    daily = rating[rating["period"] == "day"].groupby(["app_name", "country"])[["period_reviews", "avg_rating"]].first()
+    # user0 of the default app is the same review in both of its parts, user1 only in the first one
+    assert daily.loc[("jmo", "id")].tolist() == [2, 1.0]
+    assert daily.loc[("other-app", "sg")].tolist() == [3, 10 / 3]
+    reason = aggregator.sink.read_partitions("reason").to_pandas()
+    shares = reason[reason["period"] == "week"].set_index(["app_name", "country", "Reason"])["share"].to_dict()
+    assert shares == {("jmo", "id", "login"): 1.0, ("other-app", "sg", "saldo"): 1.0}
+    token = aggregator.sink.read_partitions("token").to_pandas()
+    assert set(zip(token["app_name"], token["country"])) == {("jmo", "id"), ("other-app", "sg")}
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from google.api_core.exceptions import GoogleAPICallError
+from google.auth.credentials import AnonymousCredentials
+from module.bq_connection import BQConnection
+from module.sink import BigQuerySink
+from fake_bigquery import FakeBigQueryHttp
+
+ENDPOINT = "http://bigquery.test"
+CREDENTIALS = AnonymousCredentials()
+CREATED_AT = pd.Timestamp("2024-03-01 07:00:00")
+
+
+def test_shares_one_client_per_credentials_and_project():
+    http = FakeBigQueryHttp(columns=["job_id", "review"])
+    first, second = BQConnection(ENDPOINT, http), BQConnection(ENDPOINT, http)
+
+    assert first.get_client(CREDENTIALS, "project") is second.get_client(CREDENTIALS, "project")
+    assert first.get_client(CREDENTIALS, "project") is not first.get_client(CREDENTIALS, "other")
+    assert second.table_columns("project.dataset.scraping", CREDENTIALS, "project") == ["job_id", "review"]
+    assert http.requests == [("GET", "/bigquery/v2/projects/project/datasets/dataset/tables/scraping")]
+
+
+def test_records_the_latency_of_every_call():
+    bq = BQConnection(ENDPOINT, FakeBigQueryHttp(columns=["job_id"]))
+    for _ in range(3):
+        bq.table_columns("project.dataset.scraping", CREDENTIALS, "project")
+
+    summary = bq.latency_summary()
+    assert list(summary) == ["table_columns"]
+    assert summary["table_columns"]["calls"] == 3
+    assert 0 <= summary["table_columns"]["max"] <= summary["table_columns"]["total"]
+
+
+def test_failed_load_job_is_raised_after_the_other_files_are_released(tmp_path):
+    http = FakeBigQueryHttp(failing=["reasons"])
+    bq = BQConnection(ENDPOINT, http)
+    sink = BigQuerySink(str(tmp_path), bq, {"DB": "dataset", "CRED": CREDENTIALS, "PROJECT": "project"})
+    reviews = sink.write(pd.DataFrame({"review": ["a"]}), "reviews", "job", CREATED_AT)
+    reasons = sink.write(pd.DataFrame({"reason": ["login"]}), "reasons", "job", CREATED_AT)
+    sink.write(pd.DataFrame({"job_id": ["job"]}), "log", "job", CREATED_AT, commit=True)
+
+    with pytest.raises(GoogleAPICallError, match="load of reasons failed"):
+        sink.flush()
+
+    # both data files were uploaded, the log waits for the failed one
+    assert [method for method, _ in http.requests].count("POST") == 2
+    assert [staged.table for staged in sink.pending] == ["reasons", "log"]
+    assert sink.pending[0].path == reasons and (tmp_path / reasons).exists()
+    assert not (tmp_path / reviews).exists()
+    assert bq.latency_summary()["load_files"]["calls"] == 1
@@ -0,0 +1,75 @@
+import os
+import functools
+import pytest
+import requests
+from datetime import datetime
+from module import appstore
+from module.appstore import APPStoreScraper
+from module.scheduler import ScrapeTarget, HostRateLimiter, RateLimitedAppStore
+from module.sink import BigQuerySink
+from fake_app_store import FakeAppStore, PAGE_SIZE
+from fake_bigquery import FakeBigQuery
+
+CONFIG = {"DB": "dataset", "CRED": None, "PROJECT": "project"}
+TARGET = ScrapeTarget("test-app", "id", "1")
+MAX_RETRIES = 2
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    # the scraper spaces and retries its requests on the scale of seconds, the fake store answers at once
+    monkeypatch.setattr(appstore, "HostRateLimiter", functools.partial(HostRateLimiter, min_interval=0.001))
+    monkeypatch.setattr(appstore, "RateLimitedAppStore", functools.partial(RateLimitedAppStore, max_retries=MAX_RETRIES, backoff=0.001))
+
+
+def make_scraper(tmp_path, bq):
+    scraper = APPStoreScraper(datetime(2024, 1, 1))
+    scraper.checkpoint_path = str(tmp_path / "state" / "checkpoint.json")
+    scraper.state_path = str(tmp_path / "state" / "watermark.json")
+    scraper.table, scraper.log_table, scraper.metrics_table = "scraping", "log", None
+    scraper.request_timeout = 0.2
+    scraper.bq = bq
+    scraper.sink = BigQuerySink(str(tmp_path / "sink"), bq, CONFIG)
+    return scraper
+
+
+def test_resume_skips_the_parts_loaded_before_a_failure(tmp_path):
+    # the reviews load but the log does not, the job fails
+    bq = FakeBigQuery(failing=["dataset.log"])
+    with FakeAppStore(pages=3) as store:
+        with pytest.raises(RuntimeError):
+            make_scraper(tmp_path, bq).scrape_targets([TARGET], batch_size=PAGE_SIZE, base_url=store.url)
+        first_requests = len(store.requests)
+        make_scraper(tmp_path, bq).scrape_targets([TARGET], batch_size=PAGE_SIZE, base_url=store.url)
+
+    # the pages were not fetched again and every review was loaded once, in one job
+    assert len(store.requests) == first_requests
+    assert [table_id for table_id, _ in bq.loads] == ["dataset.scraping", "dataset.log"]
+    reviews = bq.loads[0][1]
+    assert len(reviews) == 3 * PAGE_SIZE
+    assert not reviews.duplicated(["userName", "date", "title"]).any()
+    # the checkpoint and the kept parts are gone once the job is done
+    assert not os.path.exists(tmp_path / "state" / "checkpoint.json")
+    assert not [path for path in (tmp_path / "sink" / "scraping").rglob("*") if path.is_file()]
+
+
+def test_resume_fetches_only_the_pages_after_the_checkpoint(tmp_path):
+    bq = FakeBigQuery()
+    failing_offset = 2 * PAGE_SIZE
+    with FakeAppStore(pages=5) as store:
+        # the third page times out on every attempt, the job fails after its retries
+        store.stall(1, times=MAX_RETRIES + 1, offset=failing_offset)
+        with pytest.raises(requests.Timeout):
+            make_scraper(tmp_path, bq).scrape_targets([TARGET], batch_size=PAGE_SIZE, base_url=store.url)
+        first_requests = len(store.requests)
+        assert bq.loads == []
+        make_scraper(tmp_path, bq).scrape_targets([TARGET], batch_size=PAGE_SIZE, base_url=store.url)
+
+    offsets = [offset for _, _, offset, _ in store.requests]
+    assert offsets[:first_requests] == [0, PAGE_SIZE] + [failing_offset] * (MAX_RETRIES + 1)
+    # the rerun starts at the checkpointed offset of the failed page
+    assert offsets[first_requests:] == [failing_offset, 3 * PAGE_SIZE, 4 * PAGE_SIZE]
+    assert [table_id for table_id, _ in bq.loads] == ["dataset.scraping", "dataset.log"]
+    reviews = bq.loads[0][1]
+    assert len(reviews) == 5 * PAGE_SIZE
+    assert not reviews.duplicated(["userName", "date", "title"]).any()
@@ -0,0 +1,18 @@
+import json
+from module.as_config import reason_model
+from module.model_registry import ROOT, load_registry
+from module.model_update import ModelUpdater
+
+
+def test_model_paths_resolve_from_the_repository_root(tmp_path, monkeypatch):
+    registry = tmp_path / "registry.json"
+    registry.write_text(json.dumps({"models": [{"version": "v1", "model": "./lda_model", "reason_map": "model/topic_data_v1.json"}]}))
+    monkeypatch.chdir(tmp_path)
+
+    updater = ModelUpdater(model_path="lda_model", registry=str(registry), sink="local")
+    assert updater.model_path == str(ROOT / "lda_model")
+    assert load_registry(str(registry))[0].model_path == updater.model_path
+    # the base model is found in the registry whatever the spelling of its path
+    assert updater.reason_map() == str(ROOT / "model" / "topic_data_v1.json")
+    assert ModelUpdater(model_path=str(ROOT / "lda_model"), registry=None, sink="local").model_path == updater.model_path
+    assert reason_model.startswith(str(ROOT))
@@ -0,0 +1,24 @@
+from pathlib import Path
+import pytest
+from module.reason_service import ReasonClassifier
+
+ROOT = Path(__file__).parent.parent.resolve()
+REVIEWS = [
+    "tidak bisa login, aplikasi error terus",
+    "saldo jht tidak muncul padahal sudah bayar",
+    "verifikasi wajah gagal berkali kali",
+    "aplikasi lambat dan sering keluar sendiri",
+]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return ReasonClassifier(str(ROOT / "lda_model"), ROOT / "model" / "topic_data.json")
+
+
+def test_review_result_does_not_depend_on_its_batch(classifier):
+    alone = [classifier.classify([review])[0] for review in REVIEWS]
+    # the model random state advances between calls, the seeded inference must not follow it
+    assert classifier.classify(REVIEWS) == alone
+    assert classifier.classify(REVIEWS[::-1]) == alone[::-1]
+    assert classifier.classify(REVIEWS[:1] * 3) == alone[:1] * 3
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+import pandas as pd
+from module.model_registry import ROOT, default_registry
+from module import reason_generation
+from module.reason_generation import NegReasonGeneration
+from module.sink import LocalSink
+
+JOB_ID = "job"
+REVIEWS = ["tidak bisa login", "saldo jht tidak muncul", "aplikasi sering error"]
+
+
+def staged_reviews(country=None):
+    frame = pd.DataFrame({
+        "job_id": JOB_ID,
+        "date": pd.Timestamp("2024-03-01"),
+        "review": REVIEWS,
+        "rating": 1.0,
+        "userName": ["user{}".format(i) for i in range(len(REVIEWS))],
+        "title": "title",
+    })
+    if country is not None:
+        frame = frame.assign(app_name="other-app" if country == "sg" else "jmo", country=country)
+    return frame
+
+
+def staged_job(tmp_path):
+    reason = NegReasonGeneration(token_cache=None, sink="local", registry=None)
+    reason.sink = LocalSink(str(tmp_path))
+    reason.input_table, reason.log_table, reason.log_topic_table, reason.output_table = "scraping", "log", "topic_log", "result"
+    reason.explanation_table = reason.keyword_table = reason.metrics_table = None
+    reason.scrap_config = {"APP_NAME": "jmo", "COUNTRY": "ID", "APP_ID": "1"}
+    reason.models = default_registry(str(ROOT / "lda_model"), ROOT / "model" / "topic_data.json", "v1")
+    created_at = datetime.now()
+    # a part scraped before the target columns existed, then two targets of the same job
+    for frame in (staged_reviews(), staged_reviews("id"), staged_reviews("sg")):
+        reason.sink.write(frame.assign(created_at=created_at), "scraping", JOB_ID, created_at)
+    reason.sink.write(pd.DataFrame({"created_at": [created_at], "job_id": [JOB_ID]}), "log", JOB_ID, created_at)
+    reason.sink.flush()
+    return reason, created_at
+
+
+def result_targets(reason):
+    result = reason.sink.read("result").to_pandas()
+    return result.groupby(["app_name", "country"]).size().to_dict()
+
+
+def test_results_keep_the_scrape_target_of_every_review(tmp_path):
+    reason, _ = staged_job(tmp_path)
+    reason.generate_reason()
+
+    # the reviews scraped without a target belong to the default app
+    assert result_targets(reason) == {("jmo", "id"): 2 * len(REVIEWS), ("other-app", "sg"): len(REVIEWS)}
+
+
+def test_window_results_keep_the_scrape_target_of_every_review(tmp_path):
+    reason, created_at = staged_job(tmp_path)
+    reason.generate_reason_window(created_at - timedelta(days=1), created_at + timedelta(days=1), batch_size=4)
+
+    assert result_targets(reason) == {("jmo", "id"): 2 * len(REVIEWS), ("other-app", "sg"): len(REVIEWS)}
+
+
+def test_window_scores_every_batch_in_one_worker_pool(tmp_path, monkeypatch):
+    pools = []
+
+    class CountingPool(reason_generation.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(reason_generation, "ProcessPoolExecutor", CountingPool)
+    reason, created_at = staged_job(tmp_path)
+    reason.generate_reason_window(created_at - timedelta(days=1), created_at + timedelta(days=1), batch_size=4, workers=2)
+
+    # three batches of the window, one pool shut down once the last one is scored
+    assert len(pools) == 1 and pools[0]._shutdown_thread
+    assert result_targets(reason) == {("jmo", "id"): 2 * len(REVIEWS), ("other-app", "sg"): len(REVIEWS)}
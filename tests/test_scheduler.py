@@ -0,0 +1,97 @@
+import threading
+import pytest
+import requests
+from module.review_stream import iter_pages
+from module.scheduler import ScrapeTarget, HostRateLimiter, RateLimitedAppStore, run_targets
+from fake_app_store import FakeAppStore, PAGE_SIZE
+
+TARGET = ScrapeTarget("test-app", "id", "1")
+
+
+class FakeClock(object):
+    """
+    Monotonic clock only advanced by sleep, so the slots a limiter schedules do not depend on real time
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+class RecordingLimiter(HostRateLimiter):
+    def __init__(self, **options):
+        self.fake_clock = FakeClock()
+        super().__init__(clock=self.fake_clock.monotonic, sleep=self.fake_clock.sleep, **options)
+        self.slots = []
+
+    def wait(self, host):
+        slot = super().wait(host)
+        with self.lock:
+            self.slots.append(slot)
+        return slot
+
+
+def gaps(slots):
+    slots = sorted(slots)
+    return [later - earlier for earlier, later in zip(slots, slots[1:])]
+
+
+def scrape(store, target, limiter, **options):
+    app = RateLimitedAppStore(target, limiter, base_url=store.url, backoff=0.001, **options)
+    return [review for page, _ in iter_pages(app) for review in page]
+
+
+def test_retries_throttled_and_failed_requests():
+    limiter = RecordingLimiter(min_interval=0.01)
+    with FakeAppStore(pages=2) as store:
+        store.fail(429, retry_after=0.3)
+        store.fail(503)
+        reviews = scrape(store, TARGET, limiter)
+
+    assert len(reviews) == 2 * PAGE_SIZE
+    assert [status for _, _, _, status in store.requests] == [429, 503, 200, 200]
+    # the first page is requested again until it is served
+    assert [offset for _, _, offset, _ in store.requests] == [0, 0, 0, PAGE_SIZE]
+    # the landing page, then the throttled review request; Retry-After holds the host back
+    assert gaps(limiter.slots)[1] == pytest.approx(0.3)
+
+
+def test_throttling_widens_the_spacing_of_the_host():
+    limiter = RecordingLimiter(min_interval=0.01, max_interval=0.04)
+    with FakeAppStore(pages=1) as store:
+        store.fail(429, times=3)
+        scrape(store, TARGET, limiter)
+        host = store.url.split("//")[1]
+
+    # landing page, three throttled review requests and the served one: the spacing doubles on every
+    # throttled request, up to max_interval, and shrinks back once the host serves again
+    assert gaps(limiter.slots) == pytest.approx([0.01, 0.01, 0.02, 0.04])
+    assert limiter.interval(host) == pytest.approx(0.036)
+
+
+def test_gives_up_after_max_retries():
+    with FakeAppStore(pages=1) as store:
+        store.fail(500, times=10)
+        with pytest.raises(requests.HTTPError):
+            scrape(store, TARGET, RecordingLimiter(min_interval=0.01), max_retries=2)
+
+    assert [status for _, _, _, status in store.requests] == [500, 500, 500]
+
+
+def test_spaces_concurrent_targets_on_the_same_host():
+    targets = [ScrapeTarget("test-app", country, "1") for country in ("id", "sg", "my")]
+    limiter = RecordingLimiter(min_interval=0.05)
+    with FakeAppStore(pages=3) as store:
+        counts = run_targets(targets, lambda target: len(scrape(store, target, limiter)), concurrency=3)
+
+    assert counts == {target: 3 * PAGE_SIZE for target in targets}
+    assert {path.split("/")[3] for _, path, _, _ in store.requests} == {"id", "sg", "my"}
+    # every request of the three targets, landing pages included, gets its own slot of the host
+    assert len(limiter.slots) == 3 + 3 * 3
+    assert min(gaps(limiter.slots)) >= 0.05 - 1e-9
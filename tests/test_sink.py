@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+from module.sink import BigQuerySink
+from fake_bigquery import FakeBigQuery
+
+CONFIG = {"DB": "dataset", "CRED": None, "PROJECT": "project"}
+CREATED_AT = pd.Timestamp("2024-03-01 07:00:00")
+
+
+def test_loads_the_files_of_a_table_in_one_job(tmp_path):
+    bq = FakeBigQuery()
+    sink = BigQuerySink(str(tmp_path), bq, CONFIG)
+    sink.write(pd.DataFrame({"review": ["a", "b"], "rating": [1, 2]}), "reviews", "job", CREATED_AT)
+    # a part with a missing column and an all-null column
+    sink.write(pd.DataFrame({"review": [None]}), "reviews", "job", CREATED_AT)
+    sink.write(pd.DataFrame({"job_id": ["job"]}), "log", "job", CREATED_AT, commit=True)
+    sink.flush()
+
+    assert [table_id for table_id, _ in bq.loads] == ["dataset.reviews", "dataset.log"]
+    reviews = bq.loads[0][1]
+    assert reviews["review"].tolist() == ["a", "b", None]
+    assert reviews["rating"].tolist()[:2] == [1, 2] and pd.isnull(reviews["rating"].iloc[2])
+    assert sink.pending == []
+    # the loaded files and bundles are removed
+    assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+
+def test_only_the_files_of_failed_jobs_stay_pending(tmp_path):
+    bq = FakeBigQuery(failing=["dataset.reasons"])
+    sink = BigQuerySink(str(tmp_path), bq, CONFIG)
+    sink.write(pd.DataFrame({"review": ["a"]}), "reviews", "job", CREATED_AT)
+    reasons = sink.write(pd.DataFrame({"reason": ["login"]}), "reasons", "job", CREATED_AT)
+    sink.write(pd.DataFrame({"job_id": ["job"]}), "log", "job", CREATED_AT, commit=True)
+    with pytest.raises(RuntimeError):
+        sink.flush()
+
+    assert [table_id for table_id, _ in bq.loads] == ["dataset.reviews"]
+    assert sorted(staged.table for staged in sink.pending) == ["log", "reasons"]
+    # the next part of the job does not take the name of the failed one
+    assert sink.write(pd.DataFrame({"reason": ["saldo"]}), "reasons", "job", CREATED_AT) != reasons
+
+    sink.flush()
+    assert [table_id for table_id, _ in bq.loads] == ["dataset.reviews", "dataset.reasons", "dataset.log"]
+    assert bq.loads[1][1]["reason"].tolist() == ["login", "saldo"]
+    assert sink.pending == []